@@ -0,0 +1,35 @@
+"""Add auth_events keyset indexes
+
+Revision ID: 4c2e9a7b1d35
+Revises: 991bdad85be3
+Create Date: 2026-10-18 09:12:40.118204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4c2e9a7b1d35'
+down_revision: Union[str, Sequence[str], None] = '991bdad85be3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Built concurrently so the audit table stays writable during the upgrade
+    with op.get_context().autocommit_block():
+        op.create_index('ix_auth_events_created_at_id', 'auth_events', ['created_at', 'id'], unique=False, postgresql_concurrently=True)
+        op.create_index('ix_auth_events_user_id_created_at_id', 'auth_events', ['user_id', 'created_at', 'id'], unique=False, postgresql_concurrently=True)
+        op.create_index('ix_auth_events_event_type_created_at_id', 'auth_events', ['event_type', 'created_at', 'id'], unique=False, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_auth_events_event_type_created_at_id', table_name='auth_events', postgresql_concurrently=True)
+        op.drop_index('ix_auth_events_user_id_created_at_id', table_name='auth_events', postgresql_concurrently=True)
+        op.drop_index('ix_auth_events_created_at_id', table_name='auth_events', postgresql_concurrently=True)
@@ -0,0 +1,43 @@
+"""Add pending reaper indexes
+
+Revision ID: a8c4e2f6b913
+Revises: f3a1c7d9e204
+Create Date: 2026-10-18 18:05:12.402917
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a8c4e2f6b913'
+down_revision: Union[str, Sequence[str], None] = 'f3a1c7d9e204'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # CREATE INDEX CONCURRENTLY is not allowed on a partitioned table: create
+    # the parent index on its own (invalid until every partition has one
+    # attached), then build each partition's concurrently and attach it
+    op.execute('CREATE INDEX IF NOT EXISTS ix_auth_events_authenticator_id ON ONLY auth_events (authenticator_id)')
+    partitions = op.get_bind().execute(sa.text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = 'auth_events'::regclass"
+    )).scalars().all()
+    with op.get_context().autocommit_block():
+        op.create_index('ix_authenticators_pending_expiry', 'authenticators', ['provision_token_expires_at'], unique=False, postgresql_where=sa.text("status = 'pending'"), postgresql_concurrently=True)
+        for partition in partitions:
+            op.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {partition}_authenticator_id_idx ON {partition} (authenticator_id)')
+            op.execute(f'ALTER INDEX ix_auth_events_authenticator_id ATTACH PARTITION {partition}_authenticator_id_idx')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # Dropping the parent index drops the attached partition indexes with it
+    op.execute('DROP INDEX IF EXISTS ix_auth_events_authenticator_id')
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_authenticators_pending_expiry', table_name='authenticators', postgresql_concurrently=True)
@@ -0,0 +1,98 @@
+"""Partition auth_events by created_at
+
+Revision ID: b7d3e1f08a62
+Revises: 4c2e9a7b1d35
+Create Date: 2026-10-18 11:03:27.540918
+
+"""
+from datetime import datetime
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.core.config import settings
+from app.services.partitions import next_period, partition_name, period_start
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7d3e1f08a62'
+down_revision: Union[str, Sequence[str], None] = '4c2e9a7b1d35'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+COLUMNS = "id, user_id, authenticator_id, event_type, detail, ip_address, created_at"
+
+INDEXES = [
+    ('ix_auth_events_created_at_id', ['created_at', 'id']),
+    ('ix_auth_events_user_id_created_at_id', ['user_id', 'created_at', 'id']),
+    ('ix_auth_events_event_type_created_at_id', ['event_type', 'created_at', 'id']),
+]
+
+
+def _create_events_table(name: str, partitioned: bool) -> None:
+    op.create_table(name,
+    sa.Column('id', sa.UUID(), nullable=False),
+    sa.Column('user_id', sa.UUID(), nullable=False),
+    sa.Column('authenticator_id', sa.UUID(), nullable=True),
+    sa.Column('event_type', sa.String(), nullable=False),
+    sa.Column('detail', sa.JSON(), nullable=True),
+    sa.Column('ip_address', sa.String(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=not partitioned),
+    sa.ForeignKeyConstraint(['authenticator_id'], ['authenticators.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint(*(['id', 'created_at'] if partitioned else ['id'])),
+    **({'postgresql_partition_by': 'RANGE (created_at)'} if partitioned else {})
+    )
+
+
+def _rename_old_table() -> None:
+    op.rename_table('auth_events', 'auth_events_old')
+    op.execute('ALTER TABLE auth_events_old RENAME CONSTRAINT auth_events_pkey TO auth_events_old_pkey')
+    for name, _ in INDEXES:
+        op.execute(f'ALTER INDEX {name} RENAME TO {name.replace("ix_auth_events", "ix_auth_events_old")}')
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    interval = settings.AUTH_EVENTS_PARTITION_INTERVAL
+    _rename_old_table()
+    _create_events_table('auth_events', partitioned=True)
+
+    # One partition per period from the oldest row through the configured
+    # look-ahead; anything outside lands in the default partition
+    now = datetime.utcnow()
+    oldest = op.get_bind().execute(sa.text('SELECT min(created_at) FROM auth_events_old')).scalar() or now
+    start = period_start(oldest, interval)
+    end = period_start(now, interval)
+    for _ in range(settings.AUTH_EVENTS_PARTITIONS_AHEAD + 1):
+        end = next_period(end, interval)
+    while start < end:
+        upper = next_period(start, interval)
+        op.execute(
+            f"CREATE TABLE {partition_name(start, interval)} PARTITION OF auth_events "
+            f"FOR VALUES FROM ('{start.isoformat(sep=' ')}') TO ('{upper.isoformat(sep=' ')}')"
+        )
+        start = upper
+    op.execute('CREATE TABLE auth_events_default PARTITION OF auth_events DEFAULT')
+
+    op.execute(
+        f"INSERT INTO auth_events ({COLUMNS}) "
+        f"SELECT id, user_id, authenticator_id, event_type, detail, ip_address, "
+        f"COALESCE(created_at, now() AT TIME ZONE 'utc') FROM auth_events_old"
+    )
+    op.drop_table('auth_events_old')
+
+    for name, columns in INDEXES:
+        op.create_index(name, 'auth_events', columns, unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    _rename_old_table()
+    _create_events_table('auth_events', partitioned=False)
+    op.execute(f"INSERT INTO auth_events ({COLUMNS}) SELECT {COLUMNS} FROM auth_events_old")
+    # Dropping the partitioned parent drops every partition with it
+    op.drop_table('auth_events_old')
+    for name, columns in INDEXES:
+        op.create_index(name, 'auth_events', columns, unique=False)
@@ -0,0 +1,41 @@
+"""Add auth event rollups
+
+Revision ID: c2d9f4a7e318
+Revises: a8c4e2f6b913
+Create Date: 2026-10-18 19:41:27.530164
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c2d9f4a7e318'
+down_revision: Union[str, Sequence[str], None] = 'a8c4e2f6b913'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('auth_event_rollups',
+    sa.Column('granularity', sa.String(), nullable=False),
+    sa.Column('bucket_start', sa.DateTime(), nullable=False),
+    sa.Column('event_type', sa.String(), nullable=False),
+    sa.Column('issuer', sa.String(), nullable=False),
+    sa.Column('count', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('granularity', 'bucket_start', 'event_type', 'issuer')
+    )
+    op.create_table('auth_event_rollup_state',
+    sa.Column('name', sa.String(), nullable=False),
+    sa.Column('high_water', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('auth_event_rollup_state')
+    op.drop_table('auth_event_rollups')
@@ -0,0 +1,30 @@
+"""Add partial index for unused backup codes
+
+Revision ID: e5f0a8c3d912
+Revises: b7d3e1f08a62
+Create Date: 2026-10-18 13:41:05.602731
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5f0a8c3d912'
+down_revision: Union[str, Sequence[str], None] = 'b7d3e1f08a62'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.get_context().autocommit_block():
+        op.create_index('ix_backup_codes_unused_lookup', 'backup_codes', ['authenticator_id', 'code_hash'], unique=False, postgresql_where=sa.text('NOT used'), postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_backup_codes_unused_lookup', table_name='backup_codes', postgresql_concurrently=True)
@@ -0,0 +1,45 @@
+"""Add authenticator and backup code lookup indexes
+
+Revision ID: f3a1c7d9e204
+Revises: e5f0a8c3d912
+Create Date: 2026-10-18 16:20:37.914406
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f3a1c7d9e204'
+down_revision: Union[str, Sequence[str], None] = 'e5f0a8c3d912'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Nothing prevented two pending authenticators from both being activated;
+    # keep the most recently updated active one per user so the unique index builds
+    op.execute(
+        "UPDATE authenticators SET status = 'disabled', updated_at = now() "
+        "WHERE status = 'active' AND id NOT IN ("
+        "SELECT DISTINCT ON (user_id) id FROM authenticators WHERE status = 'active' "
+        "ORDER BY user_id, updated_at DESC NULLS LAST, id)"
+    )
+    # Built concurrently so the tables stay writable during the upgrade
+    with op.get_context().autocommit_block():
+        op.create_index('uq_authenticators_user_id_active', 'authenticators', ['user_id'], unique=True, postgresql_where=sa.text("status = 'active'"), postgresql_concurrently=True)
+        op.create_index('ix_authenticators_user_id_status', 'authenticators', ['user_id', 'status'], unique=False, postgresql_concurrently=True)
+        op.create_index('ix_authenticators_provision_token', 'authenticators', ['provision_token'], unique=True, postgresql_concurrently=True)
+        op.create_index('ix_backup_codes_authenticator_id', 'backup_codes', ['authenticator_id'], unique=False, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_backup_codes_authenticator_id', table_name='backup_codes', postgresql_concurrently=True)
+        op.drop_index('ix_authenticators_provision_token', table_name='authenticators', postgresql_concurrently=True)
+        op.drop_index('ix_authenticators_user_id_status', table_name='authenticators', postgresql_concurrently=True)
+        op.drop_index('uq_authenticators_user_id_active', table_name='authenticators', postgresql_concurrently=True)
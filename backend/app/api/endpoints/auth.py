@@ -1,23 +1,70 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Request
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response, status, Request
+from fastapi.responses import StreamingResponse
+from fastapi.sse import EventSourceResponse, ServerSentEvent
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from sqlalchemy import update, desc
+from sqlalchemy.exc import IntegrityError
 from datetime import datetime, timedelta
+import csv
+import functools
+import io
+import json
 import uuid
 from typing import List, Optional
 
-from app.core.database import get_db
+from app.core.database import get_db, AsyncSessionLocal
 from app.models.user import User
 from app.models.authenticator import Authenticator, AuthenticatorStatus, BackupCode
 from app.models.auth_event import AuthEvent
 from app.schemas import auth as schemas
 from app.services.totp import totp_service
-from app.services.encryption import encryption_service
-from app.services.rate_limiter import rate_limit_service
+from app.services.encryption import encryption_service, decrypt_many
+from app.services.cpu_executor import cpu_executor
+from app.services.rate_limiter import rate_limit_service, verify_limits
+from app.services.lockout import lockout_service, lockout_key
+from app.services.idempotency import idempotency_store
+from app.services.single_flight import single_flight
+from app.services.audit import audit_writer, build_audit_query, encode_cursor, naive_utc, AUTH_EVENT_COLUMNS
+from app.services.audit_stream import audit_stream
+from app.services.secret_cache import secret_cache, CachedAuthenticator
+from app.services.backup_codes import backup_code_service
+from app.services.qr import qr_service
+from app.services import provisioning, rollups
 from app.core.config import settings
 
 router = APIRouter()
 
+EXPORT_CHUNK_SIZE = 1000
+
+async def get_active_authenticator(db: AsyncSession, user_id) -> Optional[CachedAuthenticator]:
+    """Load the user's active authenticator, serving repeat lookups from the secret cache"""
+    cached = secret_cache.get(user_id)
+    if cached is not None:
+        return cached
+
+    # Concurrent misses for one user share a single query and decrypt; the
+    # generation keeps a lookup that raced an invalidation from being joined
+    generation = secret_cache.generation
+    return await single_flight.do(
+        ("authenticator", str(user_id), generation),
+        functools.partial(_load_active_authenticator, db, user_id, generation),
+    )
+
+async def _load_active_authenticator(db: AsyncSession, user_id, generation: int) -> Optional[CachedAuthenticator]:
+    result = await db.execute(
+        select(Authenticator.id, Authenticator.status, Authenticator.secret_encrypted)
+        .where(Authenticator.user_id == user_id, Authenticator.status == AuthenticatorStatus.ACTIVE)
+    )
+    row = result.first()
+    if row is None:
+        return None
+
+    secret = encryption_service.decrypt(row.secret_encrypted).decode()
+    entry = CachedAuthenticator(id=row.id, status=row.status, key=totp_service.load_key(secret))
+    secret_cache.set(user_id, entry, generation)
+    return entry
+
 @router.post("/provision", response_model=schemas.AuthenticatorProvisionResponse)
 async def provision_authenticator(
     request: schemas.AuthenticatorProvisionRequest,
@@ -46,6 +93,7 @@ async def provision_authenticator(
     expires_at = datetime.utcnow() + timedelta(minutes=10)
 
     authenticator = Authenticator(
+        id=uuid.uuid4(),
         user_id=user.id,
         secret_encrypted=encrypted_secret,
         display_name=request.display_name,
@@ -57,28 +105,55 @@ async def provision_authenticator(
     db.add(authenticator)
     
     # Log event
-    event = AuthEvent(
+    await audit_writer.record(
+        db,
+        commit=False,
         user_id=user.id,
         event_type="provision_init",
         detail={"authenticator_id": str(authenticator.id)}
     )
-    db.add(event)
     
     await db.commit()
     await db.refresh(authenticator)
+    await secret_cache.invalidate(user.id)
 
-    # Generate URI and QR
+    # Generate URI and QR (rendered in the QR pool, off the event loop)
     uri = totp_service.get_totp_uri(secret, user.email or "user@example.com", request.issuer)
-    qr_svg = totp_service.generate_qr_code(uri)
+    qr_image = await qr_service.render(uri, request.qr_format, request.qr_size)
 
     return schemas.AuthenticatorProvisionResponse(
         secret_base32=secret, # Only shown once!
         otpauth_uri=uri,
-        qr_svg=qr_svg,
+        qr_svg=qr_image if request.qr_format in ("svg", "svg-compact") else None,
+        qr_png=qr_image if request.qr_format == "png" else None,
         provision_token=str(provision_token),
         expires_at=expires_at
     )
 
+@router.post("/provision/bulk", response_model=schemas.BulkProvisionResponse)
+async def provision_bulk(
+    request: schemas.BulkProvisionRequest,
+    db: AsyncSession = Depends(get_db)
+):
+    if len(request.items) > settings.BULK_PROVISION_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail="Batch too large")
+
+    outcomes = await provisioning.provision_bulk(
+        db, [provisioning.ProvisionRecord(**item.model_dump()) for item in request.items]
+    )
+    await db.commit()
+
+    results = []
+    for item, outcome in zip(request.items, outcomes):
+        result = schemas.BulkProvisionResult(user_id=str(outcome.user_id), status=outcome.status, error=outcome.error)
+        if outcome.secret_base32:
+            result.secret_base32 = outcome.secret_base32
+            result.otpauth_uri = totp_service.get_totp_uri(outcome.secret_base32, "user@example.com", item.issuer)
+            result.provision_token = str(outcome.provision_token)
+            result.expires_at = outcome.expires_at
+        results.append(result)
+    return schemas.BulkProvisionResponse(results=results)
+
 @router.post("/verify-setup", response_model=schemas.VerifyResponse)
 async def verify_setup(
     request: schemas.VerifySetupRequest,
@@ -102,13 +177,20 @@ async def verify_setup(
         authenticator.provision_token_expires_at = None
         
         # Log success
-        event = AuthEvent(
+        await audit_writer.record(
+            db,
+            commit=False,
             user_id=authenticator.user_id,
             authenticator_id=authenticator.id,
             event_type="provision_complete"
         )
-        db.add(event)
-        await db.commit()
+        try:
+            await db.commit()
+        except IntegrityError:
+            # Another pending authenticator for this user was activated first
+            await db.rollback()
+            raise HTTPException(status_code=409, detail="User already has an active authenticator")
+        await secret_cache.invalidate(authenticator.user_id)
         return schemas.VerifyResponse(verified=True, timestamp=datetime.utcnow())
     else:
         return schemas.VerifyResponse(verified=False, error="Invalid code")
@@ -117,104 +199,182 @@ async def verify_setup(
 async def verify_totp(
     request: schemas.VerifyRequest,
     req: Request,
-    db: AsyncSession = Depends(get_db)
+    response: Response,
+    db: AsyncSession = Depends(get_db),
+    idempotency_key: Optional[str] = Header(None, max_length=255),
 ):
-    # Rate Limit
+    return await idempotency_store.run(
+        "verify", request.user_id, idempotency_key, request, response,
+        functools.partial(_verify_totp, request, req, db),
+    )
+
+async def _verify_totp(request: schemas.VerifyRequest, req: Request, db: AsyncSession) -> schemas.VerifyResponse:
+    # Rate Limit: per-user and per-IP budgets and the user's lockout checked in one script call
     client_ip = request.client_ip or req.client.host
-    await rate_limit_service.check_rate_limit(f"verify:{request.user_id}", limit=5, window=300)
+    user_lockout = lockout_key(request.user_id) if settings.LOCKOUT_ENABLED else None
+    limit = await rate_limit_service.check(verify_limits(request.user_id, client_ip), user_lockout)
 
-    result = await db.execute(select(Authenticator).where(Authenticator.user_id == request.user_id, Authenticator.status == AuthenticatorStatus.ACTIVE))
-    authenticator = result.scalars().first()
+    authenticator = await get_active_authenticator(db, request.user_id)
     
     if not authenticator:
         raise HTTPException(status_code=404, detail="No active authenticator found")
 
-    secret = encryption_service.decrypt(authenticator.secret_encrypted).decode()
-    
-    if totp_service.verify_code(secret, request.code):
-        event = AuthEvent(
+    if totp_service.verify_key(authenticator.key, request.code):
+        await audit_writer.record(
+            db,
             user_id=request.user_id,
             authenticator_id=authenticator.id,
             event_type="verify_success",
             ip_address=client_ip
         )
-        db.add(event)
-        await db.commit()
+        if user_lockout:
+            await lockout_service.record_success(request.user_id, limit.failures)
         return schemas.VerifyResponse(verified=True, timestamp=datetime.utcnow())
     else:
-        event = AuthEvent(
+        await audit_writer.record(
+            db,
             user_id=request.user_id,
             authenticator_id=authenticator.id,
             event_type="verify_fail",
             ip_address=client_ip
         )
-        db.add(event)
-        await db.commit()
-        return schemas.VerifyResponse(verified=False, error="Invalid code", retry_after_seconds=30)
+        locked_for = await lockout_service.record_failure(request.user_id) if user_lockout else 0
+        return schemas.VerifyResponse(verified=False, error="Invalid code", retry_after_seconds=max(limit.retry_after, locked_for))
+
+@router.post("/verify/batch", response_model=schemas.BatchVerifyResponse)
+async def verify_totp_batch(
+    request: schemas.BatchVerifyRequest,
+    req: Request,
+    db: AsyncSession = Depends(get_db)
+):
+    if len(request.items) > settings.VERIFY_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail="Batch too large")
+
+    results = [schemas.BatchVerifyResult(user_id=str(item.user_id), verified=False) for item in request.items]
+    if not request.items:
+        return schemas.BatchVerifyResponse(results=results, timestamp=datetime.utcnow())
+
+    # Rate limit and lockout check every item in one pipelined round trip
+    limits = await rate_limit_service.hit_many(
+        [verify_limits(item.user_id, item.client_ip or req.client.host) for item in request.items],
+        [lockout_key(item.user_id) for item in request.items] if settings.LOCKOUT_ENABLED else None,
+    )
+
+    pending = []
+    user_ids = set()
+    for index, item in enumerate(request.items):
+        results[index].retry_after_seconds = limits[index].retry_after
+        if not limits[index].allowed:
+            results[index].error = "Too many failed attempts" if limits[index].locked else "Rate limit exceeded"
+            continue
+        pending.append((index, item.user_id))
+        user_ids.add(item.user_id)
+
+    # Serve what we can from the secret cache, then one query for the rest
+    authenticators = {}
+    missing = []
+    for user_id in user_ids:
+        cached = secret_cache.get(user_id)
+        if cached is not None:
+            authenticators[user_id] = cached
+        else:
+            missing.append(user_id)
+
+    if missing:
+        generation = secret_cache.generation
+        result = await db.execute(
+            select(Authenticator.id, Authenticator.user_id, Authenticator.status, Authenticator.secret_encrypted)
+            .where(Authenticator.user_id.in_(missing), Authenticator.status == AuthenticatorStatus.ACTIVE)
+        )
+        rows = result.all()
+        secrets = await cpu_executor.run_batch("decrypt_batch", len(rows), decrypt_many, [row.secret_encrypted for row in rows])
+        for row, secret in zip(rows, secrets):
+            entry = CachedAuthenticator(id=row.id, status=row.status, key=totp_service.load_key(secret.decode()))
+            secret_cache.set(row.user_id, entry, generation)
+            authenticators[row.user_id] = entry
+
+    checks = []
+    for index, user_id in pending:
+        if user_id not in authenticators:
+            results[index].error = "No active authenticator found"
+            continue
+        checks.append((index, user_id))
+
+    # Loaded keys hold HMAC state, so only a thread pool can take this off the loop
+    verified = await cpu_executor.run_batch(
+        "totp_verify_batch", len(checks), totp_service.verify_codes_batch,
+        [(authenticators[user_id].key, request.items[index].code) for index, user_id in checks],
+        picklable=False,
+    )
+
+    events = []
+    for (index, user_id), ok in zip(checks, verified):
+        item = request.items[index]
+        results[index].verified = ok
+        if not ok:
+            results[index].error = "Invalid code"
+        events.append(audit_writer.build_event(
+            user_id=user_id,
+            authenticator_id=authenticators[user_id].id,
+            event_type="verify_success" if ok else "verify_fail",
+            ip_address=item.client_ip or req.client.host,
+        ))
+
+    # Single multi-row INSERT (or one enqueue) for the whole batch
+    await audit_writer.record_many(db, events)
+
+    if settings.LOCKOUT_ENABLED and checks:
+        locks = await lockout_service.record_many([
+            (user_id, ok, limits[index].failures) for (index, user_id), ok in zip(checks, verified)
+        ])
+        for (index, _), locked_for in zip(checks, locks):
+            results[index].retry_after_seconds = max(results[index].retry_after_seconds or 0, locked_for)
+
+    return schemas.BatchVerifyResponse(results=results, timestamp=datetime.utcnow())
 
 @router.post("/backup-codes/generate", response_model=schemas.BackupCodeResponse)
 async def generate_backup_codes(
     request: schemas.BackupCodeGenerateRequest,
     db: AsyncSession = Depends(get_db)
 ):
-    result = await db.execute(select(Authenticator).where(Authenticator.user_id == request.user_id, Authenticator.status == AuthenticatorStatus.ACTIVE))
-    authenticator = result.scalars().first()
+    authenticator = await get_active_authenticator(db, request.user_id)
     
     if not authenticator:
         raise HTTPException(status_code=404, detail="No active authenticator found")
 
-    # Invalidate old codes
-    await db.execute(select(BackupCode).where(BackupCode.authenticator_id == authenticator.id).execution_options(synchronize_session=False))
-    # Actually we should delete them
-    # For now, let's just create new ones and maybe delete old ones if we want to enforce single set
-    
-    codes = []
-    plain_codes = []
-    for _ in range(10):
-        code = totp_service.generate_secret()[:8] # Simple 8 char code
-        plain_codes.append(code)
-        # Hash code (using simple hash for demo, should be argon2)
-        import hashlib
-        code_hash = hashlib.sha256(code.encode()).hexdigest()
-        
-        backup_code = BackupCode(
-            authenticator_id=authenticator.id,
-            code_hash=code_hash
-        )
-        db.add(backup_code)
-    
+    # Old codes are deleted and the new set inserted in the same transaction
+    plain_codes = await backup_code_service.regenerate(db, authenticator.id)
     await db.commit()
     return schemas.BackupCodeResponse(backup_codes=plain_codes)
 
 @router.post("/verify-backup", response_model=schemas.VerifyResponse)
 async def verify_backup_code(
     request: schemas.BackupVerifyRequest,
-    db: AsyncSession = Depends(get_db)
+    response: Response,
+    db: AsyncSession = Depends(get_db),
+    idempotency_key: Optional[str] = Header(None, max_length=255),
 ):
-    result = await db.execute(select(Authenticator).where(Authenticator.user_id == request.user_id, Authenticator.status == AuthenticatorStatus.ACTIVE))
-    authenticator = result.scalars().first()
+    return await idempotency_store.run(
+        "verify-backup", request.user_id, idempotency_key, request, response,
+        functools.partial(_verify_backup_code, request, db),
+    )
+
+async def _verify_backup_code(request: schemas.BackupVerifyRequest, db: AsyncSession) -> schemas.VerifyResponse:
+    authenticator = await get_active_authenticator(db, request.user_id)
     
     if not authenticator:
         raise HTTPException(status_code=404, detail="No active authenticator found")
 
-    # Check all unused codes
-    result = await db.execute(select(BackupCode).where(BackupCode.authenticator_id == authenticator.id, BackupCode.used == False))
-    codes = result.scalars().all()
-    
-    import hashlib
-    input_hash = hashlib.sha256(request.backup_code.encode()).hexdigest()
-    
-    for code in codes:
-        if code.code_hash == input_hash:
-            code.used = True
-            event = AuthEvent(
-                user_id=request.user_id,
-                authenticator_id=authenticator.id,
-                event_type="backup_used"
-            )
-            db.add(event)
-            await db.commit()
-            return schemas.VerifyResponse(verified=True, timestamp=datetime.utcnow())
+    if await backup_code_service.consume(db, authenticator.id, request.backup_code):
+        await audit_writer.record(
+            db,
+            commit=False,
+            user_id=request.user_id,
+            authenticator_id=authenticator.id,
+            event_type="backup_used"
+        )
+        await db.commit()
+        return schemas.VerifyResponse(verified=True, timestamp=datetime.utcnow())
             
     return schemas.VerifyResponse(verified=False, error="Invalid backup code")
 
@@ -231,27 +391,137 @@ async def disable_authenticator(
 
     authenticator.status = AuthenticatorStatus.DISABLED
     
-    event = AuthEvent(
+    await audit_writer.record(
+        db,
+        commit=False,
         user_id=request.user_id,
         authenticator_id=authenticator.id,
         event_type="disabled"
     )
-    db.add(event)
     await db.commit()
+    await secret_cache.invalidate(request.user_id)
     
     return schemas.VerifyResponse(verified=True, timestamp=datetime.utcnow())
 
-@router.get("/admin/audit")
+@router.get("/admin/audit", response_model=schemas.AuditLogPage)
 async def get_audit_logs(
-    user_id: Optional[str] = None,
-    limit: int = 50,
-    offset: int = 0,
+    user_id: Optional[uuid.UUID] = None,
+    event_type: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=500),
     db: AsyncSession = Depends(get_db)
 ):
-    query = select(AuthEvent).order_by(desc(AuthEvent.created_at)).limit(limit).offset(offset)
-    if user_id:
-        query = query.where(AuthEvent.user_id == user_id)
-        
-    result = await db.execute(query)
-    events = result.scalars().all()
-    return events
+    # Plain rows of just the response columns; no identity map or ORM state
+    columns = [getattr(AuthEvent, name) for name in AUTH_EVENT_COLUMNS]
+    try:
+        query = build_audit_query(*columns, user_id=user_id, event_type=event_type, since=since, until=until, cursor=cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    # Fetch one extra row to know whether another page exists
+    result = await db.execute(query.limit(limit + 1))
+    events = result.all()
+    next_cursor = None
+    if len(events) > limit:
+        events = events[:limit]
+        next_cursor = encode_cursor(events[-1].created_at, events[-1].id)
+    return {"items": events, "next_cursor": next_cursor}
+
+@router.get("/admin/audit/export")
+async def export_audit_logs(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    user_id: Optional[uuid.UUID] = None,
+    event_type: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+):
+    columns = [getattr(AuthEvent, name) for name in AUTH_EVENT_COLUMNS]
+    query = build_audit_query(*columns, user_id=user_id, event_type=event_type, since=since, until=until)
+
+    async def rows():
+        # Own session: the stream outlives the request-scoped dependency
+        async with AsyncSessionLocal() as session:
+            result = await session.stream(query.execution_options(yield_per=EXPORT_CHUNK_SIZE))
+            if format == "csv":
+                yield _csv_chunk([AUTH_EVENT_COLUMNS])
+            async for chunk in result.partitions():
+                if format == "csv":
+                    yield _csv_chunk(
+                        [json.dumps(value) if name == "detail" and value is not None else value
+                         for name, value in zip(AUTH_EVENT_COLUMNS, row)]
+                        for row in chunk
+                    )
+                else:
+                    yield "".join(
+                        json.dumps(dict(zip(AUTH_EVENT_COLUMNS, row)), default=_json_default) + "\n" for row in chunk
+                    )
+
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        rows(),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename=auth_events.{format}"},
+    )
+
+async def audit_stream_subscription(user_id: Optional[uuid.UUID] = None, event_type: Optional[str] = None):
+    # A dependency, so the capacity check can still answer 503 before the stream starts
+    subscription = audit_stream.subscribe(user_id=user_id, event_type=event_type)
+    if subscription is None:
+        raise HTTPException(status_code=503, detail="Too many audit stream clients", headers={"Retry-After": "5"})
+    try:
+        yield subscription
+    finally:
+        audit_stream.unsubscribe(subscription)
+
+@router.get("/admin/audit/stream", response_class=EventSourceResponse)
+async def stream_audit_logs(subscription=Depends(audit_stream_subscription)):
+    """
+    New audit events as they are committed, as "audit" events carrying the
+    /admin/audit item JSON. A reader too slow for its buffer gets an
+    "overflow" event with the number of events it missed.
+    """
+    while True:
+        line = await subscription.get()
+        if line is None:
+            return
+        dropped = subscription.take_dropped()
+        if dropped:
+            yield ServerSentEvent(event="overflow", data={"dropped": dropped})
+        yield ServerSentEvent(event="audit", raw_data=line)
+
+def _json_default(value):
+    return value.isoformat() if isinstance(value, datetime) else str(value)
+
+def _csv_chunk(rows) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue()
+
+@router.get("/admin/stats", response_model=schemas.AuditStatsResponse)
+async def get_audit_stats(
+    granularity: str = Query("minute", pattern="^(minute|day)$"),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    event_type: Optional[str] = None,
+    issuer: Optional[str] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    """Event counts over time from the rollups; defaults to the last hour by minute or 30 days by day"""
+    until = naive_utc(until) if until else datetime.utcnow()
+    since = naive_utc(since) if since else until - (timedelta(hours=1) if granularity == "minute" else timedelta(days=30))
+    if since >= until:
+        raise HTTPException(status_code=400, detail="since must be before until")
+    if (until - since) / rollups.GRANULARITIES[granularity] > settings.AUDIT_STATS_MAX_BUCKETS:
+        raise HTTPException(status_code=400, detail="Range has too many buckets for this granularity")
+    return await rollups.query_stats(db, granularity, since, until, event_type=event_type, issuer=issuer)
+
+@router.get("/admin/cache")
+async def get_cache_stats():
+    return {
+        **secret_cache.stats(),
+        "single_flight": single_flight.stats(),
+        "idempotency": idempotency_store.stats(),
+        "cpu_executor": cpu_executor.stats(),
+    }
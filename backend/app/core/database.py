@@ -1,8 +1,23 @@
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker, declarative_base
 from app.core.config import settings
+from app.core.metrics import instrument_engine
 
-engine = create_async_engine(settings.DATABASE_URL, echo=True)
+def engine_options() -> dict:
+    """Pool settings for server databases; SQLite keeps the pool SQLAlchemy picks for it"""
+    if make_url(settings.DATABASE_URL).get_backend_name() == "sqlite":
+        return {}
+    return {
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT_SECONDS,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+        "pool_recycle": settings.DB_POOL_RECYCLE_SECONDS,
+    }
+
+engine = create_async_engine(settings.DATABASE_URL, echo=settings.DB_ECHO, **engine_options())
+instrument_engine(engine.sync_engine)
 
 AsyncSessionLocal = sessionmaker(
     engine, class_=AsyncSession, expire_on_commit=False
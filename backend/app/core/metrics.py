@@ -0,0 +1,286 @@
+import bisect
+import contextvars
+import functools
+import json
+import logging
+import random
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from app.core.config import settings
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: Sequence[str], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values: Dict[Tuple, object] = {}
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        return [f"{self.name}{_labels(self.labelnames, labels)} {value}" for labels, value in self.values.items()]
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, *labels):
+        self.values[labels] = value
+
+    def inc(self, *labels, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    def get(self, *labels) -> float:
+        return self.values.get(labels, 0)
+
+    def render(self) -> List[str]:
+        return [f"{self.name}{_labels(self.labelnames, labels)} {value}" for labels, value in self.values.items()]
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels):
+        # Per-bucket counts (made cumulative when rendered), then sum and count
+        series = self.values.get(labels)
+        if series is None:
+            series = self.values[labels] = [0] * (len(self.buckets) + 3)
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    @contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def render(self) -> List[str]:
+        lines = []
+        for labels, series in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                bucket = 'le="' + le + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, bucket)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {series[-2]}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {series[-1]}")
+        return lines
+
+class Registry:
+    """Holds metrics and renders them in the Prometheus text format"""
+
+    def __init__(self):
+        self.metrics: List[Metric] = []
+        self.collectors: List[Callable[[], None]] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def on_collect(self, collector: Callable[[], None]):
+        """Run collector before every render, e.g. to refresh gauges from service stats"""
+        self.collectors.append(collector)
+        return collector
+
+    def render(self) -> str:
+        for collector in self.collectors:
+            try:
+                collector()
+            except Exception:
+                logging.getLogger(__name__).warning("Metrics collector failed", exc_info=True)
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.header())
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+HTTP_REQUEST_SECONDS = registry.register(Histogram(
+    "http_request_duration_seconds", "Request latency by route template", ("method", "route", "status"),
+))
+HTTP_REQUESTS_IN_FLIGHT = registry.register(Gauge(
+    "http_requests_in_flight", "Requests currently being served by this worker",
+))
+DB_QUERIES_PER_REQUEST = registry.register(Histogram(
+    "db_queries_per_request", "SQL statements issued while serving one request", ("route",), buckets=COUNT_BUCKETS,
+))
+DB_QUERY_SECONDS = registry.register(Histogram(
+    "db_query_duration_seconds", "SQL statement latency by statement type", ("operation",),
+))
+REDIS_SECONDS = registry.register(Histogram(
+    "redis_call_duration_seconds", "Redis round trips made by services", ("operation",),
+))
+REDIS_ERRORS = registry.register(Counter(
+    "redis_errors_total", "Redis calls that failed or timed out", ("operation",),
+))
+CRYPTO_SECONDS = registry.register(Histogram(
+    "crypto_operation_duration_seconds", "TOTP and encryption time", ("operation",),
+))
+LOCKOUT_EVENTS = registry.register(Counter(
+    "lockout_events_total", "Verify failures counted, locks applied, resets and rows written behind", ("event",),
+))
+CPU_QUEUE_SECONDS = registry.register(Histogram(
+    "cpu_executor_queue_wait_seconds", "Time CPU-bound calls waited for an executor worker", ("operation",),
+))
+CPU_RUN_SECONDS = registry.register(Histogram(
+    "cpu_executor_run_seconds", "Time CPU-bound calls ran on an executor worker", ("operation",),
+))
+CPU_EXECUTOR_PENDING = registry.register(Gauge(
+    "cpu_executor_pending", "Calls queued or running on the CPU executor",
+))
+CPU_EXECUTOR_REJECTED = registry.register(Counter(
+    "cpu_executor_rejected_total", "Calls turned away because the CPU executor queue was full", ("operation",),
+))
+REAPER_ROWS = registry.register(Counter(
+    "reaper_rows_total", "Rows the pending authenticator reaper deleted or detached", ("table", "action"),
+))
+REAPER_BATCH_SECONDS = registry.register(Histogram(
+    "reaper_batch_duration_seconds", "Time each reaper batch transaction was open",
+))
+SERVICE_STATS = registry.register(Gauge(
+    "service_stats", "Counters and sizes reported by in-process services", ("service", "stat"),
+))
+
+def timed(histogram: Histogram, *labels):
+    """Decorator recording a sync function's run time in histogram"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started, *labels)
+        return wrapper
+    return decorator
+
+class RequestStats:
+    __slots__ = ("scope", "queries", "db_seconds")
+
+    def __init__(self, scope: dict):
+        self.scope = scope
+        self.queries = 0
+        self.db_seconds = 0.0
+
+    @property
+    def route(self) -> str:
+        """The matched path with parameter values put back as {name}"""
+        if self.scope.get("route") is None:
+            return "unmatched"
+        params = {str(value): name for name, value in self.scope.get("path_params", {}).items()}
+        return "/".join(f"{{{params[part]}}}" if part in params else part for part in self.scope["path"].split("/"))
+
+_request_stats: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar("request_stats", default=None)
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware timing each request under its route template, so
+    path parameters do not blow up label cardinality. Unmatched paths share
+    one label.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(scope)
+        token = _request_stats.set(stats)
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        HTTP_REQUESTS_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_REQUESTS_IN_FLIGHT.dec()
+            route = stats.route
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, scope["method"], route, status_code)
+            DB_QUERIES_PER_REQUEST.observe(stats.queries, route)
+            _request_stats.reset(token)
+
+slow_query_logger = logging.getLogger("app.slow_query")
+
+def instrument_engine(sync_engine):
+    """
+    Time every statement on the engine. Statements slower than
+    DB_SLOW_QUERY_MS are logged as one JSON line each, sampled at
+    DB_SLOW_QUERY_SAMPLE_RATE; parameters are never logged.
+    """
+    from sqlalchemy import event
+
+    threshold = settings.DB_SLOW_QUERY_MS / 1000
+    sample_rate = settings.DB_SLOW_QUERY_SAMPLE_RATE
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+        DB_QUERY_SECONDS.observe(elapsed, operation)
+
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_seconds += elapsed
+
+        if threshold >= 0 and elapsed >= threshold and random.random() < sample_rate:
+            slow_query_logger.warning(json.dumps({
+                "event": "slow_query",
+                "duration_ms": round(elapsed * 1000, 3),
+                "operation": operation,
+                "route": stats.route if stats is not None else None,
+                "executemany": executemany,
+                "statement": " ".join(statement.split())[:2000],
+            }))
+
+    @event.listens_for(sync_engine, "handle_error")
+    def handle_error(context):
+        started = context.connection.info.get("query_started") if context.connection is not None else None
+        if started:
+            started.pop()
@@ -0,0 +1,6 @@
+import redis.asyncio as redis
+from app.core.config import settings
+
+redis_client = redis.from_url(
+    settings.REDIS_URL, encoding="utf-8", decode_responses=True, max_connections=settings.REDIS_MAX_CONNECTIONS
+)
@@ -1,5 +1,59 @@
+import asyncio
+import contextlib
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
+
+from app.core.config import settings
+from app.core.metrics import MetricsMiddleware, SERVICE_STATS, registry
+from app.services.audit import audit_writer
+from app.services.audit_stream import audit_stream
+from app.services.cpu_executor import cpu_executor
+from app.services.idempotency import idempotency_store
+from app.services.lifecycle import lifecycle
+from app.services.lockout import lockout_service
+from app.services.partitions import maintenance_loop
+from app.services.rate_limiter import rate_limit_service
+from app.services.reaper import reaper_loop
+from app.services.rollups import rollup_loop
+from app.services.secret_cache import secret_cache
+from app.services.single_flight import single_flight
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Startup
+    background = [
+        asyncio.create_task(secret_cache.listen()),
+        asyncio.create_task(rate_limit_service.sync_loop(settings.RATE_LIMIT_LOCAL_SYNC_SECONDS)),
+    ]
+    if settings.AUTH_EVENTS_PARTITION_MAINTENANCE_SECONDS > 0:
+        background.append(asyncio.create_task(maintenance_loop(settings.AUTH_EVENTS_PARTITION_MAINTENANCE_SECONDS)))
+    if settings.AUDIT_ROLLUP_INTERVAL_SECONDS > 0:
+        background.append(asyncio.create_task(rollup_loop(settings.AUDIT_ROLLUP_INTERVAL_SECONDS)))
+    if settings.PENDING_REAPER_INTERVAL_SECONDS > 0:
+        background.append(asyncio.create_task(reaper_loop(settings.PENDING_REAPER_INTERVAL_SECONDS)))
+    if settings.LOCKOUT_ENABLED and settings.LOCKOUT_WRITE_BEHIND_SECONDS > 0:
+        background.append(asyncio.create_task(lockout_service.write_behind_loop(settings.LOCKOUT_WRITE_BEHIND_SECONDS)))
+    await audit_writer.start()
+    await lifecycle.start()
+    background.append(asyncio.create_task(lifecycle.retry_loop(settings.WARMUP_RETRY_SECONDS)))
+    lifecycle.install_signal_handlers()
+    yield
+    # Shutdown: uvicorn has already stopped accepting and waited for
+    # in-flight requests; flush what they queued, then close pools
+    audit_stream.close()
+    await audit_writer.stop(timeout=settings.AUDIT_SHUTDOWN_TIMEOUT_SECONDS)
+    for task in background:
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+    if settings.LOCKOUT_ENABLED:
+        with contextlib.suppress(Exception):
+            await lockout_service.flush_all()
+    cpu_executor.shutdown()
+    await lifecycle.close()
 
 app = FastAPI(
     title="Custom Authenticator API",
@@ -7,6 +61,7 @@ app = FastAPI(
     version="1.0.0",
     docs_url="/docs",
     redoc_url="/redoc",
+    lifespan=lifespan,
 )
 
 # CORS Configuration
@@ -22,9 +77,25 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Outermost, so the timing covers CORS handling too
+app.add_middleware(MetricsMiddleware)
+
+@registry.on_collect
+def collect_service_stats():
+    for service, stats in (
+        ("secret_cache", secret_cache.stats()),
+        ("single_flight", single_flight.stats()),
+        ("idempotency", idempotency_store.stats()),
+        ("cpu_executor", cpu_executor.stats()),
+        ("rate_limiter_local", rate_limit_service.local.stats()),
+        ("audit_writer", audit_writer.stats()),
+        ("audit_stream", audit_stream.stats()),
+    ):
+        for stat, value in stats.items():
+            if isinstance(value, (int, float)):
+                SERVICE_STATS.set(float(value), service, stat)
 
 from app.api.api import api_router
-from app.core.config import settings
 
 app.include_router(api_router, prefix=settings.API_V1_STR)
 
@@ -35,3 +106,18 @@ async def root():
 @app.get("/healthz")
 async def health_check():
     return {"status": "ok"}
+
+@app.get("/readyz")
+async def readiness_check():
+    """503 until warmup has finished, while the database or Redis is unreachable, and from SIGTERM on"""
+    if lifecycle.ready:
+        return {"status": "ready"}
+    if lifecycle.draining:
+        return JSONResponse({"status": "draining"}, status_code=503)
+    if lifecycle.started:
+        return JSONResponse({"status": "degraded", "failed": sorted(lifecycle.failed)}, status_code=503)
+    return JSONResponse({"status": "starting"}, status_code=503)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
@@ -2,3 +2,4 @@ from app.core.database import Base
 from app.models.user import User
 from app.models.authenticator import Authenticator, BackupCode
 from app.models.auth_event import AuthEvent
+from app.models.audit_rollup import AuditRollup, AuditRollupState
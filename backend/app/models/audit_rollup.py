@@ -0,0 +1,20 @@
+from sqlalchemy import BigInteger, Column, DateTime, String
+from app.core.database import Base
+
+class AuditRollup(Base):
+    """Event counts per time bucket, maintained by app.services.rollups"""
+    __tablename__ = "auth_event_rollups"
+
+    # The primary key order serves /admin/stats: one granularity, a bucket range
+    granularity = Column(String, primary_key=True) # "minute" or "day"
+    bucket_start = Column(DateTime, primary_key=True)
+    event_type = Column(String, primary_key=True)
+    issuer = Column(String, primary_key=True, default="") # "" when the event has no authenticator
+    count = Column(BigInteger, nullable=False, default=0)
+
+class AuditRollupState(Base):
+    __tablename__ = "auth_event_rollup_state"
+
+    name = Column(String, primary_key=True)
+    # Events created before this are counted in the rollups
+    high_water = Column(DateTime, nullable=False)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, ForeignKey, DateTime, JSON
+from sqlalchemy import Column, String, ForeignKey, DateTime, JSON, Index
 from sqlalchemy.dialects.postgresql import UUID
 import uuid
 from datetime import datetime
@@ -6,6 +6,16 @@ from app.core.database import Base
 
 class AuthEvent(Base):
     __tablename__ = "auth_events"
+    __table_args__ = (
+        # Keyset pagination on (created_at, id), optionally narrowed by user or type
+        Index("ix_auth_events_created_at_id", "created_at", "id"),
+        Index("ix_auth_events_user_id_created_at_id", "user_id", "created_at", "id"),
+        Index("ix_auth_events_event_type_created_at_id", "event_type", "created_at", "id"),
+        # Serves the foreign key check when authenticators are deleted
+        Index("ix_auth_events_authenticator_id", "authenticator_id"),
+        # Range-partitioned on Postgres; see app.services.partitions for maintenance
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
@@ -13,4 +23,5 @@ class AuthEvent(Base):
     event_type = Column(String, nullable=False) # provision, verify_success, verify_fail, etc.
     detail = Column(JSON, nullable=True)
     ip_address = Column(String, nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    # Part of the primary key because Postgres requires the partition key in it
+    created_at = Column(DateTime, primary_key=True, default=datetime.utcnow)
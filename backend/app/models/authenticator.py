@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Boolean, ForeignKey, DateTime, Integer, LargeBinary, Enum
+from sqlalchemy import Column, String, Boolean, ForeignKey, DateTime, Integer, LargeBinary, Enum, Index, text
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 import uuid
@@ -13,6 +13,22 @@ class AuthenticatorStatus(str, enum.Enum):
 
 class Authenticator(Base):
     __tablename__ = "authenticators"
+    __table_args__ = (
+        # At most one active authenticator per user
+        Index(
+            "uq_authenticators_user_id_active", "user_id", unique=True,
+            postgresql_where=text("status = 'active'"), sqlite_where=text("status = 'active'"),
+        ),
+        # Serves the (user_id, status) lookups; unlike the partial index it is
+        # also usable from generic plans where status is a bound parameter
+        Index("ix_authenticators_user_id_status", "user_id", "status"),
+        Index("ix_authenticators_provision_token", "provision_token", unique=True),
+        # Lets the reaper find expired pending rows without scanning the table
+        Index(
+            "ix_authenticators_pending_expiry", "provision_token_expires_at",
+            postgresql_where=text("status = 'pending'"), sqlite_where=text("status = 'pending'"),
+        ),
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
@@ -33,6 +49,15 @@ class Authenticator(Base):
 
 class BackupCode(Base):
     __tablename__ = "backup_codes"
+    __table_args__ = (
+        # Serves the consume lookup; used codes drop out of the index
+        Index(
+            "ix_backup_codes_unused_lookup", "authenticator_id", "code_hash",
+            postgresql_where=text("NOT used"), sqlite_where=text("NOT used"),
+        ),
+        # Serves regenerate's DELETE and the cascade from authenticators
+        Index("ix_backup_codes_authenticator_id", "authenticator_id"),
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     authenticator_id = Column(UUID(as_uuid=True), ForeignKey("authenticators.id"), nullable=False)
@@ -1,5 +1,5 @@
-from pydantic import BaseModel, EmailStr
-from typing import Optional, List
+from pydantic import BaseModel, ConfigDict, EmailStr, Field
+from typing import Any, Dict, Optional, List, Literal
 from datetime import datetime
 from uuid import UUID
 
@@ -8,24 +8,50 @@ class UserCreate(BaseModel):
     email: Optional[EmailStr] = None
     username: Optional[str] = None
 
+QRFormat = Literal["svg", "svg-compact", "png", "none"]
+
 class AuthenticatorProvisionRequest(BaseModel):
-    user_id: str
+    user_id: UUID
     display_name: Optional[str] = "User"
     issuer: Optional[str] = "CustomAuthenticator"
+    qr_format: QRFormat = "svg" # "none" skips rendering for API-only integrators
+    qr_size: int = Field(10, ge=1, le=40) # Pixels per QR module
 
 class AuthenticatorProvisionResponse(BaseModel):
     secret_base32: str
     otpauth_uri: str
-    qr_svg: str
+    qr_svg: Optional[str] = None # For "svg" and "svg-compact"
+    qr_png: Optional[str] = None # data: URI for "png"
     provision_token: str
     expires_at: datetime
 
+class BulkProvisionItem(BaseModel):
+    user_id: UUID
+    secret_base32: Optional[str] = None # Existing secret to import as active
+    display_name: Optional[str] = "User"
+    issuer: Optional[str] = "CustomAuthenticator"
+
+class BulkProvisionRequest(BaseModel):
+    items: List[BulkProvisionItem]
+
+class BulkProvisionResult(BaseModel):
+    user_id: str
+    status: str # created, imported, skipped or invalid
+    error: Optional[str] = None
+    secret_base32: Optional[str] = None # Only for generated secrets, shown once
+    otpauth_uri: Optional[str] = None
+    provision_token: Optional[str] = None
+    expires_at: Optional[datetime] = None
+
+class BulkProvisionResponse(BaseModel):
+    results: List[BulkProvisionResult]
+
 class VerifySetupRequest(BaseModel):
-    provision_token: str
+    provision_token: UUID
     code: str
 
 class VerifyRequest(BaseModel):
-    user_id: str
+    user_id: UUID
     code: str
     client_ip: Optional[str] = None
 
@@ -35,15 +61,61 @@ class VerifyResponse(BaseModel):
     error: Optional[str] = None
     retry_after_seconds: Optional[int] = None
 
-class BackupCodeGenerateRequest(BaseModel):
+class BatchVerifyItem(BaseModel):
+    user_id: UUID
+    code: str
+    client_ip: Optional[str] = None
+
+class BatchVerifyRequest(BaseModel):
+    items: List[BatchVerifyItem]
+
+class BatchVerifyResult(BaseModel):
     user_id: str
+    verified: bool
+    error: Optional[str] = None
+    retry_after_seconds: Optional[int] = None
+
+class BatchVerifyResponse(BaseModel):
+    results: List[BatchVerifyResult]
+    timestamp: datetime
+
+class BackupCodeGenerateRequest(BaseModel):
+    user_id: UUID
 
 class BackupCodeResponse(BaseModel):
     backup_codes: List[str]
 
 class BackupVerifyRequest(BaseModel):
-    user_id: str
+    user_id: UUID
     backup_code: str
 
 class DisableRequest(BaseModel):
-    user_id: str
+    user_id: UUID
+
+class AuthEventOut(BaseModel):
+    # Read straight off the Core rows the audit query returns
+    model_config = ConfigDict(from_attributes=True)
+
+    id: UUID
+    user_id: UUID
+    authenticator_id: Optional[UUID] = None
+    event_type: str
+    detail: Optional[Dict[str, Any]] = None
+    ip_address: Optional[str] = None
+    created_at: datetime
+
+class AuditLogPage(BaseModel):
+    items: List[AuthEventOut]
+    next_cursor: Optional[str] = None # Pass back as ?cursor= for the next page
+
+class StatsBucket(BaseModel):
+    bucket_start: datetime
+    counts: Dict[str, int] # event_type -> count
+
+class AuditStatsResponse(BaseModel):
+    granularity: Literal["minute", "day"]
+    since: datetime
+    until: datetime
+    rolled_up_to: Optional[datetime] = None # Events after this are not counted yet
+    totals: Dict[str, int]
+    buckets: List[StatsBucket]
@@ -0,0 +1,299 @@
+import asyncio
+import base64
+import json
+import logging
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+from typing import Deque, List, Optional, Tuple
+
+from sqlalchemy import event as sa_event, insert, select, desc, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.models.auth_event import AuthEvent
+from app.services.audit_stream import audit_stream
+
+logger = logging.getLogger(__name__)
+
+AUTH_EVENT_COLUMNS = ["id", "user_id", "authenticator_id", "event_type", "detail", "ip_address", "created_at"]
+
+_STOP = object()
+_PENDING_KEY = "audit_events_pending_commit"
+_PUBLISH_KEY = "audit_events_pending_publish"
+
+class AuditWriter:
+    """
+    Writes AuthEvent rows either inside the request transaction ("sync") or
+    through an in-process queue that is flushed in bulk by a background task
+    ("buffered"). Buffered flushes happen when batch_size events are queued or
+    flush_interval has passed, whichever comes first; a full queue makes
+    callers wait, which is the backpressure. Events committed from a session
+    hook cannot wait, so when the queue is full they go to an unbounded
+    overflow that the background task drains first.
+    """
+
+    def __init__(
+        self,
+        mode: str,
+        batch_size: int,
+        flush_interval: float,
+        queue_size: int,
+        use_copy: bool,
+        retries: int,
+    ):
+        if mode not in ("sync", "buffered"):
+            raise ValueError(f"Unknown audit write mode: {mode}")
+        self.mode = mode
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.use_copy = use_copy
+        self.retries = retries
+        self.queue: Optional[asyncio.Queue] = None
+        self._overflow: Deque[dict] = deque()
+        self._task: Optional[asyncio.Task] = None
+        self.flushed = 0
+        self.dropped = 0
+
+    @property
+    def buffering(self) -> bool:
+        return self.mode == "buffered" and self._task is not None and not self._task.done()
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "queue_depth": (self.queue.qsize() if self.queue is not None else 0) + len(self._overflow),
+            "flushed": self.flushed,
+            "dropped": self.dropped,
+        }
+
+    @staticmethod
+    def build_event(user_id, event_type: str, authenticator_id=None, ip_address=None, detail=None) -> dict:
+        # Stamp id and time now so queued events keep their real order and time
+        return {
+            "id": uuid.uuid4(),
+            # Canonical, so stream filters match whatever spelling the caller had
+            "user_id": uuid.UUID(str(user_id)),
+            "authenticator_id": authenticator_id,
+            "event_type": event_type,
+            "detail": detail,
+            "ip_address": ip_address,
+            "created_at": datetime.utcnow(),
+        }
+
+    async def record(self, db: AsyncSession, commit: bool = True, **fields):
+        """
+        Record one event.
+        commit: in sync mode, commit the request session afterwards. Pass False
+        when the caller commits its own changes together with the event; in
+        buffered mode the event is then only queued once that commit happens,
+        so it never reaches the database ahead of the rows it references.
+        """
+        await self.record_many(db, [self.build_event(**fields)], commit=commit)
+
+    async def record_many(self, db: AsyncSession, events: List[dict], commit: bool = True):
+        if not events:
+            return
+        if self.buffering:
+            if commit:
+                for event in events:
+                    await self.queue.put(event)
+            else:
+                self._defer_until_commit(db, events)
+            return
+
+        if len(events) == 1:
+            db.add(AuthEvent(**events[0]))
+        else:
+            await db.execute(insert(AuthEvent), events)
+        if audit_stream.accepting:
+            self._publish_after_commit(db, events)
+        if commit:
+            await db.commit()
+
+    def _defer_until_commit(self, db: AsyncSession, events: List[dict]):
+        pending = db.info.get(_PENDING_KEY)
+        if pending is None:
+            pending = db.info[_PENDING_KEY] = []
+            sync_session = db.sync_session
+            sa_event.listen(sync_session, "after_commit", self._enqueue_committed, once=True)
+            sa_event.listen(sync_session, "after_rollback", self._discard_rolled_back, once=True)
+        pending.extend(events)
+
+    def _enqueue_committed(self, session):
+        for event in session.info.pop(_PENDING_KEY, []):
+            try:
+                self.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Can't block inside a session hook
+                self._overflow.append(event)
+
+    def _discard_rolled_back(self, session):
+        session.info.pop(_PENDING_KEY, None)
+
+    def _publish_after_commit(self, db: AsyncSession, events: List[dict]):
+        # Live stream clients only ever see events that were committed
+        pending = db.info.get(_PUBLISH_KEY)
+        if pending is None:
+            pending = db.info[_PUBLISH_KEY] = []
+            sync_session = db.sync_session
+            sa_event.listen(sync_session, "after_commit", self._publish_committed, once=True)
+            sa_event.listen(sync_session, "after_rollback", self._discard_unpublished, once=True)
+        pending.extend(events)
+
+    def _publish_committed(self, session):
+        audit_stream.publish(session.info.pop(_PUBLISH_KEY, []))
+
+    def _discard_unpublished(self, session):
+        session.info.pop(_PUBLISH_KEY, None)
+
+    async def start(self):
+        if self.mode != "buffered" or self.buffering:
+            return
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: Optional[float] = None):
+        """Flush everything queued so far, then stop the background task"""
+        if not self.buffering:
+            return
+        await self.queue.put(_STOP)
+        try:
+            await asyncio.wait_for(self._task, timeout)
+        except asyncio.TimeoutError:
+            logger.error(
+                "Audit writer did not drain within %ss, %d events lost", timeout, self.queue.qsize() + len(self._overflow)
+            )
+        self._task = None
+
+    def _next_nowait(self):
+        """The oldest overflow event, else the next queued one; raises QueueEmpty when there is neither"""
+        if self._overflow:
+            return self._overflow.popleft()
+        return self.queue.get_nowait()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            try:
+                event = self._next_nowait()
+            except asyncio.QueueEmpty:
+                event = await self.queue.get()
+            if event is _STOP:
+                break
+            batch = [event]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    event = self._next_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        event = await asyncio.wait_for(self.queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if event is _STOP:
+                    stopping = True
+                    break
+                batch.append(event)
+            await self._flush(batch)
+        # Overflow added after stop() queued _STOP is still written
+        while self._overflow:
+            await self._flush([self._overflow.popleft() for _ in range(min(self.batch_size, len(self._overflow)))])
+
+    async def _flush(self, batch: List[dict]):
+        for attempt in range(self.retries + 1):
+            try:
+                async with AsyncSessionLocal() as session:
+                    if self.use_copy and session.bind.dialect.driver == "asyncpg":
+                        await self._copy(session, batch)
+                    else:
+                        await session.execute(insert(AuthEvent), batch)
+                    await session.commit()
+                self.flushed += len(batch)
+                audit_stream.publish(batch)
+                return
+            except Exception:
+                logger.warning("Audit flush of %d events failed (attempt %d)", len(batch), attempt + 1, exc_info=True)
+                await asyncio.sleep(min(2 ** attempt * 0.1, 5))
+        self.dropped += len(batch)
+        logger.error("Dropping %d audit events after %d failed flushes", len(batch), self.retries + 1)
+
+    async def _copy(self, session: AsyncSession, batch: List[dict]):
+        connection = await session.connection()
+        raw = await connection.get_raw_connection()
+        records = [
+            tuple(
+                json.dumps(event["detail"]) if column == "detail" and event["detail"] is not None else event[column]
+                for column in AUTH_EVENT_COLUMNS
+            )
+            for event in batch
+        ]
+        await raw.driver_connection.copy_records_to_table(
+            AuthEvent.__tablename__, records=records, columns=AUTH_EVENT_COLUMNS
+        )
+
+def encode_cursor(created_at: datetime, event_id: uuid.UUID) -> str:
+    """Opaque keyset cursor pointing just past (created_at, id)"""
+    raw = f"{created_at.isoformat()}|{event_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, uuid.UUID]:
+    """Inverse of encode_cursor; raises ValueError on malformed input"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, event_id = raw.split("|")
+        return datetime.fromisoformat(created_at), uuid.UUID(event_id)
+    except (ValueError, UnicodeDecodeError) as exc:
+        raise ValueError("Invalid cursor") from exc
+
+def naive_utc(value: datetime) -> datetime:
+    """Stored timestamps are naive UTC"""
+    return value.astimezone(timezone.utc).replace(tzinfo=None) if value.tzinfo else value
+
+def build_audit_query(
+    *columns,
+    user_id=None,
+    event_type: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+):
+    """
+    Newest-first select over auth_events ordered by (created_at, id), which the
+    composite indexes serve directly. Every time filter is a plain bound on
+    created_at so partitions outside the range are pruned. With no columns the
+    full entity is selected.
+    """
+    query = select(*(columns or (AuthEvent,))).order_by(desc(AuthEvent.created_at), desc(AuthEvent.id))
+    if user_id:
+        query = query.where(AuthEvent.user_id == user_id)
+    if event_type:
+        query = query.where(AuthEvent.event_type == event_type)
+    if since:
+        query = query.where(AuthEvent.created_at >= naive_utc(since))
+    if until:
+        query = query.where(AuthEvent.created_at < naive_utc(until))
+    if cursor:
+        created_at, event_id = decode_cursor(cursor)
+        # The plain created_at bound lets Postgres prune newer partitions;
+        # the row comparison alone is not used for pruning
+        query = query.where(
+            AuthEvent.created_at <= created_at,
+            tuple_(AuthEvent.created_at, AuthEvent.id) < tuple_(created_at, event_id),
+        )
+    return query
+
+audit_writer = AuditWriter(
+    mode=settings.AUDIT_WRITE_MODE,
+    batch_size=settings.AUDIT_BATCH_SIZE,
+    flush_interval=settings.AUDIT_FLUSH_INTERVAL_MS / 1000,
+    queue_size=settings.AUDIT_QUEUE_SIZE,
+    use_copy=settings.AUDIT_USE_COPY,
+    retries=settings.AUDIT_FLUSH_RETRIES,
+)
@@ -0,0 +1,187 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+from datetime import datetime
+from typing import List, Optional, Set
+
+from app.core.config import settings
+from app.core.metrics import REDIS_ERRORS, REDIS_SECONDS
+from app.core.redis import redis_client
+
+logger = logging.getLogger(__name__)
+
+# After a publish reaches no subscriber anywhere, events are not even
+# serialized for this long; a new stream may miss that much
+_IDLE_RECHECK_SECONDS = 1.0
+_CLOSED = object()
+
+def _json_default(value):
+    return value.isoformat() if isinstance(value, datetime) else str(value)
+
+class Subscription:
+    """One stream client: its filters and a bounded queue of JSON event lines"""
+
+    def __init__(self, user_id: Optional[str], event_type: Optional[str], buffer_size: int):
+        self.user_id = user_id
+        self.event_type = event_type
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=buffer_size)
+        # Events dropped because the client read too slowly, and how many it has been told about
+        self.dropped = 0
+        self.reported = 0
+
+    def matches(self, event: dict) -> bool:
+        return (self.user_id is None or event["user_id"] == self.user_id) and (
+            self.event_type is None or event["event_type"] == self.event_type
+        )
+
+    def offer(self, item):
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    def take_dropped(self) -> int:
+        """Drops since the last call, for telling the client"""
+        count, self.reported = self.dropped - self.reported, self.dropped
+        return count
+
+    def close(self):
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(_CLOSED)
+
+    async def get(self) -> Optional[str]:
+        """The next event line, or None once the stream is closed"""
+        item = await self.queue.get()
+        return None if item is _CLOSED else item
+
+class AuditStream:
+    """
+    Fans committed audit events out to /admin/audit/stream clients on every
+    worker through one Redis channel. Writers hand events to publish(), which
+    never blocks: events collect in an outbox that a single task publishes,
+    one message per batch. Each worker subscribes only while it has clients,
+    and each client has a bounded queue, so a slow reader loses events (and is
+    told how many) instead of growing memory.
+    """
+
+    def __init__(self, channel: str, client_buffer: int, max_clients: int, outbox_size: int):
+        self.redis = redis_client
+        self.channel = channel
+        self.client_buffer = client_buffer
+        self.max_clients = max_clients
+        self.outbox_size = outbox_size
+        self.subscriptions: Set[Subscription] = set()
+        self._outbox: List[str] = []
+        self._publisher: Optional[asyncio.Task] = None
+        self._listener: Optional[asyncio.Task] = None
+        self._idle_until = 0.0
+        self.closed = False
+        self.published = 0
+        self.dropped = 0
+
+    @property
+    def accepting(self) -> bool:
+        """False while no stream client is known to exist; writers can skip publish() then"""
+        return bool(self.subscriptions) or time.monotonic() >= self._idle_until
+
+    def stats(self) -> dict:
+        return {
+            "clients": len(self.subscriptions),
+            "outbox": len(self._outbox),
+            "published": self.published,
+            "dropped": self.dropped + sum(subscription.dropped for subscription in self.subscriptions),
+        }
+
+    def publish(self, events: List[dict]):
+        """Queue committed events (build_event dicts) for the stream"""
+        if not self.accepting:
+            return
+        room = self.outbox_size - len(self._outbox)
+        if room < len(events):
+            self.dropped += len(events) - max(room, 0)
+            events = events[:max(room, 0)]
+        self._outbox.extend(json.dumps(event, default=_json_default) for event in events)
+        if self._publisher is None or self._publisher.done():
+            self._publisher = asyncio.get_running_loop().create_task(self._publish_outbox())
+
+    async def _publish_outbox(self):
+        # Whatever queued while the previous PUBLISH was in flight goes out as one message
+        while self._outbox:
+            lines, self._outbox = self._outbox, []
+            try:
+                with REDIS_SECONDS.time("audit_stream_publish"):
+                    receivers = await self.redis.publish(self.channel, "\n".join(lines))
+            except Exception:
+                REDIS_ERRORS.inc("audit_stream_publish")
+                self.dropped += len(lines)
+                logger.warning("Failed to publish %d audit events to the stream", len(lines), exc_info=True)
+                return
+            self.published += len(lines)
+            if not receivers:
+                self._idle_until = time.monotonic() + _IDLE_RECHECK_SECONDS
+
+    def subscribe(self, user_id=None, event_type: Optional[str] = None) -> Optional[Subscription]:
+        """A new client subscription, or None when this worker already has max_clients"""
+        if len(self.subscriptions) >= self.max_clients:
+            return None
+        # Events carry the canonical UUID string; compare in the same form
+        user_id = str(uuid.UUID(str(user_id))) if user_id else None
+        subscription = Subscription(user_id, event_type or None, self.client_buffer)
+        if self.closed:
+            # Shutting down: end the stream at once so the client reconnects elsewhere
+            subscription.close()
+            return subscription
+        self.subscriptions.add(subscription)
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.get_running_loop().create_task(self._listen())
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self.subscriptions.discard(subscription)
+        self.dropped += subscription.dropped
+        if not self.subscriptions and self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+
+    async def _listen(self):
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        self._dispatch(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                REDIS_ERRORS.inc("audit_stream_listen")
+                logger.warning("Audit stream subscription failed, retrying", exc_info=True)
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
+
+    def _dispatch(self, data: str):
+        for line in data.split("\n"):
+            event = json.loads(line)
+            for subscription in self.subscriptions:
+                if subscription.matches(event):
+                    subscription.offer(line)
+
+    def close(self):
+        """End every open stream, and any opened later, so their requests can finish on shutdown"""
+        self.closed = True
+        for subscription in list(self.subscriptions):
+            subscription.close()
+        if self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+
+audit_stream = AuditStream(
+    channel=settings.AUDIT_STREAM_CHANNEL,
+    client_buffer=settings.AUDIT_STREAM_CLIENT_BUFFER,
+    max_clients=settings.AUDIT_STREAM_MAX_CLIENTS,
+    outbox_size=settings.AUDIT_STREAM_OUTBOX_SIZE,
+)
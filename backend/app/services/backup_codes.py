@@ -0,0 +1,82 @@
+import hashlib
+from typing import List
+
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+
+from app.models.authenticator import BackupCode
+from app.services.cpu_executor import cpu_executor
+from app.services.totp import totp_service
+
+def hash_code(code: str) -> str:
+    # Hash code (using simple hash for demo, should be argon2)
+    return hashlib.sha256(code.encode()).hexdigest()
+
+def hash_codes(codes: List[str]) -> List[str]:
+    """Module-level entry point for worker pools"""
+    return [hash_code(code) for code in codes]
+
+class BackupCodeService:
+    count = 10
+
+    def generate_code(self) -> str:
+        return totp_service.generate_secret()[:8] # Simple 8 char code
+
+    def hash_code(self, code: str) -> str:
+        return hash_code(code)
+
+    async def hash_codes(self, codes: List[str]) -> List[str]:
+        """Always on the CPU executor: the hash is meant to be a deliberately slow KDF"""
+        return await cpu_executor.run("backup_code_hash", hash_codes, codes)
+
+    async def regenerate(self, db: AsyncSession, authenticator_id) -> List[str]:
+        """
+        Replace every existing code with a fresh set: one DELETE and one
+        multi-row INSERT, committed by the caller as a single transaction.
+        """
+        plain_codes = [self.generate_code() for _ in range(self.count)]
+        code_hashes = await self.hash_codes(plain_codes)
+        await db.execute(
+            delete(BackupCode)
+            .where(BackupCode.authenticator_id == authenticator_id)
+            .execution_options(synchronize_session=False)
+        )
+        await db.execute(
+            insert(BackupCode),
+            [{"authenticator_id": authenticator_id, "code_hash": code_hash, "used": False} for code_hash in code_hashes],
+        )
+        return plain_codes
+
+    def consume_statement(self, authenticator_id, code_hash: str):
+        """
+        Mark one matching unused code as used in a single UPDATE ... RETURNING.
+        The row is picked with FOR UPDATE SKIP LOCKED and re-checked as unused,
+        so two concurrent requests can never both consume the same code.
+        """
+        candidate = aliased(BackupCode)
+        target = (
+            select(candidate.id)
+            .where(
+                candidate.authenticator_id == authenticator_id,
+                candidate.code_hash == code_hash,
+                candidate.used == False,
+            )
+            .limit(1)
+            .with_for_update(skip_locked=True)
+            .scalar_subquery()
+        )
+        return (
+            update(BackupCode)
+            .where(BackupCode.id == target, BackupCode.used == False)
+            .values(used=True)
+            .returning(BackupCode.id)
+            .execution_options(synchronize_session=False)
+        )
+
+    async def consume(self, db: AsyncSession, authenticator_id, code: str) -> bool:
+        code_hash, = await self.hash_codes([code])
+        result = await db.execute(self.consume_statement(authenticator_id, code_hash))
+        return result.first() is not None
+
+backup_code_service = BackupCodeService()
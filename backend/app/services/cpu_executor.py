@@ -0,0 +1,116 @@
+import asyncio
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from app.core.config import settings
+from app.core.metrics import CPU_EXECUTOR_PENDING, CPU_EXECUTOR_REJECTED, CPU_QUEUE_SECONDS, CPU_RUN_SECONDS
+from fastapi import HTTPException, status
+
+def _timed_call(func: Callable, args: tuple):
+    """Runs on the worker and reports when it started; module level so process pools can pickle it"""
+    # time.monotonic is system-wide on Linux, so a process pool's stamps compare with ours
+    started = time.monotonic()
+    result = func(*args)
+    return started, time.monotonic() - started, result
+
+def _noop():
+    return None
+
+class CPUExecutor:
+    """
+    Pool for CPU-bound work that would otherwise stall the event loop: QR
+    rendering, backup code hashing and large crypto batches. At most
+    workers + max_queue calls are accepted at a time; past that run() raises
+    503 so a burst sheds load instead of piling up latency. Batches under
+    min_items run inline, where the hand-off costs more than the work.
+
+    With a process pool, func and its arguments must be picklable: module
+    level functions over plain data. Work that is not (TOTP batches hold
+    HMAC state) says so and runs inline there.
+    """
+
+    def __init__(self, kind: str, workers: int, max_queue: int, min_items: int):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown CPU executor kind: {kind}")
+        self.kind = kind
+        self.workers = max(workers, 1)
+        self.max_queue = max_queue
+        self.min_items = min_items
+        self._executor: Optional[Executor] = None
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.inline = 0
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="cpu")
+        return self._executor
+
+    async def run(self, operation: str, func: Callable, *args, picklable: bool = True) -> Any:
+        """func(*args) on the pool, timing the queue wait and the run under `operation`"""
+        if not picklable and self.kind == "process":
+            self.inline += 1
+            return func(*args)
+        if self.pending >= self.workers + self.max_queue:
+            self.rejected += 1
+            CPU_EXECUTOR_REJECTED.inc(operation)
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Server busy",
+                headers={"Retry-After": "1"},
+            )
+
+        self.pending += 1
+        CPU_EXECUTOR_PENDING.inc()
+        submitted = time.monotonic()
+        try:
+            started, run_seconds, result = await asyncio.get_running_loop().run_in_executor(
+                self.executor, _timed_call, func, args,
+            )
+        finally:
+            self.pending -= 1
+            CPU_EXECUTOR_PENDING.dec()
+        self.completed += 1
+        CPU_QUEUE_SECONDS.observe(max(started - submitted, 0.0), operation)
+        CPU_RUN_SECONDS.observe(run_seconds, operation)
+        return result
+
+    async def run_batch(self, operation: str, items: int, func: Callable, *args, picklable: bool = True) -> Any:
+        """run() for a batch of `items`, or func(*args) inline when the batch is too small to be worth it"""
+        if items < self.min_items:
+            self.inline += 1
+            return func(*args)
+        return await self.run(operation, func, *args, picklable=picklable)
+
+    async def warm(self):
+        """Start every worker now (process pools fork on first use) rather than on the first request"""
+        await asyncio.gather(*(self.run("warmup", _noop) for _ in range(self.workers)))
+
+    def shutdown(self, wait: bool = False):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> dict:
+        return {
+            "kind": self.kind,
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "pending": self.pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "inline": self.inline,
+        }
+
+cpu_executor = CPUExecutor(
+    kind=settings.CPU_EXECUTOR,
+    workers=settings.CPU_EXECUTOR_WORKERS,
+    max_queue=settings.CPU_EXECUTOR_MAX_QUEUE,
+    min_items=settings.CPU_OFFLOAD_MIN_ITEMS,
+)
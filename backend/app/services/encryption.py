@@ -1,31 +1,143 @@
+from cryptography.exceptions import InvalidTag
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from app.core.config import settings
+from app.core.metrics import CRYPTO_SECONDS, timed
 import base64
 import os
+from typing import Dict, List, Optional
+
+# Ciphertexts written since keyring support start with a version byte and
+# the id of the key that sealed them:
+#   0x01 | len(key_id) | key_id | nonce (12) | ciphertext + tag
+# Older values are bare nonce + ciphertext and are tried against every key.
+KEYRING_VERSION = b"\x01"
+
+def derive_key(key_str: str) -> bytes:
+    # Pad or truncate to 32 bytes if necessary for this demo
+    # A real key should be exactly 32 bytes random
+    if len(key_str) < 32:
+        key_str = key_str.ljust(32, '0')
+    elif len(key_str) > 32:
+        key_str = key_str[:32]
+    return key_str.encode('utf-8')
+
+def load_keyring() -> Dict[str, bytes]:
+    """APP_MASTER_KEY under APP_MASTER_KEY_ID, plus retired keys from APP_RETIRED_MASTER_KEYS ("id:key,...")"""
+    keys = {}
+    for entry in filter(None, (part.strip() for part in settings.APP_RETIRED_MASTER_KEYS.split(","))):
+        key_id, _, key_str = entry.partition(":")
+        if not key_id or not key_str:
+            raise ValueError("APP_RETIRED_MASTER_KEYS entries must look like id:key")
+        keys[key_id] = derive_key(key_str)
+    keys[settings.APP_MASTER_KEY_ID] = derive_key(settings.APP_MASTER_KEY)
+    return keys
 
 class EncryptionService:
-    def __init__(self):
-        # Ensure key is 32 bytes for AES-256
-        # In production, this should be handled more robustly
-        key_str = settings.APP_MASTER_KEY
-        # Pad or truncate to 32 bytes if necessary for this demo
-        # A real key should be exactly 32 bytes random
-        if len(key_str) < 32:
-            key_str = key_str.ljust(32, '0')
-        elif len(key_str) > 32:
-            key_str = key_str[:32]
-        
-        self.key = key_str.encode('utf-8')
-        self.aesgcm = AESGCM(self.key)
+    def __init__(self, keys: Optional[Dict[str, bytes]] = None, current_key_id: Optional[str] = None):
+        keys = keys if keys is not None else load_keyring()
+        self.current_key_id = current_key_id or settings.APP_MASTER_KEY_ID
+        if self.current_key_id not in keys:
+            raise ValueError(f"Key {self.current_key_id!r} is not in the keyring")
+        if not 0 < len(self.current_key_id.encode()) < 256:
+            raise ValueError("Key ids must be 1-255 bytes")
+
+        self.ciphers = {key_id: AESGCM(key) for key_id, key in keys.items()}
+        self.aesgcm = self.ciphers[self.current_key_id]
+        key_id = self.current_key_id.encode()
+        self.prefix = KEYRING_VERSION + bytes([len(key_id)]) + key_id
+
+    @staticmethod
+    def key_id(ciphertext: bytes) -> Optional[str]:
+        """The key id in a keyring ciphertext header, None for legacy values"""
+        if ciphertext[:1] != KEYRING_VERSION or len(ciphertext) < 2:
+            return None
+        end = 2 + ciphertext[1]
+        try:
+            return ciphertext[2:end].decode()
+        except UnicodeDecodeError:
+            return None
+
+    def needs_rotation(self, ciphertext: bytes) -> bool:
+        return not ciphertext.startswith(self.prefix)
 
+    @timed(CRYPTO_SECONDS, "encrypt")
     def encrypt(self, plaintext: bytes) -> bytes:
         nonce = os.urandom(12)
         ciphertext = self.aesgcm.encrypt(nonce, plaintext, None)
-        return nonce + ciphertext
+        return self.prefix + nonce + ciphertext
 
+    @timed(CRYPTO_SECONDS, "decrypt")
     def decrypt(self, ciphertext: bytes) -> bytes:
-        nonce = ciphertext[:12]
-        data = ciphertext[12:]
-        return self.aesgcm.decrypt(nonce, data, None)
+        key_id = self.key_id(ciphertext)
+        cipher = self.ciphers.get(key_id) if key_id is not None else None
+        if cipher is not None:
+            body = ciphertext[2 + ciphertext[1]:]
+            try:
+                return cipher.decrypt(body[:12], body[12:], None)
+            except InvalidTag:
+                # A legacy nonce can happen to look like a header
+                pass
+        for cipher in self.ciphers.values():
+            try:
+                return cipher.decrypt(ciphertext[:12], ciphertext[12:], None)
+            except InvalidTag:
+                continue
+        raise InvalidTag()
+
+    @timed(CRYPTO_SECONDS, "decrypt_batch")
+    def decrypt_many(self, ciphertexts: List[bytes]) -> List[bytes]:
+        """Decrypt a batch, with a fast path for values sealed by the current key"""
+        decrypt = self.aesgcm.decrypt
+        prefix = self.prefix
+        offset = len(prefix)
+        return [
+            decrypt(ciphertext[offset:offset + 12], ciphertext[offset + 12:], None)
+            if ciphertext.startswith(prefix) else self.decrypt(ciphertext)
+            for ciphertext in ciphertexts
+        ]
+
+    @timed(CRYPTO_SECONDS, "encrypt_batch")
+    def encrypt_many(self, plaintexts: List[bytes]) -> List[bytes]:
+        """Encrypt a batch of plaintexts with the shared AESGCM context"""
+        encrypt = self.aesgcm.encrypt
+        prefix = self.prefix
+        results = []
+        for plaintext in plaintexts:
+            nonce = os.urandom(12)
+            results.append(prefix + nonce + encrypt(nonce, plaintext, None))
+        return results
+
+    def reencrypt_many(self, ciphertexts: List[bytes]) -> List[Optional[bytes]]:
+        """
+        Re-seal a batch under the current key; values already on it are
+        returned as is, and values no known key opens come back as None
+        instead of failing the whole batch
+        """
+        results: List[Optional[bytes]] = list(ciphertexts)
+        stale, plaintexts = [], []
+        for index, ciphertext in enumerate(ciphertexts):
+            if not self.needs_rotation(ciphertext):
+                continue
+            try:
+                plaintexts.append(self.decrypt(ciphertext))
+            except (InvalidTag, ValueError):
+                results[index] = None
+                continue
+            stale.append(index)
+        for index, ciphertext in zip(stale, self.encrypt_many(plaintexts)):
+            results[index] = ciphertext
+        return results
 
 encryption_service = EncryptionService()
+
+def encrypt_many(plaintexts: List[bytes]) -> List[bytes]:
+    """Module-level entry point for worker pools (picklable, per-process service)"""
+    return encryption_service.encrypt_many(plaintexts)
+
+def decrypt_many(ciphertexts: List[bytes]) -> List[bytes]:
+    """Module-level entry point for worker pools (picklable, per-process service)"""
+    return encryption_service.decrypt_many(ciphertexts)
+
+def reencrypt_many(ciphertexts: List[bytes]) -> List[Optional[bytes]]:
+    """Module-level entry point for worker pools (picklable, per-process service)"""
+    return encryption_service.reencrypt_many(ciphertexts)
@@ -0,0 +1,115 @@
+import asyncio
+import functools
+import hashlib
+import json
+import logging
+from typing import Awaitable, Callable, Optional
+
+from fastapi import HTTPException, Response, status
+from pydantic import BaseModel
+from redis.exceptions import RedisError
+
+from app.core.config import settings
+from app.core.metrics import REDIS_ERRORS, REDIS_SECONDS
+from app.core.redis import redis_client
+from app.services.single_flight import single_flight
+
+logger = logging.getLogger(__name__)
+
+REPLAYED_HEADER = "Idempotent-Replayed"
+
+class IdempotencyStore:
+    """
+    Replays the first response to a request sent again with the same
+    Idempotency-Key header, for the TTL, without running it again. Keys are
+    scoped per endpoint and user and bound to a hash of the request body:
+    reusing one for a different request is a 422, and a retry that arrives
+    while the first attempt is still running on another worker is a 409.
+    Only successful responses are kept; after an error the key is released
+    so a retry runs normally. If Redis is unavailable requests just run.
+    """
+
+    def __init__(self, ttl: int):
+        self.redis = redis_client
+        self.ttl = ttl
+        self.replayed = 0
+        self.conflicts = 0
+
+    @staticmethod
+    def _fingerprint(scope: str, request: BaseModel) -> str:
+        # A hash, so the stored record never holds codes
+        return hashlib.sha256(f"{scope}\n{request.model_dump_json()}".encode()).hexdigest()
+
+    async def run(
+        self,
+        scope: str,
+        user_id,
+        idempotency_key: Optional[str],
+        request: BaseModel,
+        response: Response,
+        handler: Callable[[], Awaitable[BaseModel]],
+    ):
+        """handler(), or the response it gave the first time this key was used"""
+        if not idempotency_key:
+            return await handler()
+        key = f"idem:{scope}:{user_id}:{idempotency_key}"
+        fingerprint = self._fingerprint(scope, request)
+        # Identical retries racing on this worker share one attempt
+        replayed, result = await single_flight.do((key, fingerprint), functools.partial(self._run_once, key, fingerprint, handler))
+        if replayed:
+            response.headers[REPLAYED_HEADER] = "true"
+        return result
+
+    async def _run_once(self, key: str, fingerprint: str, handler):
+        try:
+            with REDIS_SECONDS.time("idempotency"):
+                claimed = await self.redis.set(key, json.dumps({"fingerprint": fingerprint}), nx=True, ex=self.ttl)
+                stored = None if claimed else await self.redis.get(key)
+        except (RedisError, OSError):
+            REDIS_ERRORS.inc("idempotency")
+            logger.warning("Idempotency store unavailable, running the request", exc_info=True)
+            return False, await handler()
+
+        if stored is not None:
+            record = json.loads(stored)
+            if record["fingerprint"] != fingerprint:
+                raise HTTPException(
+                    status_code=422,
+                    detail="Idempotency-Key was already used for a different request",
+                )
+            if "response" not in record:
+                self.conflicts += 1
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail="A request with this Idempotency-Key is in progress",
+                    headers={"Retry-After": "1"},
+                )
+            self.replayed += 1
+            return True, record["response"]
+
+        try:
+            result = await handler()
+        except BaseException:
+            await self._release(key)
+            raise
+        try:
+            await self.redis.set(
+                key, json.dumps({"fingerprint": fingerprint, "response": result.model_dump(mode="json")}), ex=self.ttl,
+            )
+        except (RedisError, OSError):
+            REDIS_ERRORS.inc("idempotency")
+            logger.warning("Failed to store the response for Idempotency-Key", exc_info=True)
+            await self._release(key)
+        return False, result
+
+    async def _release(self, key: str):
+        try:
+            await asyncio.shield(self.redis.delete(key))
+        except (RedisError, OSError):
+            REDIS_ERRORS.inc("idempotency")
+            logger.warning("Failed to release Idempotency-Key; it expires with the TTL", exc_info=True)
+
+    def stats(self) -> dict:
+        return {"ttl_seconds": self.ttl, "replayed": self.replayed, "conflicts": self.conflicts}
+
+idempotency_store = IdempotencyStore(ttl=settings.IDEMPOTENCY_TTL_SECONDS)
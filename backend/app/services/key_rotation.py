@@ -0,0 +1,104 @@
+import asyncio
+import uuid
+from concurrent.futures import Executor
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, List, Optional, Sequence
+
+from sqlalchemy import bindparam, func, select, update
+
+from app.core.database import AsyncSessionLocal
+from app.models.authenticator import Authenticator
+from app.services.encryption import encryption_service, reencrypt_many
+
+@dataclass
+class RotationProgress:
+    after: Optional[uuid.UUID]  # keyset position, the last id handled
+    rotated: int = 0
+    failed: List[uuid.UUID] = field(default_factory=list)  # rows no known key decrypts, left as they are
+
+async def fetch_stale(after: Optional[uuid.UUID], limit: int) -> List[tuple]:
+    """The next `limit` (id, secret_encrypted) rows not sealed by the current key, in id order"""
+    prefix = encryption_service.prefix
+    query = (
+        select(Authenticator.id, Authenticator.secret_encrypted)
+        .where(func.substr(Authenticator.secret_encrypted, 1, len(prefix)) != prefix)
+        .order_by(Authenticator.id)
+        .limit(limit)
+    )
+    if after is not None:
+        query = query.where(Authenticator.id > after)
+    async with AsyncSessionLocal() as db:
+        return (await db.execute(query)).all()
+
+async def reencrypt(ciphertexts: Sequence[bytes], executor: Optional[Executor] = None, workers: int = 1) -> List[Optional[bytes]]:
+    """Re-seal ciphertexts under the current key, split across `workers` pool slots; None where decryption failed"""
+    loop = asyncio.get_running_loop()
+    size = -(-len(ciphertexts) // max(workers, 1))
+    chunks = [list(ciphertexts[start:start + size]) for start in range(0, len(ciphertexts), size)]
+    resealed = await asyncio.gather(*(loop.run_in_executor(executor, reencrypt_many, chunk) for chunk in chunks))
+    return [ciphertext for chunk in resealed for ciphertext in chunk]
+
+async def write_batch(rows: Sequence[tuple], resealed: Sequence[Optional[bytes]]):
+    """
+    One executemany UPDATE per batch. Each row is only replaced if it still
+    holds the ciphertext that was read, so a secret changed concurrently is
+    never overwritten; updated_at is left alone. Rows resealed as None are
+    skipped.
+    """
+    params = [
+        {"row_id": row_id, "old_secret": old, "new_secret": new}
+        for (row_id, old), new in zip(rows, resealed)
+        if new is not None
+    ]
+    if not params:
+        return
+    table = Authenticator.__table__
+    statement = (
+        update(table)
+        .where(table.c.id == bindparam("row_id"), table.c.secret_encrypted == bindparam("old_secret"))
+        .values(secret_encrypted=bindparam("new_secret"), updated_at=table.c.updated_at)
+    )
+    async with AsyncSessionLocal() as db:
+        connection = await db.connection()
+        await connection.execute(statement, params)
+        await db.commit()
+
+async def rotate_keys(
+    batch_size: int,
+    executor: Optional[Executor] = None,
+    workers: int = 1,
+    after: Optional[uuid.UUID] = None,
+    failed: Sequence[uuid.UUID] = (),
+    on_batch: Optional[Callable[[RotationProgress], Awaitable[None]]] = None,
+) -> RotationProgress:
+    """
+    Re-encrypt every authenticator secret not sealed by the current key.
+
+    Rows are walked by id from `after` (with `failed` carried over from the
+    run being resumed), one committed batch at a time, while
+    the next batch is already being read. on_batch is awaited after every
+    commit, so progress can be checkpointed and an interrupted run resumed.
+    Rows that no configured key decrypts are left unchanged and listed in
+    progress.failed rather than stopping the run.
+    """
+    progress = RotationProgress(after=after, failed=list(failed))
+    pending = asyncio.create_task(fetch_stale(after, batch_size))
+    try:
+        while True:
+            rows = await pending
+            if not rows:
+                break
+            pending = asyncio.create_task(fetch_stale(rows[-1][0], batch_size))
+
+            resealed = await reencrypt([secret for _, secret in rows], executor, workers)
+            await write_batch(rows, resealed)
+
+            failed = [row_id for (row_id, _), new in zip(rows, resealed) if new is None]
+            progress.after = rows[-1][0]
+            progress.rotated += len(rows) - len(failed)
+            progress.failed.extend(failed)
+            if on_batch is not None:
+                await on_batch(progress)
+    finally:
+        pending.cancel()
+    return progress
@@ -0,0 +1,147 @@
+import asyncio
+import functools
+import logging
+import signal
+import time
+from typing import Set
+
+from sqlalchemy import text
+
+from app.core.config import settings
+from app.core.database import engine
+from app.core.redis import redis_client
+from app.services.audit_stream import audit_stream
+from app.services.cpu_executor import cpu_executor
+from app.services.encryption import encryption_service
+from app.services.lockout import lockout_service
+from app.services.rate_limiter import rate_limit_service
+from app.services.totp import totp_service
+
+logger = logging.getLogger(__name__)
+
+async def warm_database(connections: int):
+    """Open connections concurrently and return them to the pool, so they stay checked in"""
+    async def open_one():
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
+    await asyncio.gather(*(open_one() for _ in range(connections)))
+
+async def warm_redis(connections: int):
+    # Concurrent commands each take their own pooled connection
+    await asyncio.gather(*(redis_client.ping() for _ in range(connections)))
+    await rate_limit_service.load_scripts()
+    await lockout_service.load_scripts()
+
+def warm_crypto():
+    """Run the AES-GCM and TOTP paths once so their first real call is not the slow one"""
+    encryption_service.decrypt(encryption_service.encrypt(b"warmup"))
+    key = totp_service.load_key(totp_service.generate_secret())
+    totp_service.verify_key(key, key.code())
+
+class Lifecycle:
+    """
+    Startup warmup, readiness and shutdown signals for one worker. Warmup
+    failures are logged rather than raised: every dependency is also reached
+    lazily, so the worker can still serve, just with a slower first request.
+    A failed database or Redis step does keep the worker unready, though,
+    until retry_loop() has run it successfully.
+
+    Request draining itself is uvicorn's: on SIGTERM it stops accepting and
+    waits for in-flight requests before the lifespan shutdown runs. What
+    this adds happens before that, while the server still accepts: /readyz
+    turns 503 and, for shutdown_delay seconds, requests are still served so
+    the load balancer can take the worker out of rotation first.
+    """
+
+    # Steps whose failure means requests would fail, not just start slowly
+    REQUIRED = ("database", "redis")
+
+    def __init__(self, shutdown_delay: float = 0.0):
+        self.shutdown_delay = shutdown_delay
+        self.started = False
+        self.draining = False
+        self.failed: Set[str] = set()
+
+    @property
+    def ready(self) -> bool:
+        return self.started and not self.draining and not self.failed
+
+    @staticmethod
+    def _step(name: str):
+        if name == "database":
+            return warm_database(min(settings.WARMUP_DB_CONNECTIONS, settings.DB_POOL_SIZE))
+        if name == "redis":
+            return warm_redis(settings.WARMUP_REDIS_CONNECTIONS)
+        if name == "crypto":
+            return asyncio.to_thread(warm_crypto)
+        return cpu_executor.warm()
+
+    async def _run(self, names):
+        results = await asyncio.gather(*(self._step(name) for name in names), return_exceptions=True)
+        for name, result in zip(names, results):
+            if not isinstance(result, Exception):
+                self.failed.discard(name)
+                continue
+            logger.warning("Warmup step %s failed", name, exc_info=result)
+            if name in self.REQUIRED:
+                self.failed.add(name)
+
+    async def start(self):
+        started = time.perf_counter()
+        await self._run(["database", "redis", "crypto", "cpu_executor"])
+        logger.info("Warmup finished in %.0f ms", (time.perf_counter() - started) * 1000)
+        if self.failed:
+            logger.warning("Not ready until warmup succeeds for: %s", ", ".join(sorted(self.failed)))
+        self.started = True
+
+    async def retry_loop(self, interval: float):
+        """Re-run the failed required warmup steps every interval until cancelled"""
+        while True:
+            await asyncio.sleep(interval)
+            if self.failed:
+                await self._run(sorted(self.failed))
+                if not self.failed:
+                    logger.info("Warmup recovered, ready")
+
+    def install_signal_handlers(self):
+        """
+        Run on_signal() when SIGTERM or SIGINT arrives, ahead of the server's
+        own handler. Uvicorn waits for open connections to finish before it
+        runs the lifespan shutdown, so responses that never finish by
+        themselves, like audit streams, have to be ended from here.
+        """
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            previous = signal.getsignal(signum)
+            if not callable(previous):
+                # No server handler to run after ours, e.g. outside uvicorn
+                continue
+
+            def handler(received, frame, previous=previous):
+                loop.call_soon_threadsafe(self.on_signal, received, functools.partial(previous, received, frame))
+
+            try:
+                signal.signal(signum, handler)
+            except ValueError:
+                logger.warning("Not on the main thread; audit streams will hold up shutdown")
+                return
+
+    def on_signal(self, received: int, stop_server):
+        """Stop reporting ready and end the streams, then stop_server(), after shutdown_delay on a first SIGTERM"""
+        first = not self.draining
+        self.draining = True
+        audit_stream.close()
+        if first and received == signal.SIGTERM and self.shutdown_delay > 0:
+            logger.info("Draining for %.0f s before shutting down", self.shutdown_delay)
+            asyncio.get_running_loop().call_later(self.shutdown_delay, stop_server)
+        else:
+            # A second signal, or Ctrl+C, stops the server right away
+            stop_server()
+
+    async def close(self):
+        """Close the DB pool and Redis connections"""
+        await engine.dispose()
+        await redis_client.aclose()
+
+lifecycle = Lifecycle(shutdown_delay=settings.SHUTDOWN_DELAY_SECONDS)
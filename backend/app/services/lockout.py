@@ -0,0 +1,206 @@
+import asyncio
+import logging
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from redis.exceptions import RedisError
+from sqlalchemy import bindparam, update
+
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.core.metrics import LOCKOUT_EVENTS, REDIS_ERRORS, REDIS_SECONDS
+from app.core.redis import redis_client
+from app.models.authenticator import Authenticator, AuthenticatorStatus
+from app.services.rate_limiter import rate_limit_service
+
+logger = logging.getLogger(__name__)
+
+# Users whose lockout state changed since it was last written to the database
+DIRTY_KEY = "lockout:dirty"
+
+# Counts one failed verify. From the threshold on, every failure locks the
+# subject for base * 2^(failures - threshold), capped; the hash outlives the
+# lock by the reset period, after which the failures are forgotten.
+#   KEYS: lockout hash, dirty set
+#   ARGV: threshold, base_ms, max_ms, reset_ms, user id for the dirty set
+# Returns {failures, lock_ms}.
+FAILURE_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local threshold = tonumber(ARGV[1])
+local failures = redis.call('HINCRBY', KEYS[1], 'failures', 1)
+local lock = 0
+if failures >= threshold then
+    lock = math.min(tonumber(ARGV[2]) * 2 ^ math.min(failures - threshold, 30), tonumber(ARGV[3]))
+    lock = math.floor(lock)
+    redis.call('HSET', KEYS[1], 'locked_until', now + lock)
+end
+redis.call('PEXPIRE', KEYS[1], lock + tonumber(ARGV[4]))
+redis.call('SADD', KEYS[2], ARGV[5])
+return {failures, lock}
+"""
+
+def lockout_key(user_id) -> str:
+    # Canonical form, so other spellings of the same UUID share one lockout
+    return f"lockout:verify:user:{uuid.UUID(str(user_id))}"
+
+class LockoutService:
+    """
+    Progressive lockout for TOTP verification. State lives in one Redis hash
+    per user, read by the rate limit script on every attempt, so a failed
+    verify costs one more Redis call and no database write. The
+    failed_attempts and locked_until columns are a record of that state,
+    brought up to date in batches by flush().
+    """
+
+    def __init__(self):
+        self.redis = redis_client
+        self.script = self.redis.register_script(FAILURE_SCRIPT)
+        self.redis_timeout = settings.RATE_LIMIT_REDIS_TIMEOUT_MS / 1000
+
+    async def load_scripts(self):
+        await self.redis.script_load(FAILURE_SCRIPT)
+
+    @staticmethod
+    def _failure_args(user_id) -> Tuple[list, list]:
+        keys = [lockout_key(user_id), DIRTY_KEY]
+        args = [
+            settings.LOCKOUT_THRESHOLD,
+            settings.LOCKOUT_BASE_SECONDS * 1000,
+            settings.LOCKOUT_MAX_SECONDS * 1000,
+            settings.LOCKOUT_RESET_SECONDS * 1000,
+            str(uuid.UUID(str(user_id))),
+        ]
+        return keys, args
+
+    def _observe(self, user_id, reply) -> int:
+        failures, lock_ms = (int(value) for value in reply)
+        LOCKOUT_EVENTS.inc("failure")
+        if lock_ms <= 0:
+            return 0
+        LOCKOUT_EVENTS.inc("locked")
+        rate_limit_service.local.lock(lockout_key(user_id), lock_ms / 1000)
+        logger.info("Locked out user %s for %d s after %d failed verifies", user_id, lock_ms // 1000, failures)
+        return -(-lock_ms // 1000)
+
+    async def record_failure(self, user_id) -> int:
+        """Count a failed verify; returns the seconds the user is now locked for, 0 if not locked"""
+        keys, args = self._failure_args(user_id)
+        try:
+            with REDIS_SECONDS.time("lockout"):
+                reply = await asyncio.wait_for(self.script(keys=keys, args=args), self.redis_timeout)
+        except (RedisError, OSError, asyncio.TimeoutError):
+            REDIS_ERRORS.inc("lockout")
+            logger.warning("Failed to record a failed verify for lockout", exc_info=True)
+            return 0
+        return self._observe(user_id, reply)
+
+    async def record_success(self, user_id, failures: int):
+        """Clear the failures a user had before a successful verify (nothing to do when there were none)"""
+        if failures <= 0:
+            return
+        await self.record_many([(user_id, True, failures)])
+
+    async def record_many(self, outcomes: Sequence[Tuple[object, bool, int]]) -> List[int]:
+        """
+        record_failure()/record_success() for (user_id, verified, prior
+        failures) outcomes, pipelined into one round trip. Returns the lock
+        seconds per outcome.
+        """
+        pipe = self.redis.pipeline(transaction=False)
+        calls = []
+        for index, (user_id, verified, failures) in enumerate(outcomes):
+            if not verified:
+                keys, args = self._failure_args(user_id)
+                await self.script(keys=keys, args=args, client=pipe)
+                calls.append((index, user_id))
+            elif failures > 0:
+                pipe.delete(lockout_key(user_id))
+                pipe.sadd(DIRTY_KEY, str(uuid.UUID(str(user_id))))
+                calls.append((index, None))
+        locks = [0] * len(outcomes)
+        if not calls:
+            return locks
+        try:
+            with REDIS_SECONDS.time("lockout_batch"):
+                replies = await asyncio.wait_for(pipe.execute(), self.redis_timeout)
+        except (RedisError, OSError, asyncio.TimeoutError):
+            REDIS_ERRORS.inc("lockout_batch")
+            logger.warning("Failed to record verify outcomes for lockout", exc_info=True)
+            return locks
+        # A success queued two commands, a failure one
+        replies = iter(replies)
+        for index, user_id in calls:
+            reply = next(replies)
+            if user_id is None:
+                next(replies)
+                LOCKOUT_EVENTS.inc("reset")
+            else:
+                locks[index] = self._observe(user_id, reply)
+        return locks
+
+    async def flush(self, batch_size: Optional[int] = None) -> int:
+        """
+        Write the current Redis state of up to batch_size changed users to
+        their active authenticator in one executemany UPDATE. Users are
+        popped from the dirty set, so concurrent workers never write the same
+        user twice, and put back when the write fails.
+        """
+        members = await self.redis.spop(DIRTY_KEY, batch_size or settings.LOCKOUT_WRITE_BEHIND_BATCH_SIZE)
+        if not members:
+            return 0
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            for member in members:
+                pipe.hmget(lockout_key(member), "failures", "locked_until")
+            states = await pipe.execute()
+
+            rows: List[Dict] = []
+            for member, (failures, locked_until) in zip(members, states):
+                rows.append({
+                    "b_user_id": uuid.UUID(member),
+                    "b_failed_attempts": int(failures or 0),
+                    "b_locked_until": datetime.utcfromtimestamp(int(locked_until) / 1000) if locked_until else None,
+                })
+            table = Authenticator.__table__
+            statement = (
+                update(table)
+                .where(table.c.user_id == bindparam("b_user_id"), table.c.status == AuthenticatorStatus.ACTIVE.value)
+                .values(
+                    failed_attempts=bindparam("b_failed_attempts"),
+                    locked_until=bindparam("b_locked_until"),
+                    updated_at=table.c.updated_at,
+                )
+            )
+            async with AsyncSessionLocal() as db:
+                connection = await db.connection()
+                await connection.execute(statement, rows)
+                await db.commit()
+        except BaseException:  # cancellation included, or the popped users would be lost
+            await self.redis.sadd(DIRTY_KEY, *members)
+            raise
+        LOCKOUT_EVENTS.inc("written", amount=len(rows))
+        return len(rows)
+
+    async def flush_all(self) -> int:
+        """flush() until the dirty set is empty"""
+        written = 0
+        while True:
+            count = await self.flush()
+            written += count
+            if count < settings.LOCKOUT_WRITE_BEHIND_BATCH_SIZE:
+                return written
+
+    async def write_behind_loop(self, interval_seconds: int):
+        """Periodically write changed lockout state to the database until cancelled"""
+        while True:
+            await asyncio.sleep(interval_seconds)
+            try:
+                await self.flush_all()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Lockout write-behind failed")
+
+lockout_service = LockoutService()
@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import re
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from app.core.config import settings
+from app.core.database import engine
+
+logger = logging.getLogger(__name__)
+
+PARENT_TABLE = "auth_events"
+# Arbitrary constant so concurrent workers never run maintenance at the same time
+ADVISORY_LOCK_ID = 7_318_046_211
+
+_BOUND_RE = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+def period_start(value: datetime, interval: str) -> datetime:
+    if interval == "day":
+        return datetime(value.year, value.month, value.day)
+    return datetime(value.year, value.month, 1)
+
+def next_period(start: datetime, interval: str) -> datetime:
+    if interval == "day":
+        return start + timedelta(days=1)
+    return datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+
+def partition_name(start: datetime, interval: str) -> str:
+    if interval == "day":
+        return start.strftime(f"{PARENT_TABLE}_p%Y_%m_%d")
+    return start.strftime(f"{PARENT_TABLE}_p%Y_%m")
+
+async def list_partitions(conn: AsyncConnection) -> dict:
+    """Map of attached range partitions to their (lower, upper) bounds"""
+    result = await conn.execute(text(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) "
+        "FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid "
+        "JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = :parent"
+    ), {"parent": PARENT_TABLE})
+    partitions = {}
+    for name, bound in result:
+        match = _BOUND_RE.search(bound or "")
+        if match:
+            partitions[name] = tuple(datetime.fromisoformat(value) for value in match.groups())
+    return partitions
+
+async def ensure_partitions(conn: AsyncConnection, now: Optional[datetime] = None, dry_run: bool = False) -> List[str]:
+    """Create the current partition and AUTH_EVENTS_PARTITIONS_AHEAD future ones"""
+    interval = settings.AUTH_EVENTS_PARTITION_INTERVAL
+    existing = await list_partitions(conn)
+    start = period_start(now or datetime.utcnow(), interval)
+
+    created = []
+    for _ in range(settings.AUTH_EVENTS_PARTITIONS_AHEAD + 1):
+        upper = next_period(start, interval)
+        name = partition_name(start, interval)
+        overlaps = any(lower < upper and start < existing_upper for lower, existing_upper in existing.values())
+        if name not in existing and not overlaps:
+            if not dry_run:
+                await conn.execute(text(
+                    f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {PARENT_TABLE} "
+                    f"FOR VALUES FROM ('{start.isoformat(sep=' ')}') TO ('{upper.isoformat(sep=' ')}')"
+                ))
+            created.append(name)
+        start = upper
+    return created
+
+async def expire_partitions(conn: AsyncConnection, now: Optional[datetime] = None, dry_run: bool = False) -> List[str]:
+    """Detach or drop partitions entirely older than AUTH_EVENTS_RETENTION_DAYS"""
+    if settings.AUTH_EVENTS_RETENTION_DAYS <= 0:
+        return []
+    cutoff = (now or datetime.utcnow()) - timedelta(days=settings.AUTH_EVENTS_RETENTION_DAYS)
+
+    expired = []
+    for name, (_, upper) in sorted((await list_partitions(conn)).items()):
+        if upper > cutoff:
+            continue
+        if not dry_run:
+            await conn.execute(text(f"ALTER TABLE {PARENT_TABLE} DETACH PARTITION {name}"))
+            if settings.AUTH_EVENTS_RETENTION_ACTION == "drop":
+                await conn.execute(text(f"DROP TABLE {name}"))
+        expired.append(name)
+    return expired
+
+async def run_maintenance(dry_run: bool = False) -> dict:
+    """One maintenance pass; a no-op on databases without partitioning"""
+    if engine.dialect.name != "postgresql":
+        return {"created": [], "expired": []}
+    async with engine.begin() as conn:
+        locked = (await conn.execute(text("SELECT pg_try_advisory_xact_lock(:id)"), {"id": ADVISORY_LOCK_ID})).scalar()
+        if not locked:
+            return {"created": [], "expired": []}
+        created = await ensure_partitions(conn, dry_run=dry_run)
+        expired = await expire_partitions(conn, dry_run=dry_run)
+    if created or expired:
+        logger.info("auth_events partitions created=%s expired=%s", created, expired)
+    return {"created": created, "expired": expired}
+
+async def maintenance_loop(interval_seconds: int):
+    """Run maintenance periodically until cancelled"""
+    while True:
+        try:
+            await run_maintenance()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("auth_events partition maintenance failed")
+        await asyncio.sleep(interval_seconds)
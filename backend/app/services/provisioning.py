@@ -0,0 +1,170 @@
+import asyncio
+import binascii
+import uuid
+from concurrent.futures import Executor
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import List, Optional, Sequence
+
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.models.authenticator import Authenticator, AuthenticatorStatus
+from app.models.user import User
+from app.services.audit import audit_writer
+from app.services.cpu_executor import cpu_executor
+from app.services.encryption import encrypt_many
+from app.services.totp import totp_service
+
+AUTHENTICATOR_COLUMNS = [
+    "id", "user_id", "secret_encrypted", "display_name", "issuer", "status", "created_at", "updated_at",
+    "provision_token", "provision_token_expires_at", "failed_attempts", "locked_until",
+]
+
+@dataclass
+class ProvisionRecord:
+    user_id: str
+    secret_base32: Optional[str] = None  # An existing secret to import as ACTIVE
+    display_name: Optional[str] = "User"
+    issuer: Optional[str] = "CustomAuthenticator"
+
+@dataclass
+class ProvisionOutcome:
+    user_id: str
+    status: str  # "created", "imported", "user_only", "skipped" or "invalid"
+    error: Optional[str] = None
+    secret_base32: Optional[str] = None
+    provision_token: Optional[uuid.UUID] = None
+    expires_at: Optional[datetime] = None
+    authenticator_id: Optional[uuid.UUID] = None
+
+async def encrypt_secrets(secrets: Sequence[str], executor: Optional[Executor] = None, workers: int = 1) -> List[bytes]:
+    """
+    Encrypt secrets off the event loop, split across `workers` slots of the
+    given pool; without one, on the shared CPU executor.
+    """
+    if not secrets:
+        return []
+    if executor is None:
+        return await cpu_executor.run_batch("encrypt_batch", len(secrets), encrypt_many, [secret.encode() for secret in secrets])
+    loop = asyncio.get_running_loop()
+    size = -(-len(secrets) // max(workers, 1))
+    chunks = [[secret.encode() for secret in secrets[start:start + size]] for start in range(0, len(secrets), size)]
+    encrypted = await asyncio.gather(*(loop.run_in_executor(executor, encrypt_many, chunk) for chunk in chunks))
+    return [ciphertext for chunk in encrypted for ciphertext in chunk]
+
+async def _copy_rows(db: AsyncSession, table: str, columns: List[str], rows: List[dict]):
+    connection = await db.connection()
+    raw = await connection.get_raw_connection()
+    await raw.driver_connection.copy_records_to_table(
+        table, records=[tuple(row[column] for column in columns) for row in rows], columns=columns
+    )
+
+async def provision_bulk(
+    db: AsyncSession,
+    records: Sequence[ProvisionRecord],
+    generate_missing: bool = True,
+    executor: Optional[Executor] = None,
+    workers: int = 1,
+    use_copy: bool = False,
+) -> List[ProvisionOutcome]:
+    """
+    Provision many users in one transaction (committed by the caller).
+
+    Records with a secret become ACTIVE authenticators. Records without one get
+    a fresh PENDING authenticator when generate_missing is set, otherwise only
+    the user row. Users that already have an active authenticator are skipped.
+    Rows are loaded with COPY when use_copy is set and the driver is asyncpg,
+    and with multi-row INSERTs otherwise.
+    """
+    outcomes = []
+    valid = []
+    seen = set()
+    for record in records:
+        try:
+            user_id = uuid.UUID(str(record.user_id))
+            if record.secret_base32:
+                totp_service.decode_secret(record.secret_base32)
+        except (ValueError, binascii.Error):
+            outcomes.append(ProvisionOutcome(user_id=record.user_id, status="invalid", error="Invalid user_id or secret"))
+            continue
+        if user_id in seen:
+            outcomes.append(ProvisionOutcome(user_id=record.user_id, status="skipped", error="Duplicate user_id"))
+            continue
+        seen.add(user_id)
+        outcome = ProvisionOutcome(user_id=record.user_id, status="pending")
+        outcomes.append(outcome)
+        valid.append((user_id, record, outcome))
+
+    if not valid:
+        return outcomes
+
+    user_ids = [user_id for user_id, _, _ in valid]
+    existing_users = set((await db.execute(select(User.id).where(User.id.in_(user_ids)))).scalars())
+    active_users = set((await db.execute(
+        select(Authenticator.user_id).where(Authenticator.user_id.in_(user_ids), Authenticator.status == AuthenticatorStatus.ACTIVE)
+    )).scalars())
+
+    now = datetime.utcnow()
+    expires_at = now + timedelta(hours=settings.BULK_PROVISION_TOKEN_TTL_HOURS)
+    user_rows = []
+    pending = []
+    for user_id, record, outcome in valid:
+        if user_id not in existing_users:
+            user_rows.append({"id": user_id, "email": None, "username": None})
+        if user_id in active_users:
+            outcome.status, outcome.error = "skipped", "User already has an active authenticator"
+        elif record.secret_base32:
+            pending.append((user_id, record, outcome, record.secret_base32.upper(), True))
+        elif generate_missing:
+            pending.append((user_id, record, outcome, totp_service.generate_secret(), False))
+        else:
+            outcome.status = "user_only"
+
+    encrypted = await encrypt_secrets([secret for *_, secret, _ in pending], executor, workers)
+
+    authenticator_rows = []
+    events = []
+    for (user_id, record, outcome, secret, imported), secret_encrypted in zip(pending, encrypted):
+        authenticator_id = uuid.uuid4()
+        token = None if imported else uuid.uuid4()
+        authenticator_rows.append({
+            "id": authenticator_id,
+            "user_id": user_id,
+            "secret_encrypted": secret_encrypted,
+            "display_name": record.display_name,
+            "issuer": record.issuer,
+            "status": AuthenticatorStatus.ACTIVE.value if imported else AuthenticatorStatus.PENDING.value,
+            "created_at": now,
+            "updated_at": now,
+            "provision_token": token,
+            "provision_token_expires_at": None if imported else expires_at,
+            "failed_attempts": 0,
+            "locked_until": None,
+        })
+        events.append(audit_writer.build_event(
+            user_id=user_id,
+            authenticator_id=authenticator_id,
+            event_type="provision_import" if imported else "provision_init",
+            detail={"authenticator_id": str(authenticator_id), "bulk": True},
+        ))
+        outcome.status = "imported" if imported else "created"
+        outcome.authenticator_id = authenticator_id
+        if not imported:
+            outcome.secret_base32 = secret
+            outcome.provision_token = token
+            outcome.expires_at = expires_at
+
+    if use_copy and db.bind.dialect.driver == "asyncpg":
+        if user_rows:
+            await _copy_rows(db, User.__tablename__, ["id"], user_rows)
+        if authenticator_rows:
+            await _copy_rows(db, Authenticator.__tablename__, AUTHENTICATOR_COLUMNS, authenticator_rows)
+    else:
+        if user_rows:
+            await db.execute(insert(User), user_rows)
+        if authenticator_rows:
+            await db.execute(insert(Authenticator), authenticator_rows)
+    await audit_writer.record_many(db, events, commit=False)
+    return outcomes
@@ -0,0 +1,76 @@
+import base64
+import io
+from typing import TYPE_CHECKING, Optional
+
+from app.services.cpu_executor import cpu_executor
+
+if TYPE_CHECKING:
+    import qrcode
+
+QR_FORMATS = ("svg", "svg-compact", "png", "none")
+
+def _compact_svg(qr: "qrcode.QRCode", box_size: int) -> str:
+    """One path of horizontal runs in module units, scaled by the viewBox"""
+    matrix = qr.get_matrix()
+    size = len(matrix)
+    runs = []
+    for y, row in enumerate(matrix):
+        x = 0
+        while x < size:
+            if not row[x]:
+                x += 1
+                continue
+            start = x
+            while x < size and row[x]:
+                x += 1
+            runs.append(f"M{start} {y}h{x - start}v1h-{x - start}z")
+    pixels = size * box_size
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{pixels}" height="{pixels}" '
+        f'viewBox="0 0 {size} {size}" shape-rendering="crispEdges">'
+        f'<rect width="{size}" height="{size}" fill="#fff"/><path d="{"".join(runs)}"/></svg>'
+    )
+
+def render_qr(uri: str, fmt: str = "svg", box_size: int = 10, border: int = 4) -> Optional[str]:
+    """
+    Render uri as a QR code. Module level so it can run in a process pool.
+    Returns SVG markup, a PNG data URI, or None for fmt="none".
+    """
+    if fmt == "none":
+        return None
+    if fmt not in QR_FORMATS:
+        raise ValueError(f"Unknown QR format: {fmt}")
+
+    # Imported on first render: qrcode pulls in Pillow, which workers that
+    # only verify codes never need
+    import qrcode
+    import qrcode.image.svg
+
+    qr = qrcode.QRCode(box_size=box_size, border=border)
+    qr.add_data(uri)
+    qr.make(fit=True)
+
+    if fmt == "svg-compact":
+        return _compact_svg(qr, box_size)
+
+    stream = io.BytesIO()
+    if fmt == "svg":
+        qr.make_image(image_factory=qrcode.image.svg.SvgPathImage).save(stream)
+        return stream.getvalue().decode()
+
+    qr.make_image().save(stream, format="PNG")
+    return "data:image/png;base64," + base64.b64encode(stream.getvalue()).decode()
+
+class QRService:
+    """
+    Renders QR codes on the CPU executor. Nothing is cached: every URI holds
+    a fresh secret, so a render never repeats and keeping one would only
+    keep the secret in memory.
+    """
+
+    async def render(self, uri: str, fmt: str = "svg", box_size: int = 10, border: int = 4) -> Optional[str]:
+        if fmt == "none":
+            return None
+        return await cpu_executor.run("qr_render", render_qr, uri, fmt, box_size, border)
+
+qr_service = QRService()
@@ -1,26 +1,374 @@
-import redis.asyncio as redis
+import asyncio
+import logging
+import math
+import time
+import uuid
+import zlib
+from collections import deque
+from dataclasses import dataclass
+from typing import List, NamedTuple, Optional, Sequence
+
+from redis.exceptions import RedisError
+
 from app.core.config import settings
+from app.core.metrics import REDIS_ERRORS, REDIS_SECONDS
+from app.core.redis import redis_client
 from fastapi import HTTPException, status
 
+# Sliding-window log over one sorted set per limit. Every limit passed in one
+# call is evaluated against the same server clock, and the attempt is only
+# recorded when all of them allow it, so the check is atomic across keys.
+# An optional lockout hash (app.services.lockout) is read in the same call;
+# while it is locked the attempt is rejected without touching the windows.
+#   KEYS: one sorted set per limit, then the lockout hash if any
+#   ARGV: unique member, number of limits, then (limit, window_ms) per limit
+# Returns {allowed, remaining, retry_after_ms, {retry_after_ms per key},
+#          failures, lock_ms}.
+SLIDING_WINDOW_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local member = ARGV[1]
+local limits = tonumber(ARGV[2])
+local counts = {}
+local allowed = 1
+
+local failures = 0
+if #KEYS > limits then
+    local state = redis.call('HMGET', KEYS[#KEYS], 'failures', 'locked_until')
+    failures = tonumber(state[1]) or 0
+    local lock = (tonumber(state[2]) or 0) - now
+    if lock > 0 then
+        return {0, 0, lock, {}, failures, lock}
+    end
+end
+
+for i = 1, limits do
+    local key = KEYS[i]
+    local limit = tonumber(ARGV[i * 2 + 1])
+    local window = tonumber(ARGV[i * 2 + 2])
+    redis.call('ZREMRANGEBYSCORE', key, '-inf', now - window)
+    counts[i] = redis.call('ZCARD', key)
+    if counts[i] >= limit then
+        allowed = 0
+    end
+end
+
+local remaining = -1
+local retry_after = 0
+local key_retry_after = {}
+for i = 1, limits do
+    local key = KEYS[i]
+    local limit = tonumber(ARGV[i * 2 + 1])
+    local window = tonumber(ARGV[i * 2 + 2])
+    if allowed == 1 then
+        redis.call('ZADD', key, now, member)
+        redis.call('PEXPIRE', key, window)
+        counts[i] = counts[i] + 1
+    end
+    local left = math.max(limit - counts[i], 0)
+    if remaining < 0 or left < remaining then
+        remaining = left
+    end
+    key_retry_after[i] = 0
+    if counts[i] >= limit then
+        -- The next attempt fits once the entry that fills the window expires
+        local index = counts[i] - limit
+        local oldest = redis.call('ZRANGE', key, index, index, 'WITHSCORES')
+        if oldest[2] then
+            key_retry_after[i] = tonumber(oldest[2]) + window - now
+            retry_after = math.max(retry_after, key_retry_after[i])
+        end
+    end
+end
+
+return {allowed, remaining, retry_after, key_retry_after, failures, 0}
+"""
+
+class RateLimit(NamedTuple):
+    key: str
+    limit: int
+    window: int  # seconds
+
+@dataclass
+class RateLimitResult:
+    allowed: bool
+    remaining: int
+    retry_after: int  # seconds until another attempt would be allowed
+    failures: int = 0  # consecutive failures on the lockout key before this attempt
+    locked: bool = False  # rejected by the lockout rather than a limit
+
+def verify_limits(user_id, client_ip: Optional[str]) -> List[RateLimit]:
+    """Per-user and per-IP limits applied to TOTP verification"""
+    # Canonical form, so every spelling of one UUID shares the user's window
+    user_id = uuid.UUID(str(user_id))
+    limits = [RateLimit(f"rl:verify:user:{user_id}", settings.VERIFY_RATE_LIMIT_USER, settings.VERIFY_RATE_LIMIT_USER_WINDOW)]
+    if client_ip:
+        limits.append(RateLimit(f"rl:verify:ip:{client_ip}", settings.VERIFY_RATE_LIMIT_IP, settings.VERIFY_RATE_LIMIT_IP_WINDOW))
+    return limits
+
+logger = logging.getLogger(__name__)
+
+class _LocalKey:
+    __slots__ = ("window", "hits", "blocked_until")
+
+    def __init__(self, window: int):
+        self.window = window
+        self.hits = deque()  # wall-clock times of attempts admitted through this worker
+        self.blocked_until = 0.0  # learned from Redis: the key is full until then
+
+class LocalRateLimiter:
+    """
+    In-process tier in front of Redis. Keys are hashed over shards, each a
+    bounded dict, so bookkeeping stays cheap under a flood of distinct keys.
+
+    A key is rejected locally when Redis already reported it full, or when
+    this worker alone has seen `limit` attempts in the window (the global
+    count can only be higher). While Redis is unreachable the same local
+    counters enforce approximate limits, and the attempts admitted meanwhile
+    are replayed to Redis in batches by sync(). Attempts admitted after a
+    timeout are not replayed: Redis may have counted them already.
+    """
+
+    def __init__(self, shards: int, max_keys_per_shard: int, max_pending: int):
+        self._shards = [dict() for _ in range(max(shards, 1))]
+        self.max_keys_per_shard = max_keys_per_shard
+        self.max_pending = max_pending
+        self.pending = []
+        self.local_rejections = 0
+        self.fallbacks = 0
+
+    def _shard(self, key: str) -> dict:
+        return self._shards[zlib.crc32(key.encode()) % len(self._shards)]
+
+    def _entry(self, limit: RateLimit, create: bool = False) -> Optional[_LocalKey]:
+        shard = self._shard(limit.key)
+        entry = shard.get(limit.key)
+        if entry is None and create:
+            if len(shard) >= self.max_keys_per_shard:
+                # Drop the oldest-inserted key; Redis still has the real count
+                del shard[next(iter(shard))]
+            entry = shard[limit.key] = _LocalKey(limit.window)
+        return entry
+
+    @staticmethod
+    def _prune(entry: _LocalKey, now: float):
+        while entry.hits and entry.hits[0] <= now - entry.window:
+            entry.hits.popleft()
+
+    def lock(self, key: str, seconds: float):
+        """Remember that a lockout key is locked, so attempts are rejected without Redis"""
+        entry = self._entry(RateLimit(key, 0, 0), create=True)
+        entry.blocked_until = max(entry.blocked_until, time.time() + seconds)
+
+    def precheck(self, limits: Sequence[RateLimit], lockout_key: Optional[str] = None) -> Optional[RateLimitResult]:
+        """A rejection if the lockout key is locked or any key is known to be over its limit, else None"""
+        now = time.time()
+        if lockout_key is not None:
+            entry = self._entry(RateLimit(lockout_key, 0, 0))
+            if entry is not None and entry.blocked_until > now:
+                self.local_rejections += 1
+                return RateLimitResult(allowed=False, remaining=0, retry_after=math.ceil(entry.blocked_until - now), locked=True)
+        retry_after = 0.0
+        for limit in limits:
+            entry = self._entry(limit)
+            if entry is None:
+                continue
+            if entry.blocked_until > now:
+                retry_after = max(retry_after, entry.blocked_until - now)
+                continue
+            self._prune(entry, now)
+            if len(entry.hits) >= limit.limit:
+                oldest = entry.hits[len(entry.hits) - limit.limit]
+                retry_after = max(retry_after, oldest + limit.window - now)
+        if retry_after <= 0:
+            return None
+        self.local_rejections += 1
+        return RateLimitResult(allowed=False, remaining=0, retry_after=math.ceil(retry_after))
+
+    def observe(self, limits: Sequence[RateLimit], result: RateLimitResult, key_retry_after: Sequence[int]):
+        """Mirror a Redis decision into the local counters"""
+        now = time.time()
+        for limit, retry_after_ms in zip(limits, key_retry_after):
+            entry = self._entry(limit, create=True)
+            if result.allowed:
+                entry.hits.append(now)
+            if retry_after_ms > 0:
+                entry.blocked_until = now + retry_after_ms / 1000
+
+    def fallback(self, limits: Sequence[RateLimit], replay: bool = True) -> RateLimitResult:
+        """Admit an attempt on local counters only; call after precheck()"""
+        now = time.time()
+        self.fallbacks += 1
+        remaining = None
+        for limit in limits:
+            entry = self._entry(limit, create=True)
+            self._prune(entry, now)
+            entry.hits.append(now)
+            left = max(limit.limit - len(entry.hits), 0)
+            remaining = left if remaining is None else min(remaining, left)
+            if replay and len(self.pending) < self.max_pending:
+                self.pending.append((limit, now))
+        return RateLimitResult(allowed=True, remaining=remaining or 0, retry_after=0)
+
+    async def sync(self, client):
+        """Replay attempts admitted during a Redis outage and drop idle keys"""
+        pending, self.pending = self.pending, []
+        if pending:
+            pipe = client.pipeline(transaction=False)
+            for limit, at in pending:
+                pipe.zadd(limit.key, {f"{uuid.uuid4().hex}": int(at * 1000)})
+                pipe.pexpire(limit.key, limit.window * 1000)
+            try:
+                await pipe.execute()
+            except (RedisError, OSError):
+                self.pending = (pending + self.pending)[-self.max_pending:]
+                raise
+
+        now = time.time()
+        for shard in self._shards:
+            for key in [key for key, entry in shard.items() if entry.blocked_until <= now]:
+                entry = shard[key]
+                self._prune(entry, now)
+                if not entry.hits:
+                    del shard[key]
+
+    def stats(self) -> dict:
+        return {
+            "keys": sum(len(shard) for shard in self._shards),
+            "local_rejections": self.local_rejections,
+            "fallbacks": self.fallbacks,
+            "pending_sync": len(self.pending),
+        }
+
 class RateLimitService:
     def __init__(self):
-        self.redis = redis.from_url(settings.REDIS_URL, encoding="utf-8", decode_responses=True)
+        self.redis = redis_client
+        # Runs as EVALSHA, loading the script on the first NOSCRIPT
+        self.script = self.redis.register_script(SLIDING_WINDOW_SCRIPT)
+        self.local = LocalRateLimiter(
+            shards=settings.RATE_LIMIT_LOCAL_SHARDS,
+            max_keys_per_shard=settings.RATE_LIMIT_LOCAL_MAX_KEYS_PER_SHARD,
+            max_pending=settings.RATE_LIMIT_LOCAL_MAX_PENDING,
+        )
+        self.redis_timeout = settings.RATE_LIMIT_REDIS_TIMEOUT_MS / 1000
+        self.redis_item_timeout = settings.RATE_LIMIT_REDIS_TIMEOUT_PER_ITEM_MS / 1000
+
+    async def load_scripts(self):
+        """SCRIPT LOAD up front so the first attempts skip the NOSCRIPT round trip"""
+        await self.redis.script_load(SLIDING_WINDOW_SCRIPT)
+
+    @staticmethod
+    def _script_args(limits: Sequence[RateLimit], lockout_key: Optional[str] = None):
+        keys = [limit.key for limit in limits]
+        if lockout_key is not None:
+            keys.append(lockout_key)
+        args = [uuid.uuid4().hex, len(limits)]
+        for limit in limits:
+            args.extend((limit.limit, limit.window * 1000))
+        return keys, args
 
-    async def check_rate_limit(self, key: str, limit: int, window: int):
+    def _result(self, limits: Sequence[RateLimit], reply, lockout_key: Optional[str] = None) -> RateLimitResult:
+        allowed, remaining, retry_after_ms, key_retry_after, failures, lock_ms = reply
+        result = RateLimitResult(
+            allowed=bool(allowed),
+            remaining=int(remaining),
+            retry_after=math.ceil(int(retry_after_ms) / 1000),
+            failures=int(failures),
+            locked=int(lock_ms) > 0,
+        )
+        if result.locked:
+            self.local.lock(lockout_key, int(lock_ms) / 1000)
+        self.local.observe(limits, result, [int(value) for value in key_retry_after])
+        return result
+
+    def _fallback(self, limits: Sequence[RateLimit], replay: bool = True) -> RateLimitResult:
+        if not settings.RATE_LIMIT_LOCAL_FALLBACK:
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Rate limiter unavailable")
+        return self.local.fallback(limits, replay)
+
+    async def hit(self, limits: Sequence[RateLimit], lockout_key: Optional[str] = None) -> RateLimitResult:
+        """
+        Record one attempt against every limit in a single round trip. With a
+        lockout_key the same call rejects a locked subject and reports its
+        failure count; without Redis only locks already seen are enforced.
+        """
+        rejected = self.local.precheck(limits, lockout_key)
+        if rejected is not None:
+            return rejected
+        keys, args = self._script_args(limits, lockout_key)
+        try:
+            with REDIS_SECONDS.time("rate_limit"):
+                reply = await asyncio.wait_for(self.script(keys=keys, args=args), self.redis_timeout)
+        except (RedisError, OSError, asyncio.TimeoutError) as exc:
+            REDIS_ERRORS.inc("rate_limit")
+            logger.warning("Redis rate limit check failed, enforcing locally", exc_info=True)
+            return self._fallback(limits, replay=not isinstance(exc, asyncio.TimeoutError))
+        return self._result(limits, reply, lockout_key)
+
+    async def hit_many(
+        self,
+        batches: Sequence[Sequence[RateLimit]],
+        lockout_keys: Optional[Sequence[Optional[str]]] = None,
+    ) -> List[RateLimitResult]:
+        """hit() for many independent attempts, pipelined into one round trip"""
+        lockout_keys = lockout_keys or [None] * len(batches)
+        results = [self.local.precheck(limits, key) for limits, key in zip(batches, lockout_keys)]
+        remote = [index for index, result in enumerate(results) if result is None]
+        if not remote:
+            return results
+
+        pipe = self.redis.pipeline(transaction=False)
+        for index in remote:
+            keys, args = self._script_args(batches[index], lockout_keys[index])
+            await self.script(keys=keys, args=args, client=pipe)
+        # Redis runs the scripts one after another, so the budget grows with the batch
+        timeout = self.redis_timeout + len(remote) * self.redis_item_timeout
+        try:
+            with REDIS_SECONDS.time("rate_limit_batch"):
+                replies = await asyncio.wait_for(pipe.execute(), timeout)
+        except (RedisError, OSError, asyncio.TimeoutError) as exc:
+            REDIS_ERRORS.inc("rate_limit_batch")
+            logger.warning("Redis rate limit check failed, enforcing locally", exc_info=True)
+            # A timed-out pipeline may have run, in part or in full; replaying it would count twice
+            replay = not isinstance(exc, asyncio.TimeoutError)
+            for index in remote:
+                results[index] = self.local.precheck(batches[index], lockout_keys[index]) or self._fallback(batches[index], replay)
+            return results
+        for index, reply in zip(remote, replies):
+            results[index] = self._result(batches[index], reply, lockout_keys[index])
+        return results
+
+    async def check(self, limits: Sequence[RateLimit], lockout_key: Optional[str] = None) -> RateLimitResult:
+        """hit() that raises 429 with Retry-After when locked out or any limit is exceeded"""
+        result = await self.hit(limits, lockout_key)
+        if not result.allowed:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many failed attempts" if result.locked else "Rate limit exceeded",
+                headers={"Retry-After": str(result.retry_after)},
+            )
+        return result
+
+    async def check_rate_limit(self, key: str, limit: int, window: int) -> RateLimitResult:
         """
         Check if the key has exceeded the limit in the window.
         key: Unique identifier (e.g., user_id or ip)
         limit: Max attempts
         window: Time window in seconds
         """
-        current = await self.redis.incr(key)
-        if current == 1:
-            await self.redis.expire(key, window)
-        
-        if current > limit:
-            raise HTTPException(
-                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-                detail="Rate limit exceeded"
-            )
+        return await self.check([RateLimit(key, limit, window)])
+
+    async def sync_loop(self, interval: float):
+        """Periodically push locally admitted attempts to Redis until cancelled"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                with REDIS_SECONDS.time("rate_limit_sync"):
+                    await asyncio.wait_for(self.local.sync(self.redis), self.redis_timeout * 10)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                REDIS_ERRORS.inc("rate_limit_sync")
+                logger.warning("Local rate limit sync failed", exc_info=True)
 
 rate_limit_service = RateLimitService()
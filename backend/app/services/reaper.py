@@ -0,0 +1,104 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import delete, literal, select, update
+
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.core.metrics import REAPER_BATCH_SECONDS, REAPER_ROWS
+from app.models.auth_event import AuthEvent
+from app.models.authenticator import Authenticator, AuthenticatorStatus, BackupCode
+
+logger = logging.getLogger(__name__)
+
+def expired_pending_statement(cutoff: datetime, batch_size: int):
+    """
+    Oldest expired PENDING authenticators, locked; rows another transaction
+    holds (a verify-setup in progress, another reaper) are skipped.
+    """
+    return (
+        select(Authenticator.id)
+        .where(
+            # Inlined rather than bound, so even a generic plan can use the partial index
+            Authenticator.status == literal(AuthenticatorStatus.PENDING.value, literal_execute=True),
+            Authenticator.provision_token_expires_at < cutoff,
+        )
+        .order_by(Authenticator.provision_token_expires_at)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    )
+
+def detach_events_statement(authenticator_ids: List):
+    # Audit rows are kept; their detail still names the authenticator
+    return (
+        update(AuthEvent)
+        .where(AuthEvent.authenticator_id.in_(authenticator_ids))
+        .values(authenticator_id=None)
+    )
+
+async def reap_batch(cutoff: datetime, batch_size: int) -> Dict[str, int]:
+    """Delete one batch of expired pending authenticators and their dependent rows in one short transaction"""
+    async with AsyncSessionLocal() as session:
+        with REAPER_BATCH_SECONDS.time():
+            ids = (await session.execute(expired_pending_statement(cutoff, batch_size))).scalars().all()
+            if not ids:
+                await session.rollback()
+                return {}
+            events = await session.execute(detach_events_statement(ids))
+            codes = await session.execute(delete(BackupCode).where(BackupCode.authenticator_id.in_(ids)))
+            authenticators = await session.execute(delete(Authenticator).where(Authenticator.id.in_(ids)))
+            await session.commit()
+
+    REAPER_ROWS.inc("authenticators", "deleted", amount=authenticators.rowcount)
+    REAPER_ROWS.inc("backup_codes", "deleted", amount=codes.rowcount)
+    REAPER_ROWS.inc("auth_events", "detached", amount=events.rowcount)
+    return {
+        "authenticators": authenticators.rowcount,
+        "backup_codes": codes.rowcount,
+        "auth_events_detached": events.rowcount,
+    }
+
+async def reap_expired(
+    batch_size: Optional[int] = None,
+    grace: Optional[timedelta] = None,
+    max_batches: Optional[int] = None,
+    pause: float = 0.0,
+) -> Dict[str, int]:
+    """
+    Reap until no expired pending authenticators remain (or max_batches).
+    Rows are only reaped once their token has been expired for the grace
+    period, so verify-setup keeps answering "expired" rather than "invalid"
+    for a while.
+    """
+    batch_size = batch_size or settings.PENDING_REAPER_BATCH_SIZE
+    if grace is None:
+        grace = timedelta(minutes=settings.PENDING_REAPER_GRACE_MINUTES)
+    cutoff = datetime.utcnow() - grace
+
+    totals: Dict[str, int] = {}
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        counts = await reap_batch(cutoff, batch_size)
+        batches += 1
+        for table, count in counts.items():
+            totals[table] = totals.get(table, 0) + count
+        if counts.get("authenticators", 0) < batch_size:
+            break
+        if pause:
+            await asyncio.sleep(pause)
+    if totals.get("authenticators"):
+        logger.info("Reaped expired pending authenticators: %s", totals)
+    return totals
+
+async def reaper_loop(interval_seconds: int):
+    """Run the reaper periodically until cancelled"""
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            await reap_expired(pause=settings.PENDING_REAPER_BATCH_PAUSE_MS / 1000)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Pending authenticator reaper failed")
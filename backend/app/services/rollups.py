@@ -0,0 +1,175 @@
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, func, literal, select, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+from app.core.config import settings
+from app.core.database import engine
+from app.models.audit_rollup import AuditRollup, AuditRollupState
+from app.models.auth_event import AuthEvent
+from app.models.authenticator import Authenticator
+
+logger = logging.getLogger(__name__)
+
+GRANULARITIES = {"minute": timedelta(minutes=1), "day": timedelta(days=1)}
+STATE_NAME = "auth_events"
+# Arbitrary constant so concurrent workers never roll up the same window twice
+ADVISORY_LOCK_ID = 7_318_046_212
+
+def floor_bucket(value: datetime, granularity: str) -> datetime:
+    if granularity == "day":
+        return datetime(value.year, value.month, value.day)
+    return value.replace(second=0, microsecond=0)
+
+def _upsert(conn: AsyncConnection, table, index_elements: List[str], updates):
+    insert = postgresql.insert if conn.dialect.name == "postgresql" else sqlite.insert
+    statement = insert(table)
+    return statement.on_conflict_do_update(index_elements=index_elements, set_=updates(statement.excluded))
+
+async def rollup_window(conn: AsyncConnection, lower: datetime, upper: datetime) -> int:
+    """Add the events created in [lower, upper) to the minute and day rollups; returns the event count"""
+    if conn.dialect.name == "postgresql":
+        bucket = func.date_trunc("minute", AuthEvent.created_at)
+    else:
+        bucket = func.strftime("%Y-%m-%d %H:%M:00", AuthEvent.created_at)
+    issuer = func.coalesce(Authenticator.issuer, "") if settings.AUDIT_ROLLUP_BY_ISSUER else literal("")
+
+    query = (
+        select(bucket, AuthEvent.event_type, issuer, func.count())
+        .where(AuthEvent.created_at >= lower, AuthEvent.created_at < upper)
+        .group_by(bucket, AuthEvent.event_type, issuer)
+    )
+    if settings.AUDIT_ROLLUP_BY_ISSUER:
+        query = query.select_from(AuthEvent).outerjoin(Authenticator, Authenticator.id == AuthEvent.authenticator_id)
+
+    counts: Dict[Tuple[str, datetime, str, str], int] = defaultdict(int)
+    events = 0
+    for minute, event_type, event_issuer, count in (await conn.execute(query)).all():
+        if not isinstance(minute, datetime):
+            minute = datetime.fromisoformat(minute)
+        counts["minute", minute, event_type, event_issuer] += count
+        counts["day", floor_bucket(minute, "day"), event_type, event_issuer] += count
+        events += count
+    if not counts:
+        return 0
+
+    table = AuditRollup.__table__
+    await conn.execute(
+        _upsert(conn, table, ["granularity", "bucket_start", "event_type", "issuer"],
+                lambda excluded: {"count": table.c.count + excluded.count}),
+        [
+            {"granularity": granularity, "bucket_start": bucket_start, "event_type": event_type, "issuer": event_issuer, "count": count}
+            for (granularity, bucket_start, event_type, event_issuer), count in counts.items()
+        ],
+    )
+    return events
+
+async def _initial_high_water(conn: AsyncConnection, upper: datetime) -> datetime:
+    oldest = (await conn.execute(select(func.min(AuthEvent.created_at)))).scalar()
+    if isinstance(oldest, str):
+        oldest = datetime.fromisoformat(oldest)
+    return floor_bucket(oldest, "minute") if oldest is not None and oldest < upper else upper
+
+async def rollup_step(now: Optional[datetime] = None) -> Optional[dict]:
+    """
+    Roll up the next window after the high-water mark in one transaction,
+    moving the mark with it, so every event is counted exactly once. Returns
+    None when nothing is due or another worker holds the lock.
+    """
+    upper = (now or datetime.utcnow()) - timedelta(seconds=settings.AUDIT_ROLLUP_LAG_SECONDS)
+    async with engine.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            locked = (await conn.execute(text("SELECT pg_try_advisory_xact_lock(:id)"), {"id": ADVISORY_LOCK_ID})).scalar()
+            if not locked:
+                return None
+        state = AuditRollupState.__table__
+        high_water = (await conn.execute(select(state.c.high_water).where(state.c.name == STATE_NAME))).scalar()
+        if high_water is None:
+            high_water = await _initial_high_water(conn, upper)
+        upper = min(upper, high_water + timedelta(hours=settings.AUDIT_ROLLUP_MAX_SPAN_HOURS))
+        if upper <= high_water:
+            return None
+
+        events = await rollup_window(conn, high_water, upper)
+        await conn.execute(
+            _upsert(conn, state, ["name"], lambda excluded: {"high_water": excluded.high_water}),
+            {"name": STATE_NAME, "high_water": upper},
+        )
+        if settings.AUDIT_ROLLUP_MINUTE_RETENTION_DAYS > 0:
+            await conn.execute(delete(AuditRollup).where(
+                AuditRollup.granularity == "minute",
+                AuditRollup.bucket_start < upper - timedelta(days=settings.AUDIT_ROLLUP_MINUTE_RETENTION_DAYS),
+            ))
+    return {"lower": high_water, "upper": upper, "events": events}
+
+async def run_rollups(now: Optional[datetime] = None) -> dict:
+    """Roll up window by window until caught up to the lag"""
+    windows = events = 0
+    high_water = None
+    while True:
+        step = await rollup_step(now)
+        if step is None:
+            break
+        windows += 1
+        events += step["events"]
+        high_water = step["upper"]
+    if windows:
+        logger.info("Rolled up %d auth events in %d windows, high water %s", events, windows, high_water)
+    return {"windows": windows, "events": events, "high_water": high_water}
+
+async def rollup_loop(interval_seconds: int):
+    """Keep the rollups current until cancelled"""
+    while True:
+        try:
+            await run_rollups()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Audit rollup failed")
+        await asyncio.sleep(interval_seconds)
+
+async def query_stats(
+    db: AsyncSession,
+    granularity: str,
+    since: datetime,
+    until: datetime,
+    event_type: Optional[str] = None,
+    issuer: Optional[str] = None,
+) -> dict:
+    """Counts per bucket and event type from the rollups, summed over issuers unless one is given"""
+    query = (
+        select(AuditRollup.bucket_start, AuditRollup.event_type, func.sum(AuditRollup.count))
+        .where(
+            AuditRollup.granularity == granularity,
+            AuditRollup.bucket_start >= floor_bucket(since, granularity),
+            AuditRollup.bucket_start < until,
+        )
+        .group_by(AuditRollup.bucket_start, AuditRollup.event_type)
+        .order_by(AuditRollup.bucket_start)
+    )
+    if event_type:
+        query = query.where(AuditRollup.event_type == event_type)
+    if issuer is not None:
+        query = query.where(AuditRollup.issuer == issuer)
+
+    buckets: Dict[datetime, Dict[str, int]] = {}
+    totals: Dict[str, int] = defaultdict(int)
+    for bucket_start, row_event_type, count in (await db.execute(query)).all():
+        buckets.setdefault(bucket_start, {})[row_event_type] = int(count)
+        totals[row_event_type] += int(count)
+
+    state = AuditRollupState.__table__
+    high_water = (await db.execute(select(state.c.high_water).where(state.c.name == STATE_NAME))).scalar()
+    return {
+        "granularity": granularity,
+        "since": floor_bucket(since, granularity),
+        "until": until,
+        "rolled_up_to": high_water,
+        "totals": dict(totals),
+        "buckets": [{"bucket_start": bucket_start, "counts": counts} for bucket_start, counts in buckets.items()],
+    }
@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+from app.core.config import settings
+from app.core.redis import redis_client
+from app.services.totp import TOTPKey
+
+logger = logging.getLogger(__name__)
+
+class CachedAuthenticator(NamedTuple):
+    id: uuid.UUID
+    status: str
+    key: TOTPKey  # Loaded HMAC state, ready for TOTPService.verify_key
+
+class SecretCache:
+    """
+    Bounded LRU/TTL cache of active authenticators keyed by user_id.
+    Invalidations are published on a Redis channel so every worker drops
+    its copy when /disable, /verify-setup or /provision changes the row.
+    """
+
+    def __init__(self, max_size: int, ttl: int, channel: str, enabled: bool = True):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.channel = channel
+        self.enabled = enabled and max_size > 0
+        self.redis = redis_client
+        self._entries = OrderedDict()
+        # Bumped on every invalidation so a fill that raced one is discarded
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _key(user_id) -> str:
+        try:
+            return str(uuid.UUID(str(user_id)))
+        except ValueError:
+            return str(user_id)
+
+    def get(self, user_id) -> Optional[CachedAuthenticator]:
+        if not self.enabled:
+            return None
+        key = self._key(user_id)
+        item = self._entries.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        expires_at, entry = item
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def set(self, user_id, entry: CachedAuthenticator, generation: int):
+        """Store entry unless an invalidation happened since `generation` was read"""
+        if not self.enabled or generation != self.generation:
+            return
+        key = self._key(user_id)
+        self._entries[key] = (time.monotonic() + self.ttl, entry)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def discard(self, user_id):
+        """Drop the local copy only"""
+        self.generation += 1
+        self._entries.pop(self._key(user_id), None)
+
+    def clear(self):
+        self.generation += 1
+        self._entries.clear()
+
+    async def invalidate(self, user_id):
+        """Drop the entry here and tell every other worker to do the same"""
+        self.invalidations += 1
+        self.discard(user_id)
+        if not self.enabled:
+            return
+        try:
+            await self.redis.publish(self.channel, self._key(user_id))
+        except Exception:
+            # Other workers fall back to the TTL
+            logger.warning("Failed to publish cache invalidation for %s", user_id, exc_info=True)
+
+    async def listen(self):
+        """Apply invalidations published by other workers until cancelled"""
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                # Anything published while we were not subscribed is lost
+                self.clear()
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        self.discard(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.warning("Cache invalidation listener disconnected, retrying", exc_info=True)
+                self.clear()
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+secret_cache = SecretCache(
+    max_size=settings.SECRET_CACHE_MAX_SIZE,
+    ttl=settings.SECRET_CACHE_TTL_SECONDS,
+    channel=settings.SECRET_CACHE_CHANNEL,
+    enabled=settings.SECRET_CACHE_ENABLED,
+)
@@ -0,0 +1,63 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable, TypeVar
+
+from app.core.config import settings
+
+T = TypeVar("T")
+
+class _LeaderCancelled(Exception):
+    """Tells waiters the call they joined was abandoned, so one of them runs it again"""
+
+class SingleFlight:
+    """
+    Per-worker call coalescing: while a call for a key is in flight, further
+    calls for the same key wait for its result instead of running their own.
+    The first caller runs the function itself (on its own DB session), the
+    others share the outcome, errors included; if the first caller is
+    cancelled a waiter takes over. Nothing is kept once the call
+    finishes, so this only deduplicates work that overlaps in time.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+        self.calls = 0
+        self.shared = 0
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> T:
+        if not self.enabled:
+            return await func()
+        while True:
+            future = self._calls.get(key)
+            if future is None:
+                break
+            self.shared += 1
+            try:
+                # shield: a waiter going away must not cancel the shared call
+                return await asyncio.shield(future)
+            except _LeaderCancelled:
+                continue
+
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        self.calls += 1
+        try:
+            result = await func()
+        except BaseException as exc:
+            future.set_exception(_LeaderCancelled() if isinstance(exc, asyncio.CancelledError) else exc)
+            future.exception()  # Retrieved, so nothing is logged when nobody was waiting
+            raise
+        finally:
+            del self._calls[key]
+        future.set_result(result)
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "in_flight": len(self._calls),
+            "calls": self.calls,
+            "shared": self.shared,
+        }
+
+single_flight = SingleFlight(enabled=settings.SINGLE_FLIGHT_ENABLED)
@@ -1,10 +1,79 @@
 import pyotp
-import qrcode
-import io
 import base64
+import hashlib
+import struct
+import time
+from typing import Dict, List, Optional, Sequence, Tuple, Union
 from app.core.config import settings
+from app.core.metrics import CRYPTO_SECONDS, timed
+from app.services.qr import render_qr
+
+ALGORITHMS = {"sha1": hashlib.sha1, "sha256": hashlib.sha256, "sha512": hashlib.sha512}
+
+# XOR tables for the HMAC pads, applied to the whole key with bytes.translate
+_IPAD = bytes(value ^ 0x36 for value in range(256))
+_OPAD = bytes(value ^ 0x5C for value in range(256))
+_pack_counter = struct.Struct(">Q").pack
+_unpack_word = struct.Struct(">I").unpack_from
+
+class TOTPKey:
+    """
+    A decoded secret with the HMAC inner and outer pads already absorbed, so
+    each code costs two hash state copies instead of a full HMAC setup.
+    Build once per secret and reuse; instances are safe to share.
+    """
+
+    __slots__ = ("inner", "outer", "digits", "period", "modulo")
+
+    def __init__(self, key: bytes, algorithm: str = "sha1", digits: int = 6, period: int = 30):
+        constructor = ALGORITHMS[algorithm]
+        block_size = constructor().block_size
+        if len(key) > block_size:
+            key = constructor(key).digest()
+        key = key.ljust(block_size, b"\0")
+        self.inner = constructor(key.translate(_IPAD))
+        self.outer = constructor(key.translate(_OPAD))
+        self.digits = digits
+        self.period = period
+        self.modulo = 10 ** digits
+
+    def value(self, message: bytes) -> int:
+        """HOTP value (RFC 4226 dynamic truncation) for a packed counter"""
+        inner = self.inner.copy()
+        inner.update(message)
+        outer = self.outer.copy()
+        outer.update(inner.digest())
+        mac = outer.digest()
+        return (_unpack_word(mac, mac[-1] & 0x0F)[0] & 0x7FFFFFFF) % self.modulo
+
+    def code(self, for_time: Optional[float] = None) -> str:
+        """The code for a moment, zero padded; for provisioning checks and tests"""
+        counter = int(time.time() if for_time is None else for_time) // self.period
+        return str(self.value(_pack_counter(counter))).zfill(self.digits)
+
+    def parse(self, code: str) -> int:
+        """The submitted code as an int, or -1 if it cannot be one of ours"""
+        if len(code) != self.digits or not (code.isascii() and code.isdigit()):
+            return -1
+        return int(code)
+
+    def matches(self, candidate: int, messages: Sequence[bytes]) -> bool:
+        # Every window slot is computed and compared, and both sides are small
+        # ints, so the time taken does not depend on which slot matched
+        matched = False
+        for message in messages:
+            matched |= self.value(message) == candidate
+        return matched
+
+def window_messages(period: int, valid_window: int, for_time: Optional[float] = None) -> List[bytes]:
+    counter = int(time.time() if for_time is None else for_time) // period
+    return [_pack_counter(counter + offset) for offset in range(-valid_window, valid_window + 1)]
 
 class TOTPService:
+    algorithm = "sha1"
+    interval = 30
+    digits = 6
+
     def generate_secret(self) -> str:
         """Generate a random Base32 secret"""
         return pyotp.random_base32()
@@ -13,18 +82,65 @@ class TOTPService:
         return pyotp.totp.TOTP(secret).provisioning_uri(name=user_email, issuer_name=issuer)
 
     def generate_qr_code(self, uri: str) -> str:
-        """Generate SVG QR code and return as string"""
-        img = qrcode.make(uri, image_factory=qrcode.image.svg.SvgPathImage)
-        stream = io.BytesIO()
-        img.save(stream)
-        return stream.getvalue().decode()
+        """Generate SVG QR code and return as string (blocking; see qr_service.render)"""
+        return render_qr(uri, "svg")
+
+    def decode_secret(self, secret: str) -> bytes:
+        """Decode a Base32 secret into the raw HMAC key"""
+        missing_padding = len(secret) % 8
+        if missing_padding:
+            secret += "=" * (8 - missing_padding)
+        return base64.b32decode(secret, casefold=True)
+
+    def load_key(
+        self,
+        secret: Union[str, bytes],
+        algorithm: Optional[str] = None,
+        digits: Optional[int] = None,
+        period: Optional[int] = None,
+    ) -> TOTPKey:
+        """A reusable TOTPKey for a Base32 secret or raw key bytes, on the service defaults unless given"""
+        key = self.decode_secret(secret) if isinstance(secret, str) else secret
+        return TOTPKey(key, algorithm or self.algorithm, digits or self.digits, period or self.interval)
 
+    @timed(CRYPTO_SECONDS, "totp_verify")
     def verify_code(self, secret: str, code: str, valid_window: int = 1) -> bool:
         """
         Verify TOTP code.
         valid_window: 1 means accept code for current time +/- 30 seconds.
         """
-        totp = pyotp.TOTP(secret)
-        return totp.verify(code, valid_window=valid_window)
+        key = self.load_key(secret)
+        return key.matches(key.parse(code), window_messages(key.period, valid_window))
+
+    @timed(CRYPTO_SECONDS, "totp_verify")
+    def verify_key(self, key: Union[TOTPKey, bytes], code: str, valid_window: int = 1, for_time: Optional[float] = None) -> bool:
+        """Verify TOTP code against an already loaded (or decoded) key"""
+        if not isinstance(key, TOTPKey):
+            key = self.load_key(key)
+        return key.matches(key.parse(code), window_messages(key.period, valid_window, for_time))
+
+    @timed(CRYPTO_SECONDS, "totp_verify_batch")
+    def verify_codes_batch(
+        self,
+        items: Sequence[Tuple[Union[TOTPKey, bytes], str]],
+        valid_window: int = 1,
+        for_time: Optional[float] = None,
+    ) -> List[bool]:
+        """
+        Verify many (key, code) pairs in a single pass.
+        The window counters are packed once per period and shared by every
+        key, so each item only costs its HMACs.
+        """
+        now = time.time() if for_time is None else for_time
+        messages_by_period: Dict[int, List[bytes]] = {}
+        results = []
+        for key, code in items:
+            if not isinstance(key, TOTPKey):
+                key = self.load_key(key)
+            messages = messages_by_period.get(key.period)
+            if messages is None:
+                messages = messages_by_period[key.period] = window_messages(key.period, valid_window, now)
+            results.append(key.matches(key.parse(code), messages))
+        return results
 
 totp_service = TOTPService()
@@ -0,0 +1,137 @@
+"""
+Import users and existing TOTP secrets from a CSV or NDJSON file.
+
+    python -m app.tools.bulk_import FILE [--format csv|ndjson] [--chunk-size 5000]
+                                         [--workers 4] [--checkpoint FILE] [--no-resume]
+
+Each record has user_id and optionally secret_base32, display_name and issuer.
+Records with a secret become active authenticators; records without one only
+create the user. The file is streamed in chunks, each committed in its own
+transaction, with secrets encrypted in a process pool and rows loaded with COPY
+on Postgres. After every chunk the number of records done is written to the
+checkpoint file, so an interrupted import picks up where it stopped.
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Iterator, Union
+
+from app.core.database import AsyncSessionLocal, engine
+from app.services.audit import audit_writer
+from app.services.provisioning import ProvisionOutcome, ProvisionRecord, provision_bulk
+
+FIELDS = ("user_id", "secret_base32", "display_name", "issuer")
+
+def parse_record(row) -> ProvisionRecord:
+    """raises ValueError for a row that is not a record"""
+    if not isinstance(row, dict):
+        raise ValueError("Not an object")
+    if not row.get("user_id"):
+        raise ValueError("Missing user_id")
+    return ProvisionRecord(**{field: row[field] for field in FIELDS if row.get(field)})
+
+def read_records(path: str, fmt: str) -> Iterator[Union[ProvisionRecord, ProvisionOutcome]]:
+    """Records in file order; a row that cannot be read is an invalid outcome naming its line"""
+    with open(path, newline="", encoding="utf-8") as handle:
+        if fmt == "csv":
+            reader = csv.DictReader(handle)
+            rows = ((reader.line_num, row) for row in reader)
+        else:
+            rows = ((number, line) for number, line in enumerate(handle, 1) if line.strip())
+        for line_number, row in rows:
+            try:
+                record = parse_record(row if fmt == "csv" else json.loads(row))
+            except ValueError as exc:
+                yield ProvisionOutcome(user_id=f"line {line_number}", status="invalid", error=str(exc))
+                continue
+            yield record
+
+def load_checkpoint(path: str, source: str) -> int:
+    """Records already done for source; refuses a checkpoint written for another file"""
+    try:
+        with open(path, encoding="utf-8") as handle:
+            state = json.load(handle)
+    except FileNotFoundError:
+        return 0
+    if state.get("source") != os.path.abspath(source):
+        raise SystemExit(
+            f"{path} records progress for {state.get('source')}, not {os.path.abspath(source)}; "
+            "pass --checkpoint for another file or --no-resume to start over"
+        )
+    return int(state["done"])
+
+def save_checkpoint(path: str, source: str, done: int):
+    # Write then rename, so a crash never leaves a torn checkpoint
+    temporary = f"{path}.tmp"
+    with open(temporary, "w", encoding="utf-8") as handle:
+        json.dump({"source": os.path.abspath(source), "done": done}, handle)
+    os.replace(temporary, path)
+
+async def main(args):
+    checkpoint = args.checkpoint or f"{args.file}.checkpoint"
+    skip = load_checkpoint(checkpoint, args.file) if args.resume else 0
+    if skip:
+        print(f"resuming after {skip} records")
+
+    records = read_records(args.file, args.format)
+    for _ in islice(records, skip):
+        pass
+
+    totals = Counter()
+    done = skip
+    started = time.perf_counter()
+    executor = ProcessPoolExecutor(max_workers=args.workers)
+    await audit_writer.start()
+    try:
+        while True:
+            chunk = list(islice(records, args.chunk_size))
+            if not chunk:
+                break
+            chunk_started = time.perf_counter()
+            # Unreadable rows count as done too, so the checkpoint moves past them
+            outcomes = [item for item in chunk if isinstance(item, ProvisionOutcome)]
+            batch = [item for item in chunk if isinstance(item, ProvisionRecord)]
+            if batch:
+                async with AsyncSessionLocal() as db:
+                    outcomes += await provision_bulk(
+                        db, batch, generate_missing=False, executor=executor, workers=args.workers, use_copy=True
+                    )
+                    await db.commit()
+            done += len(chunk)
+            save_checkpoint(checkpoint, args.file, done)
+
+            counts = Counter(outcome.status for outcome in outcomes)
+            totals.update(counts)
+            elapsed = time.perf_counter() - chunk_started
+            summary = ", ".join(f"{status} {count}" for status, count in sorted(counts.items()))
+            print(f"{done:>10} records   {len(chunk) / elapsed:9.0f} rec/s   {summary}")
+            for outcome in outcomes:
+                if outcome.status == "invalid":
+                    print(f"  invalid {outcome.user_id}: {outcome.error}")
+    finally:
+        executor.shutdown()
+        await audit_writer.stop()
+        await engine.dispose()
+
+    elapsed = time.perf_counter() - started
+    summary = ", ".join(f"{status} {count}" for status, count in sorted(totals.items())) or "-"
+    print(f"\n{done - skip} records in {elapsed:.1f}s ({(done - skip) / elapsed if elapsed else 0:.0f} rec/s): {summary}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("file")
+    parser.add_argument("--format", choices=("csv", "ndjson"), help="defaults to the file extension")
+    parser.add_argument("--chunk-size", type=int, default=5000, help="records per transaction")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="encryption processes")
+    parser.add_argument("--checkpoint", help="progress file, defaults to FILE.checkpoint")
+    parser.add_argument("--no-resume", dest="resume", action="store_false", help="ignore an existing checkpoint")
+    args = parser.parse_args()
+    if args.format is None:
+        args.format = "csv" if args.file.lower().endswith(".csv") else "ndjson"
+    asyncio.run(main(args))
@@ -0,0 +1,25 @@
+"""
+Create upcoming auth_events partitions and retire expired ones.
+
+    python -m app.tools.partitions [--dry-run]
+"""
+import argparse
+import asyncio
+
+from app.core.database import engine
+from app.services.partitions import run_maintenance
+
+async def main(dry_run: bool):
+    try:
+        result = await run_maintenance(dry_run=dry_run)
+    finally:
+        await engine.dispose()
+    prefix = "would " if dry_run else ""
+    print(f"{prefix}create: {', '.join(result['created']) or '-'}")
+    print(f"{prefix}expire: {', '.join(result['expired']) or '-'}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--dry-run", action="store_true", help="report what would change without touching the database")
+    args = parser.parse_args()
+    asyncio.run(main(args.dry_run))
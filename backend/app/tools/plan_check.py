@@ -0,0 +1,129 @@
+"""
+Check that every hot query is served by an index.
+
+    python -m app.tools.plan_check [--users 20000]
+
+Seeds users, authenticators, backup codes and audit events into DATABASE_URL
+(Postgres, migrated to head) inside one transaction, runs ANALYZE, then
+EXPLAINs the queries the endpoints issue. Exits non-zero if any plan contains
+a sequential scan. The transaction is rolled back, so nothing is left behind.
+"""
+import argparse
+import asyncio
+import sys
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, select, text
+
+from app.core.database import engine
+from app.models.authenticator import Authenticator, AuthenticatorStatus, BackupCode
+from app.models.user import User
+from app.services.audit import build_audit_query, encode_cursor
+from app.services.backup_codes import backup_code_service
+from app.services.reaper import detach_events_statement, expired_pending_statement
+
+# One user in five is mid-provisioning; everyone also has a disabled authenticator
+SEED_STATEMENTS = [
+    "CREATE TEMP TABLE plan_check_users ON COMMIT DROP AS "
+    "SELECT gen_random_uuid() AS id, n FROM generate_series(1, :users) AS n",
+    "INSERT INTO users (id) SELECT id FROM plan_check_users",
+    "INSERT INTO authenticators (id, user_id, secret_encrypted, status, created_at, updated_at, "
+    "provision_token, provision_token_expires_at, failed_attempts) "
+    "SELECT gen_random_uuid(), id, '\\x00'::bytea, CASE WHEN n % 5 = 0 THEN 'pending' ELSE 'active' END, now(), now(), "
+    "CASE WHEN n % 5 = 0 THEN gen_random_uuid() END, CASE WHEN n % 5 = 0 THEN now() + interval '1 day' END, 0 "
+    "FROM plan_check_users",
+    "INSERT INTO authenticators (id, user_id, secret_encrypted, status, created_at, updated_at, failed_attempts) "
+    "SELECT gen_random_uuid(), id, '\\x00'::bytea, 'disabled', now(), now(), 0 FROM plan_check_users",
+    "INSERT INTO backup_codes (id, authenticator_id, code_hash, used, created_at) "
+    "SELECT gen_random_uuid(), a.id, md5(random()::text), c % 3 = 0, now() "
+    "FROM authenticators a JOIN plan_check_users u ON u.id = a.user_id, generate_series(1, 10) AS c",
+    "INSERT INTO auth_events (id, user_id, event_type, created_at) "
+    "SELECT gen_random_uuid(), id, (ARRAY['verify_success', 'verify_fail', 'provision_init'])[1 + e % 3], "
+    "now() - (e * interval '1 minute') "
+    "FROM plan_check_users, generate_series(1, 5) AS e",
+    "ANALYZE users",
+    "ANALYZE authenticators",
+    "ANALYZE backup_codes",
+    "ANALYZE auth_events",
+]
+
+def hot_queries(sample) -> dict:
+    """The statements issued by auth.py and its services, keyed by a label"""
+    user_id, authenticator_id, provision_token, event_id, created_at = sample
+    user_ids = [user_id]
+    cursor = encode_cursor(created_at, event_id)
+    return {
+        "user by id": select(User).where(User.id == user_id),
+        "active authenticator": select(Authenticator.id, Authenticator.status, Authenticator.secret_encrypted)
+            .where(Authenticator.user_id == user_id, Authenticator.status == AuthenticatorStatus.ACTIVE),
+        "active authenticators (batch)": select(Authenticator.id, Authenticator.user_id, Authenticator.status, Authenticator.secret_encrypted)
+            .where(Authenticator.user_id.in_(user_ids), Authenticator.status == AuthenticatorStatus.ACTIVE),
+        "authenticator by provision token": select(Authenticator).where(Authenticator.provision_token == provision_token),
+        "consume backup code": backup_code_service.consume_statement(authenticator_id, backup_code_service.hash_code("00000000")),
+        "regenerate backup codes": delete(BackupCode).where(BackupCode.authenticator_id == authenticator_id),
+        "reaper expired pending": expired_pending_statement(datetime.utcnow(), 500),
+        "reaper detach audit events": detach_events_statement([authenticator_id]),
+        "audit page": build_audit_query().limit(51),
+        "audit page by user": build_audit_query(user_id=user_id).limit(51),
+        "audit page by type": build_audit_query(event_type="verify_fail").limit(51),
+        "audit page after cursor": build_audit_query(cursor=cursor).limit(51),
+        "audit page since": build_audit_query(since=datetime.utcnow() - timedelta(minutes=2)).limit(51),
+    }
+
+def seq_scans(node: dict):
+    """Relations read by a sequential scan anywhere in a JSON plan"""
+    if node.get("Node Type") == "Seq Scan":
+        yield node.get("Relation Name")
+    for child in node.get("Plans", ()):
+        yield from seq_scans(child)
+
+def index_names(node: dict):
+    if "Index Name" in node:
+        yield node["Index Name"]
+    for child in node.get("Plans", ()):
+        yield from index_names(child)
+
+async def main(users: int) -> int:
+    if engine.dialect.name != "postgresql":
+        print("plan_check needs a Postgres DATABASE_URL")
+        return 2
+
+    failures = 0
+    async with engine.connect() as conn:
+        transaction = await conn.begin()
+        try:
+            for statement in SEED_STATEMENTS:
+                await conn.execute(text(statement), {"users": users} if ":users" in statement else {})
+            # Sample a user that has a pending token, a disabled authenticator and events
+            sample = (await conn.execute(text(
+                "SELECT a.user_id, d.id, a.provision_token, e.id, e.created_at "
+                "FROM authenticators a "
+                "JOIN authenticators d ON d.user_id = a.user_id AND d.status = 'disabled' "
+                "JOIN auth_events e ON e.user_id = a.user_id "
+                "WHERE a.provision_token IS NOT NULL LIMIT 1"
+            ))).one()
+
+            queries = hot_queries(sample)
+            for label, query in queries.items():
+                # Plain EXPLAIN only plans, so the UPDATE and DELETE never run
+                compiled = query.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True})
+                plan = (await conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}")).scalar()
+                root = plan[0]["Plan"]
+                scanned = sorted(set(seq_scans(root)))
+                indexes = ", ".join(sorted(set(index_names(root)))) or "-"
+                if scanned:
+                    failures += 1
+                    print(f"FAIL  {label:<34} seq scan on {', '.join(scanned)}")
+                else:
+                    print(f"ok    {label:<34} {indexes}")
+        finally:
+            await transaction.rollback()
+    await engine.dispose()
+
+    print(f"\n{failures} of {len(queries)} queries use a sequential scan" if failures else "\nall queries use indexes")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=20000, help="users to seed; too few and Postgres prefers seq scans regardless")
+    sys.exit(asyncio.run(main(parser.parse_args().users)))
@@ -0,0 +1,41 @@
+"""
+Delete expired pending authenticators and their dependent rows.
+
+    python -m app.tools.reap_pending [--batch-size 500] [--grace-minutes 60]
+                                     [--max-batches N] [--pause-ms 50]
+
+Runs the same batched SKIP LOCKED reaper as the in-process task, for
+deployments that set PENDING_REAPER_INTERVAL_SECONDS=0 and schedule it
+externally (cron, a Kubernetes CronJob).
+"""
+import argparse
+import asyncio
+from datetime import timedelta
+
+from app.core.config import settings
+from app.core.database import engine
+from app.services.reaper import reap_expired
+
+async def main(args):
+    try:
+        totals = await reap_expired(
+            batch_size=args.batch_size,
+            grace=timedelta(minutes=args.grace_minutes),
+            max_batches=args.max_batches,
+            pause=args.pause_ms / 1000,
+        )
+    finally:
+        await engine.dispose()
+    print(
+        f"deleted {totals.get('authenticators', 0)} authenticators, "
+        f"{totals.get('backup_codes', 0)} backup codes; "
+        f"detached {totals.get('auth_events_detached', 0)} audit events"
+    )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=settings.PENDING_REAPER_BATCH_SIZE)
+    parser.add_argument("--grace-minutes", type=int, default=settings.PENDING_REAPER_GRACE_MINUTES, help="only reap tokens expired at least this long ago")
+    parser.add_argument("--max-batches", type=int, help="stop after this many batches")
+    parser.add_argument("--pause-ms", type=int, default=settings.PENDING_REAPER_BATCH_PAUSE_MS, help="sleep between batches")
+    asyncio.run(main(parser.parse_args()))
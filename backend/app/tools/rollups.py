@@ -0,0 +1,25 @@
+"""
+Bring the auth_events rollups up to date.
+
+    python -m app.tools.rollups
+
+Runs the same high-water-mark job as the in-process task, window by window,
+for deployments that set AUDIT_ROLLUP_INTERVAL_SECONDS=0 or to backfill
+after enabling rollups on an existing table.
+"""
+import argparse
+import asyncio
+
+from app.core.database import engine
+from app.services.rollups import run_rollups
+
+async def main():
+    try:
+        result = await run_rollups()
+    finally:
+        await engine.dispose()
+    print(f"rolled up {result['events']} events in {result['windows']} windows; high water {result['high_water'] or 'unchanged'}")
+
+if __name__ == "__main__":
+    argparse.ArgumentParser(description=__doc__.strip().splitlines()[0]).parse_args()
+    asyncio.run(main())
@@ -0,0 +1,95 @@
+"""
+Re-encrypt authenticator secrets under the current master key, online.
+
+    python -m app.tools.rotate_keys [--batch-size 1000] [--workers 4]
+                                    [--checkpoint FILE] [--no-resume]
+
+To rotate: deploy with the new key as APP_MASTER_KEY / APP_MASTER_KEY_ID and
+the old one listed in APP_RETIRED_MASTER_KEYS, run this tool, then drop the
+old key. Secrets are re-encrypted in a process pool and written back one
+batch per transaction. The last id handled is checkpointed after every
+batch, so an interrupted run resumes where it stopped. Secrets that no
+configured key decrypts are left as they are and listed at the end, with a
+non-zero exit status.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from app.core.config import settings
+from app.core.database import engine
+from app.services.encryption import encryption_service
+from app.services.key_rotation import RotationProgress, rotate_keys
+
+def load_checkpoint(path: str):
+    """The id to resume after and the ids failed so far, if the checkpoint is for the current key"""
+    try:
+        with open(path, encoding="utf-8") as handle:
+            checkpoint = json.load(handle)
+    except FileNotFoundError:
+        return None, []
+    if checkpoint.get("key_id") != encryption_service.current_key_id:
+        return None, []
+    return uuid.UUID(checkpoint["after"]), [uuid.UUID(row_id) for row_id in checkpoint.get("failed", [])]
+
+def save_checkpoint(path: str, progress: RotationProgress):
+    # Write then rename, so a crash never leaves a torn checkpoint
+    temporary = f"{path}.tmp"
+    with open(temporary, "w", encoding="utf-8") as handle:
+        json.dump({
+            "key_id": encryption_service.current_key_id,
+            "after": str(progress.after),
+            "failed": [str(row_id) for row_id in progress.failed],
+        }, handle)
+    os.replace(temporary, path)
+
+async def main(args):
+    after, failed = load_checkpoint(args.checkpoint) if args.resume else (None, [])
+    if after is not None:
+        print(f"resuming after {after}")
+    print(f"rotating to key {encryption_service.current_key_id!r}")
+
+    started = last_report = time.perf_counter()
+    reported = 0
+
+    async def on_batch(progress: RotationProgress):
+        nonlocal last_report, reported
+        save_checkpoint(args.checkpoint, progress)
+        now = time.perf_counter()
+        if now - last_report >= args.progress_seconds:
+            rate = (progress.rotated - reported) / (now - last_report)
+            print(f"{progress.rotated:>12} rotated   {len(progress.failed):>6} failed   {rate:9.0f} rows/s   at {progress.after}")
+            last_report, reported = now, progress.rotated
+
+    executor = ProcessPoolExecutor(max_workers=args.workers)
+    try:
+        progress = await rotate_keys(args.batch_size, executor, args.workers, after, failed, on_batch)
+    finally:
+        executor.shutdown()
+        await engine.dispose()
+    # A finished run leaves nothing to resume; the next one rescans from the start
+    if os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+
+    elapsed = time.perf_counter() - started
+    print(f"\n{progress.rotated} secrets re-encrypted in {elapsed:.1f}s ({progress.rotated / elapsed if elapsed else 0:.0f} rows/s)")
+    if progress.failed:
+        print(f"{len(progress.failed)} secrets could not be decrypted with any configured key and were left as is:")
+        for row_id in progress.failed:
+            print(f"  {row_id}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=settings.KEY_ROTATION_BATCH_SIZE, help="rows per transaction")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="encryption processes")
+    parser.add_argument("--checkpoint", default="rotate_keys.checkpoint", help="progress file")
+    parser.add_argument("--no-resume", dest="resume", action="store_false", help="ignore an existing checkpoint")
+    parser.add_argument("--progress-seconds", type=float, default=5.0, help="seconds between progress lines")
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,113 @@
+"""
+Compare the legacy and current backup code paths for users holding many codes.
+
+    python -m benchmarks.backup_codes [--users 20] [--codes 2000] [--rounds 50]
+
+Runs against DATABASE_URL, which must already be migrated (alembic upgrade
+head); SQLite URLs get the schema created on the fly. Every seeded row is
+deleted again at the end.
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+import uuid
+
+from sqlalchemy import delete, insert, select
+
+from app.core.database import AsyncSessionLocal, Base, engine
+from app.models.authenticator import Authenticator, AuthenticatorStatus, BackupCode
+from app.models.user import User
+from app.services.backup_codes import backup_code_service
+
+async def legacy_consume(db, authenticator_id, code: str) -> bool:
+    """The pre-index path: load every unused code and compare in Python"""
+    result = await db.execute(select(BackupCode).where(BackupCode.authenticator_id == authenticator_id, BackupCode.used == False))
+    input_hash = backup_code_service.hash_code(code)
+    for row in result.scalars().all():
+        if row.code_hash == input_hash:
+            row.used = True
+            await db.commit()
+            return True
+    return False
+
+async def legacy_regenerate(db, authenticator_id):
+    """The pre-index path: ten ORM inserts, old codes left in place"""
+    for _ in range(backup_code_service.count):
+        db.add(BackupCode(authenticator_id=authenticator_id, code_hash=backup_code_service.hash_code(backup_code_service.generate_code())))
+    await db.commit()
+
+async def current_consume(db, authenticator_id, code: str) -> bool:
+    consumed = await backup_code_service.consume(db, authenticator_id, code)
+    await db.commit()
+    return consumed
+
+async def current_regenerate(db, authenticator_id):
+    await backup_code_service.regenerate(db, authenticator_id)
+    await db.commit()
+
+async def seed(users: int, codes: int):
+    authenticator_ids = []
+    async with AsyncSessionLocal() as db:
+        for _ in range(users):
+            user_id, authenticator_id = uuid.uuid4(), uuid.uuid4()
+            db.add(User(id=user_id))
+            db.add(Authenticator(id=authenticator_id, user_id=user_id, secret_encrypted=b"-", status=AuthenticatorStatus.ACTIVE))
+            authenticator_ids.append((user_id, authenticator_id))
+        await db.flush()
+        for _, authenticator_id in authenticator_ids:
+            await db.execute(insert(BackupCode), [
+                {"authenticator_id": authenticator_id, "code_hash": backup_code_service.hash_code(f"{index:08d}"), "used": False}
+                for index in range(codes)
+            ])
+        await db.commit()
+    return authenticator_ids
+
+async def cleanup(authenticator_ids):
+    async with AsyncSessionLocal() as db:
+        ids = [authenticator_id for _, authenticator_id in authenticator_ids]
+        await db.execute(delete(BackupCode).where(BackupCode.authenticator_id.in_(ids)))
+        await db.execute(delete(Authenticator).where(Authenticator.id.in_(ids)))
+        await db.execute(delete(User).where(User.id.in_([user_id for user_id, _ in authenticator_ids])))
+        await db.commit()
+
+async def measure(name: str, operation, authenticator_ids, rounds: int, code_indexes):
+    timings = []
+    async with AsyncSessionLocal() as db:
+        for round_index in range(rounds):
+            _, authenticator_id = random.choice(authenticator_ids)
+            args = (f"{next(code_indexes):08d}",) if code_indexes is not None else ()
+            started = time.perf_counter()
+            await operation(db, authenticator_id, *args)
+            timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    p95 = timings[int(len(timings) * 0.95) - 1] if len(timings) >= 20 else timings[-1]
+    print(f"{name:<22} mean {statistics.mean(timings):8.3f} ms   p50 {statistics.median(timings):8.3f} ms   p95 {p95:8.3f} ms")
+
+async def main(args):
+    if engine.dialect.name == "sqlite":
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+    authenticator_ids = await seed(args.users, args.codes)
+    print(f"{args.users} users x {args.codes} codes, {args.rounds} rounds per path\n")
+    try:
+        # Each path consumes its own slice of the seeded codes
+        legacy_codes = iter(random.sample(range(args.codes // 2), min(args.rounds, args.codes // 2)))
+        current_codes = iter(random.sample(range(args.codes // 2, args.codes), min(args.rounds, args.codes // 2)))
+        rounds = min(args.rounds, args.codes // 2)
+        await measure("consume (legacy)", legacy_consume, authenticator_ids, rounds, legacy_codes)
+        await measure("consume (current)", current_consume, authenticator_ids, rounds, current_codes)
+        await measure("regenerate (legacy)", legacy_regenerate, authenticator_ids, args.rounds, None)
+        await measure("regenerate (current)", current_regenerate, authenticator_ids, args.rounds, None)
+    finally:
+        await cleanup(authenticator_ids)
+        await engine.dispose()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--codes", type=int, default=2000, help="backup codes held by each user")
+    parser.add_argument("--rounds", type=int, default=50)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,105 @@
+"""
+Import cost of the API process, summarized per package and kept within a budget.
+
+    python -m benchmarks.import_time [--module app.main] [--runs 5] [--top 15]
+                                     [--budget-ms MS] [--threshold 0.3]
+                                     [--baseline FILE] [--save-baseline]
+
+Imports --module in fresh interpreters under python -X importtime and keeps
+the fastest run, then reports the total, the time spent in each top-level
+package and the slowest modules by self time. The exit status is non-zero
+when a dependency that should load lazily (LAZY_MODULES) is imported, when
+the total is over --budget-ms, or when it is slower than the baseline
+(benchmarks/baseline/import_time.json by default) by more than --threshold.
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+from collections import defaultdict
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline", "import_time.json")
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Only needed for QR rendering, which imports them on first use
+LAZY_MODULES = ("qrcode", "PIL")
+MARKER = "-- benchmark import start --"
+
+_LINE_RE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+def profile(module: str) -> list:
+    """(self_us, cumulative_us, depth, name) for every module the import loads"""
+    code = f"import sys; sys.stderr.write({MARKER!r} + '\\n'); import {module}"
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=BACKEND_DIR, capture_output=True, text=True, check=True,
+    )
+    # Everything before the marker is interpreter startup
+    output = completed.stderr.split(MARKER, 1)[1]
+    rows = []
+    for line in output.splitlines():
+        match = _LINE_RE.match(line)
+        if match:
+            rows.append((int(match[1]), int(match[2]), len(match[3]) // 2, match[4]))
+    return rows
+
+def summarize(rows: list) -> dict:
+    packages = defaultdict(int)
+    for self_us, _, _, name in rows:
+        packages[name.split(".")[0]] += self_us
+    return {
+        "total_ms": sum(cumulative for _, cumulative, depth, _ in rows if depth == 0) / 1000,
+        "modules": len(rows),
+        "packages": {name: us / 1000 for name, us in sorted(packages.items(), key=lambda item: -item[1])},
+    }
+
+def main(args) -> int:
+    runs = [profile(args.module) for _ in range(args.runs)]
+    rows = min(runs, key=lambda run: summarize(run)["total_ms"])
+    summary = summarize(rows)
+
+    print(f"import {args.module}: {summary['total_ms']:.1f} ms, {summary['modules']} modules (best of {args.runs})\n")
+    print("by package (self time)")
+    for name, ms in list(summary["packages"].items())[:args.top]:
+        print(f"  {name:<32}{ms:9.1f} ms")
+    print("\nslowest modules (self time)")
+    for self_us, _, _, name in sorted(rows, reverse=True)[:args.top]:
+        print(f"  {name:<48}{self_us / 1000:9.1f} ms")
+    print()
+
+    failures = []
+    loaded_lazy = sorted({name for _, _, _, name in rows if name.split(".")[0] in LAZY_MODULES})
+    if loaded_lazy:
+        failures.append(f"lazily loaded modules imported at startup: {', '.join(loaded_lazy)}")
+    if args.budget_ms is not None and summary["total_ms"] > args.budget_ms:
+        failures.append(f"total {summary['total_ms']:.1f} ms is over the {args.budget_ms:.0f} ms budget")
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as handle:
+            json.dump({"python": sys.version.split()[0], "module": args.module, **summary}, handle, indent=2)
+            handle.write("\n")
+        print(f"baseline written to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as handle:
+            baseline = json.load(handle)
+        change = summary["total_ms"] / baseline["total_ms"] - 1
+        print(f"vs baseline: {change:+.1%} ({baseline['total_ms']:.1f} ms)")
+        if change > args.threshold:
+            failures.append(f"total is slower than baseline by more than {args.threshold:.0%}")
+
+    for failure in failures:
+        print(f"FAIL  {failure}")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--module", default="app.main")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="rows to show per table")
+    parser.add_argument("--budget-ms", type=float, help="fail when the total import time exceeds this")
+    parser.add_argument("--threshold", type=float, default=0.3, help="allowed slowdown vs baseline, as a fraction")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="record this run as the new baseline")
+    sys.exit(main(parser.parse_args()))
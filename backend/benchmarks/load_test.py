@@ -0,0 +1,179 @@
+"""
+Drive many simulated users through the authenticator flows at a target arrival rate.
+
+    python -m benchmarks.load_test [--users 1000] [--rate 100] [--base-url URL]
+                                   [--max-in-flight 500] [--max-p99-ms MS]
+
+Each user runs the flow verify_system.py checks one step at a time:
+provision, verify-setup, verify, backup code generation, verify-backup and
+disable. Users arrive as a Poisson process at --rate per second; latency
+percentiles and throughput are reported per endpoint.
+
+Without --base-url the app runs in-process against a throwaway SQLite
+database and fakeredis (pip install -r requirements-dev.txt), so no
+Postgres or Redis is needed. The exit status is non-zero when any request
+gets an unexpected response or, with --max-p99-ms, when an endpoint's p99
+is over budget.
+"""
+import argparse
+import asyncio
+import contextlib
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+
+import httpx
+import pyotp
+
+API_PREFIX = "/api/v1/authenticator"
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.failures = defaultdict(int)
+        self.examples = {}
+
+    async def call(self, client: httpx.AsyncClient, endpoint: str, payload: dict, expect: int = 200, check=None):
+        started = time.perf_counter()
+        try:
+            response = await client.post(f"{API_PREFIX}{endpoint}", json=payload)
+        except httpx.HTTPError as exc:
+            self.failures[endpoint] += 1
+            self.examples.setdefault(endpoint, repr(exc))
+            return None
+        self.latencies[endpoint].append(time.perf_counter() - started)
+        body = response.json() if response.headers.get("content-type", "").startswith("application/json") else None
+        if response.status_code != expect or (check is not None and not check(body)):
+            self.failures[endpoint] += 1
+            self.examples.setdefault(endpoint, f"{response.status_code} {response.text[:200]}")
+            return None
+        return body
+
+async def user_flow(client: httpx.AsyncClient, recorder: Recorder):
+    user_id = str(uuid.uuid4())
+    # A distinct address per user keeps the per-IP limit from throttling the run
+    client_ip = f"10.{random.randrange(256)}.{random.randrange(256)}.{random.randrange(1, 255)}"
+    verified = lambda body: body["verified"]
+
+    provision = await recorder.call(client, "/provision", {"user_id": user_id, "qr_format": "svg"})
+    if provision is None:
+        return
+    totp = pyotp.TOTP(provision["secret_base32"])
+    if await recorder.call(client, "/verify-setup", {"provision_token": provision["provision_token"], "code": totp.now()}, check=verified) is None:
+        return
+    await recorder.call(client, "/verify", {"user_id": user_id, "code": totp.now(), "client_ip": client_ip}, check=verified)
+
+    generated = await recorder.call(client, "/backup-codes/generate", {"user_id": user_id})
+    if generated is not None:
+        await recorder.call(client, "/verify-backup", {"user_id": user_id, "backup_code": generated["backup_codes"][0]}, check=verified)
+    await recorder.call(client, "/disable", {"user_id": user_id}, check=verified)
+
+def percentile(ordered, fraction: float) -> float:
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+def report(recorder: Recorder, elapsed: float, max_p99_ms) -> bool:
+    ok = True
+    print(f"{'endpoint':<24}{'count':>8}{'errors':>8}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'mean ms':>10}")
+    for endpoint in sorted(set(recorder.latencies) | set(recorder.failures)):
+        ordered = sorted(recorder.latencies[endpoint])
+        errors = recorder.failures[endpoint]
+        ok = ok and not errors
+        if not ordered:
+            print(f"{endpoint:<24}{0:>8}{errors:>8}")
+            continue
+        p99 = percentile(ordered, 0.99) * 1000
+        over_budget = max_p99_ms is not None and p99 > max_p99_ms
+        ok = ok and not over_budget
+        print(
+            f"{endpoint:<24}{len(ordered):>8}{errors:>8}{len(ordered) / elapsed:>9.1f}"
+            f"{percentile(ordered, 0.5) * 1000:>10.2f}{percentile(ordered, 0.95) * 1000:>10.2f}{p99:>10.2f}"
+            f"{statistics.mean(ordered) * 1000:>10.2f}{'  over budget' if over_budget else ''}"
+        )
+    total = sum(len(values) for values in recorder.latencies.values())
+    print(f"\n{total} requests in {elapsed:.1f}s ({total / elapsed:.1f} req/s)")
+    for endpoint, example in recorder.examples.items():
+        print(f"first failure on {endpoint}: {example}")
+    return ok
+
+async def run(client: httpx.AsyncClient, args) -> bool:
+    recorder = Recorder()
+    in_flight = asyncio.Semaphore(args.max_in_flight)
+    tasks = []
+
+    async def arrive():
+        async with in_flight:
+            await user_flow(client, recorder)
+
+    started = time.perf_counter()
+    next_arrival = started
+    for _ in range(args.users):
+        next_arrival += random.expovariate(args.rate)
+        delay = next_arrival - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(arrive()))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    print(f"{args.users} users at {args.rate}/s target\n")
+    return report(recorder, elapsed, args.max_p99_ms)
+
+@contextlib.asynccontextmanager
+async def offline_app():
+    """The app on SQLite and fakeredis with its tables created, configured before it is imported"""
+    import fakeredis
+
+    workdir = tempfile.TemporaryDirectory(prefix="load_test_")
+    os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(workdir.name, 'load_test.db')}?timeout=30"
+    # Lock waits on SQLite say nothing about the Postgres query plans
+    os.environ.setdefault("DB_SLOW_QUERY_MS", "-1")
+    import app.core.redis
+    app.core.redis.redis_client = fakeredis.FakeAsyncRedis(decode_responses=True)
+
+    from app.core.database import Base, engine
+    from app.main import app as application
+    import app.models  # noqa: F401  registers every table on Base
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with engine.connect() as conn:
+        # Readers no longer block on the writer; persists in the database file
+        await conn.exec_driver_sql("PRAGMA journal_mode=WAL")
+    try:
+        yield application
+    finally:
+        await engine.dispose()
+        workdir.cleanup()
+
+@contextlib.asynccontextmanager
+async def offline_client(limits: httpx.Limits):
+    """The app in-process on SQLite and fakeredis, lifespan included"""
+    async with offline_app() as application, application.router.lifespan_context(application):
+        transport = httpx.ASGITransport(app=application)
+        async with httpx.AsyncClient(transport=transport, base_url="http://load-test", limits=limits, timeout=60) as client:
+            yield client
+
+async def main(args) -> bool:
+    limits = httpx.Limits(max_connections=args.max_in_flight, max_keepalive_connections=args.max_in_flight)
+    if args.base_url:
+        async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=60) as client:
+            return await run(client, args)
+    async with offline_client(limits) as client:
+        return await run(client, args)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--rate", type=float, default=100, help="new users per second")
+    parser.add_argument("--base-url", help="run against a live server, e.g. http://localhost:8000")
+    parser.add_argument("--max-in-flight", type=int, default=500, help="cap on concurrently active users")
+    parser.add_argument("--max-p99-ms", type=float, help="fail when any endpoint's p99 exceeds this")
+    parser.add_argument("--seed", type=int, help="seed arrivals and client addresses for repeatable runs")
+    args = parser.parse_args()
+    if args.seed is not None:
+        random.seed(args.seed)
+    sys.exit(0 if asyncio.run(main(args)) else 1)
@@ -0,0 +1,67 @@
+"""
+Check that the verify lockout holds however a user id is spelled.
+
+    python -m benchmarks.lockout
+
+Runs the app in-process on SQLite and fakeredis, like benchmarks.load_test
+without --base-url. A user is provisioned and fails /verify until locked
+out; the correct code is then sent to /verify and /verify/batch with the
+same UUID spelled differently (upper case, no hyphens, braces, URN). Every
+attempt must be refused as locked out, otherwise the exit status is
+non-zero.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import uuid
+
+import httpx
+import pyotp
+
+from benchmarks.load_test import API_PREFIX, offline_client
+
+THRESHOLD = 3
+
+def spellings(user_id: uuid.UUID) -> list:
+    return [str(user_id).upper(), user_id.hex, f"{{{user_id}}}", user_id.urn]
+
+async def check(client: httpx.AsyncClient) -> list:
+    failures = []
+    user_id = uuid.uuid4()
+    provision = (await client.post(f"{API_PREFIX}/provision", json={"user_id": str(user_id), "qr_format": "none"})).json()
+    totp = pyotp.TOTP(provision["secret_base32"])
+    await client.post(f"{API_PREFIX}/verify-setup", json={"provision_token": provision["provision_token"], "code": totp.now()})
+
+    wrong = "000000" if totp.now() != "000000" else "111111"
+    for _ in range(THRESHOLD):
+        await client.post(f"{API_PREFIX}/verify", json={"user_id": str(user_id), "code": wrong})
+    response = await client.post(f"{API_PREFIX}/verify", json={"user_id": str(user_id), "code": totp.now()})
+    if response.status_code != 429:
+        failures.append(f"canonical id not locked out: {response.status_code} {response.text[:200]}")
+
+    for spelling in spellings(user_id):
+        response = await client.post(f"{API_PREFIX}/verify", json={"user_id": spelling, "code": totp.now()})
+        if response.status_code != 429:
+            failures.append(f"/verify {spelling}: {response.status_code} {response.text[:200]}")
+        response = await client.post(f"{API_PREFIX}/verify/batch", json={"items": [{"user_id": spelling, "code": totp.now()}]})
+        result = response.json()["results"][0] if response.status_code == 200 else None
+        if result is None or result["error"] != "Too many failed attempts":
+            failures.append(f"/verify/batch {spelling}: {response.status_code} {response.text[:200]}")
+    return failures
+
+async def main() -> int:
+    # Enough per-user budget that the lockout, not the rate limit, refuses the attempts
+    os.environ["LOCKOUT_THRESHOLD"] = str(THRESHOLD)
+    os.environ["VERIFY_RATE_LIMIT_USER"] = "1000"
+    async with offline_client(httpx.Limits()) as client:
+        failures = await check(client)
+    for failure in failures:
+        print(f"FAIL  {failure}")
+    if not failures:
+        print(f"locked out under every spelling ({len(spellings(uuid.uuid4()))} checked on /verify and /verify/batch)")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    argparse.ArgumentParser(description=__doc__.strip().splitlines()[0]).parse_args()
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,137 @@
+"""
+Event-loop latency under mixed CPU load, inline versus on the CPU executor.
+
+    python -m benchmarks.loop_latency [--duration 5] [--clients 8]
+                                      [--executor thread] [--workers 2]
+                                      [--kdf-ms 0] [--max-p99-ms MS]
+
+A ticker sleeps 1 ms at a time and records how late it wakes while
+--clients tasks loop over the heavy operations of the service layer: QR
+renders, 500-item decrypt and TOTP batches, backup code hashing, and
+single verifies. The mix runs once with everything called inline on the
+loop, then once through a CPUExecutor configured like the service one.
+Lag percentiles and operations per second are printed for both; the exit
+status is non-zero when the executor run's p99 lag is over --max-p99-ms.
+--kdf-ms stands in for a slow backup code KDF: PBKDF2 tuned to take about
+that long per code.
+"""
+import argparse
+import asyncio
+import hashlib
+import statistics
+import sys
+import time
+from typing import List
+
+from app.core.config import settings
+from app.services.backup_codes import backup_code_service, hash_codes
+from app.services.cpu_executor import CPUExecutor
+from app.services.encryption import decrypt_many, encryption_service
+from app.services.qr import render_qr
+from app.services.totp import totp_service
+
+BATCH_SIZE = 500
+TICK = 0.001
+
+def kdf_codes(codes: List[str], iterations: int) -> List[str]:
+    """Module level so process pools can run it"""
+    return [hashlib.pbkdf2_hmac("sha256", code.encode(), b"benchmark", iterations).hex() for code in codes]
+
+def kdf_iterations(target_ms: float) -> int:
+    started = time.perf_counter()
+    hashlib.pbkdf2_hmac("sha256", b"calibrate", b"benchmark", 100_000)
+    per_iteration = (time.perf_counter() - started) / 100_000
+    return max(int(target_ms / 1000 / per_iteration), 1)
+
+def build_operations(kdf_ms: float) -> list:
+    """
+    (name, items, func, args, picklable) in the proportions of a busy worker;
+    items is None for work the services always offload, as they do QR
+    rendering and backup code hashing
+    """
+    secret = totp_service.generate_secret()
+    key = totp_service.load_key(secret)
+    uri = totp_service.get_totp_uri(secret, "user@example.com", "CustomAuthenticator")
+    ciphertexts = [encryption_service.encrypt(totp_service.generate_secret().encode()) for _ in range(BATCH_SIZE)]
+    pairs = [(totp_service.load_key(totp_service.generate_secret()), "123456") for _ in range(BATCH_SIZE)]
+    codes = [backup_code_service.generate_code() for _ in range(backup_code_service.count)]
+    if kdf_ms > 0:
+        hashing = ("backup_code_hash", None, kdf_codes, (codes, kdf_iterations(kdf_ms)), True)
+    else:
+        hashing = ("backup_code_hash", None, hash_codes, (codes,), True)
+    single = ("totp_verify", 1, totp_service.verify_key, (key, "123456"), False)
+    return [
+        ("qr_render", None, render_qr, (uri, "svg"), True),
+        single, single, single,
+        ("decrypt_batch", BATCH_SIZE, decrypt_many, (ciphertexts,), True),
+        single, single, single,
+        ("totp_verify_batch", BATCH_SIZE, totp_service.verify_codes_batch, (pairs,), False),
+        hashing,
+    ]
+
+async def run_mix(operations: list, clients: int, duration: float, executor) -> dict:
+    lags: List[float] = []
+    done = 0
+    deadline = time.perf_counter() + duration
+
+    async def ticker():
+        while time.perf_counter() < deadline:
+            before = time.perf_counter()
+            await asyncio.sleep(TICK)
+            lags.append(time.perf_counter() - before - TICK)
+
+    async def client(offset: int):
+        nonlocal done
+        index = offset
+        while time.perf_counter() < deadline:
+            name, items, func, args, picklable = operations[index % len(operations)]
+            index += 1
+            if executor is None:
+                func(*args)
+            elif items is None:
+                await executor.run(name, func, *args)
+            else:
+                await executor.run_batch(name, items, func, *args, picklable=picklable)
+            done += 1
+            await asyncio.sleep(0)
+
+    await asyncio.gather(ticker(), *(client(offset) for offset in range(clients)))
+    lags.sort()
+    return {
+        "ops_per_second": done / duration,
+        "p50_ms": lags[len(lags) // 2] * 1000,
+        "p99_ms": lags[int(len(lags) * 0.99)] * 1000,
+        "max_ms": lags[-1] * 1000,
+        "mean_ms": statistics.fmean(lags) * 1000,
+    }
+
+async def main(args) -> int:
+    operations = build_operations(args.kdf_ms)
+    executor = CPUExecutor(args.executor, args.workers, settings.CPU_EXECUTOR_MAX_QUEUE, settings.CPU_OFFLOAD_MIN_ITEMS)
+    await executor.warm()
+
+    print(f"{args.clients} clients for {args.duration:.0f}s each, {args.executor} pool of {args.workers}"
+          f"{f', {args.kdf_ms:.0f} ms KDF' if args.kdf_ms else ''}\n")
+    print(f"{'mode':<10}{'ops/s':>10}{'lag p50':>12}{'lag p99':>12}{'lag max':>12}")
+    results = {}
+    for mode, pool in (("inline", None), ("executor", executor)):
+        results[mode] = result = await run_mix(operations, args.clients, args.duration, pool)
+        print(f"{mode:<10}{result['ops_per_second']:>10.0f}{result['p50_ms']:>9.2f} ms"
+              f"{result['p99_ms']:>9.2f} ms{result['max_ms']:>9.2f} ms")
+    executor.shutdown(wait=True)
+
+    p99 = results["executor"]["p99_ms"]
+    if args.max_p99_ms is not None and p99 > args.max_p99_ms:
+        print(f"\nFAIL  executor p99 loop lag {p99:.2f} ms is over {args.max_p99_ms:.2f} ms")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per mode")
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--executor", choices=("thread", "process"), default=settings.CPU_EXECUTOR)
+    parser.add_argument("--workers", type=int, default=settings.CPU_EXECUTOR_WORKERS)
+    parser.add_argument("--kdf-ms", type=float, default=0.0, help="simulate a backup code KDF this slow per code")
+    parser.add_argument("--max-p99-ms", type=float, help="fail when the executor run's p99 loop lag is over this")
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,151 @@
+"""
+Per-call cost of the services layer, compared against a stored baseline.
+
+    python -m benchmarks.micro [--filter NAME] [--threshold 0.3] [--retries 2]
+                               [--baseline FILE] [--save-baseline]
+
+Each case is timed with timeit: autorange picks the loop count, the best of
+--repeat runs is kept, and results are reported per call. With a baseline
+(benchmarks/baseline/micro.json by default) every case is compared to it
+and the exit status is non-zero when one is slower by more than
+--threshold, or when the baseline and the cases no longer list the same
+names. A case over the threshold is measured up to --retries more times
+and keeps its best time, so one noisy run does not fail the gate. Baselines are machine specific; record them with
+--save-baseline on the machine that runs the comparison.
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+import uuid
+from collections import namedtuple
+from datetime import datetime
+
+from app.schemas import auth as schemas
+from app.services.audit import AUTH_EVENT_COLUMNS
+from app.services.encryption import encryption_service
+from app.services.qr import render_qr
+from app.services.totp import totp_service
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline", "micro.json")
+
+def build_cases() -> dict:
+    """name -> zero-argument callable, with inputs shaped like production traffic"""
+    secret = totp_service.generate_secret()
+    key = totp_service.load_key(secret)
+    code = "123456"
+    batch = [(totp_service.load_key(totp_service.generate_secret()), code) for _ in range(100)]
+    plaintext = secret.encode()
+    ciphertext = encryption_service.encrypt(plaintext)
+    ciphertexts = [encryption_service.encrypt(totp_service.generate_secret().encode()) for _ in range(100)]
+    uri = totp_service.get_totp_uri(secret, "user@example.com", "CustomAuthenticator")
+
+    verify_payload = {"user_id": str(uuid.uuid4()), "code": code, "client_ip": "10.0.0.1"}
+    verify_json = json.dumps(verify_payload)
+    batch_payload = {"items": [{"user_id": str(uuid.uuid4()), "code": code} for _ in range(100)]}
+    provision_response = schemas.AuthenticatorProvisionResponse(
+        secret_base32=secret,
+        otpauth_uri=uri,
+        qr_svg=render_qr(uri, "svg"),
+        provision_token=str(uuid.uuid4()),
+        expires_at=datetime.utcnow(),
+    )
+
+    # Attribute access like the Core rows the audit endpoint selects
+    AuditRow = namedtuple("AuditRow", AUTH_EVENT_COLUMNS)
+    events = [
+        AuditRow(
+            id=uuid.uuid4(),
+            user_id=uuid.uuid4(),
+            authenticator_id=uuid.uuid4(),
+            event_type="verify_success",
+            detail={"authenticator_id": str(uuid.uuid4())},
+            ip_address="10.0.0.1",
+            created_at=datetime.utcnow(),
+        )
+        for _ in range(50)
+    ]
+
+    return {
+        "totp.verify_code": lambda: totp_service.verify_code(secret, code),
+        "totp.verify_key": lambda: totp_service.verify_key(key, code),
+        "totp.verify_codes_batch[100]": lambda: totp_service.verify_codes_batch(batch),
+        "encryption.encrypt": lambda: encryption_service.encrypt(plaintext),
+        "encryption.decrypt": lambda: encryption_service.decrypt(ciphertext),
+        "encryption.decrypt_many[100]": lambda: encryption_service.decrypt_many(ciphertexts),
+        "qr.generate_qr_code": lambda: totp_service.generate_qr_code(uri),
+        "qr.render[svg-compact]": lambda: render_qr(uri, "svg-compact"),
+        "qr.render[png]": lambda: render_qr(uri, "png"),
+        "schemas.VerifyRequest.validate": lambda: schemas.VerifyRequest.model_validate(verify_payload),
+        "schemas.VerifyRequest.validate_json": lambda: schemas.VerifyRequest.model_validate_json(verify_json),
+        "schemas.BatchVerifyRequest.validate[100]": lambda: schemas.BatchVerifyRequest.model_validate(batch_payload),
+        "schemas.ProvisionResponse.dump_json": lambda: provision_response.model_dump_json(),
+        "schemas.AuditLogPage.dump_json[50]": lambda: schemas.AuditLogPage.model_validate({"items": events, "next_cursor": None}).model_dump_json(),
+    }
+
+def measure(func, repeat: int) -> float:
+    """Best per-call time in seconds"""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+def format_time(seconds: float) -> str:
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:8.2f} {unit}"
+    return f"{seconds / 1e-9:8.2f} ns"
+
+def main(args) -> int:
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, encoding="utf-8") as handle:
+            baseline = json.load(handle)["results"]
+
+    results = {}
+    regressions = []
+    for name, func in build_cases().items():
+        if args.filter and args.filter not in name:
+            continue
+        results[name] = measure(func, args.repeat)
+        for _ in range(args.retries if name in baseline else 0):
+            if results[name] / baseline[name] - 1 <= args.threshold:
+                break
+            results[name] = min(results[name], measure(func, args.repeat))
+        line = f"{name:<44}{format_time(results[name])}"
+        if name in baseline:
+            change = results[name] / baseline[name] - 1
+            line += f"   {change:+7.1%} vs baseline"
+            if change > args.threshold:
+                regressions.append(name)
+                line += "  REGRESSION"
+        print(line)
+
+    # A stale baseline silently skips new cases; make it fail instead
+    stale = [] if args.filter or not baseline else sorted(set(baseline) ^ set(results))
+    for name in stale:
+        print(f"{name:<44}{'not in baseline' if name in results else 'in baseline only'}")
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as handle:
+            json.dump({"python": sys.version.split()[0], "results": results}, handle, indent=2, sort_keys=True)
+            handle.write("\n")
+        print(f"\nbaseline written to {args.baseline}")
+    elif regressions:
+        print(f"\n{len(regressions)} case(s) slower than baseline by more than {args.threshold:.0%}")
+        return 1
+    elif stale:
+        print(f"\n{len(stale)} case(s) out of sync with the baseline; record it again with --save-baseline")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--filter", help="only run cases whose name contains this")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--threshold", type=float, default=0.3, help="allowed slowdown, as a fraction")
+    parser.add_argument("--retries", type=int, default=2, help="re-measure a case over the threshold this many times")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="record this run as the new baseline")
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,101 @@
+"""
+Check that a SIGTERM shuts the server down cleanly while an audit stream is open.
+
+    python -m benchmarks.shutdown [--timeout 10] [--delay 1]
+
+Starts uvicorn in a subprocess on SQLite and fakeredis (see
+benchmarks.load_test) with SHUTDOWN_DELAY_SECONDS=--delay, opens
+/admin/audit/stream, then sends SIGTERM. The server must close the stream
+at once, answer /readyz with 503 "draining" during the delay, then run the
+lifespan shutdown and exit within --timeout seconds, otherwise the exit
+status is non-zero.
+"""
+import argparse
+import asyncio
+import os
+import signal
+import socket
+import sys
+import time
+
+import httpx
+
+from benchmarks.load_test import API_PREFIX, offline_app
+
+async def serve(port: int):
+    import uvicorn
+
+    async with offline_app() as application:
+        await uvicorn.Server(uvicorn.Config(application, host="127.0.0.1", port=port, log_level="info")).serve()
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+async def wait_ready(client: httpx.AsyncClient, process, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline and process.returncode is None:
+        try:
+            if (await client.get("/readyz")).status_code == 200:
+                return True
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    return False
+
+async def check(timeout: float, delay: float) -> list:
+    port = free_port()
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, "-m", "benchmarks.shutdown", "--serve", str(port),
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT,
+        env={**os.environ, "SHUTDOWN_DELAY_SECONDS": str(delay)},
+    )
+    output = asyncio.ensure_future(process.stdout.read())
+    failures = []
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=timeout) as client:
+            if not await wait_ready(client, process):
+                return ["server did not become ready"]
+            async with client.stream("GET", f"{API_PREFIX}/admin/audit/stream") as stream:
+                if stream.status_code != 200:
+                    return [f"stream answered {stream.status_code}"]
+                signalled = time.monotonic()
+                process.send_signal(signal.SIGTERM)
+                try:
+                    await asyncio.wait_for(stream.aread(), timeout)
+                except (asyncio.TimeoutError, httpx.TransportError):
+                    failures.append("stream was not closed by the server")
+            if delay > 0:
+                response = await client.get("/readyz")
+                if response.status_code != 503 or response.json().get("status") != "draining":
+                    failures.append(f"/readyz during the delay: {response.status_code} {response.text[:200]}")
+        try:
+            await asyncio.wait_for(process.wait(), max(timeout - (time.monotonic() - signalled), 0.1))
+            print(f"exited {process.returncode} {time.monotonic() - signalled:.1f}s after SIGTERM")
+        except asyncio.TimeoutError:
+            failures.append(f"server still running {timeout:.0f}s after SIGTERM")
+    finally:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+    log = (await output).decode(errors="replace")
+    if "Application shutdown complete" not in log:
+        failures.append("lifespan shutdown did not complete")
+    if failures:
+        print(log)
+    return failures
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--timeout", type=float, default=10.0, help="seconds allowed from SIGTERM to exit")
+    parser.add_argument("--delay", type=float, default=1.0, help="SHUTDOWN_DELAY_SECONDS for the server")
+    parser.add_argument("--serve", type=int, metavar="PORT", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        asyncio.run(serve(args.serve))
+        sys.exit(0)
+    failures = asyncio.run(check(args.timeout, args.delay))
+    for failure in failures:
+        print(f"FAIL  {failure}")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,90 @@
+"""
+Check the TOTP engine against RFC 6238 and time it against pyotp.
+
+    python -m benchmarks.totp [--number 20000]
+
+The RFC 6238 appendix B vectors (SHA-1, SHA-256 and SHA-512, 8 digits) are
+checked first, then other digit counts and periods against pyotp; any
+mismatch exits non-zero before timing starts. A +/-1 window verify is then
+timed for pyotp, TOTPService.verify_code (Base32 secret in, default
+algorithm only) and TOTPService.verify_key with a key loaded once, as the
+secret cache holds it.
+"""
+import argparse
+import base64
+import hashlib
+import sys
+import timeit
+
+import pyotp
+
+from app.services.totp import ALGORITHMS, TOTPKey, totp_service
+
+RFC_SEEDS = {
+    "sha1": b"12345678901234567890",
+    "sha256": b"12345678901234567890123456789012",
+    "sha512": b"1234567890123456789012345678901234567890123456789012345678901234",
+}
+RFC_VECTORS = [
+    # time, sha1, sha256, sha512
+    (59, "94287082", "46119246", "90693936"),
+    (1111111109, "07081804", "68084774", "25091201"),
+    (1111111111, "14050471", "67062674", "99943326"),
+    (1234567890, "89005924", "91819424", "93441116"),
+    (2000000000, "69279037", "90698825", "38618901"),
+    (20000000000, "65353130", "77737706", "47863826"),
+]
+MALFORMED_CODES = ("", "12345", "1234567", "12345a", " 12345", "１２３４５６")
+
+def conformance() -> int:
+    failures = []
+    for at, *expected in RFC_VECTORS:
+        for (algorithm, seed), code in zip(RFC_SEEDS.items(), expected):
+            key = TOTPKey(seed, algorithm, digits=8)
+            if key.code(at) != code or not totp_service.verify_key(key, code, valid_window=0, for_time=at):
+                failures.append(f"rfc6238 {algorithm} t={at}: got {key.code(at)}, want {code}")
+
+    secret = totp_service.generate_secret()
+    for algorithm in ALGORITHMS:
+        for digits, period in ((6, 30), (8, 30), (6, 60), (8, 15)):
+            reference = pyotp.TOTP(secret, digits=digits, interval=period, digest=getattr(hashlib, algorithm))
+            key = totp_service.load_key(secret, algorithm, digits, period)
+            for at in (0, 59, 1111111109, 2000000000):
+                if key.code(at) != reference.at(at):
+                    failures.append(f"pyotp {algorithm} digits={digits} period={period} t={at}")
+
+    key = totp_service.load_key(secret)
+    failures.extend(f"accepted malformed code {code!r}" for code in MALFORMED_CODES if totp_service.verify_key(key, code))
+
+    for failure in failures:
+        print(f"FAIL  {failure}")
+    print(f"conformance: {len(failures)} failure(s)\n")
+    return len(failures)
+
+def main(number: int) -> int:
+    if conformance():
+        return 1
+
+    for algorithm, digits in (("sha1", 6), ("sha256", 8), ("sha512", 8)):
+        secret = base64.b32encode(RFC_SEEDS[algorithm]).decode()
+        digest = getattr(hashlib, algorithm)
+        key = totp_service.load_key(secret, algorithm, digits)
+        code = key.code()
+        cases = {"pyotp TOTP.verify": lambda: pyotp.TOTP(secret, digits=digits, digest=digest).verify(code, valid_window=1)}
+        if algorithm == totp_service.algorithm and digits == totp_service.digits:
+            cases["TOTPService.verify_code"] = lambda: totp_service.verify_code(secret, code)
+        cases["TOTPService.verify_key"] = lambda: totp_service.verify_key(key, code)
+
+        print(f"{algorithm}, {digits} digits, +/-1 window")
+        reference = None
+        for name, func in cases.items():
+            seconds = min(timeit.repeat(func, number=number, repeat=5)) / number
+            reference = reference or seconds
+            print(f"  {name:<28}{seconds * 1e6:9.2f} us   {reference / seconds:5.1f}x")
+        print()
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--number", type=int, default=20000, help="calls per timing run")
+    sys.exit(main(parser.parse_args().number))
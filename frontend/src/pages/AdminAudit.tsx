@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import api from '../api/client';
 
 interface AuthEvent {
@@ -10,19 +10,50 @@ interface AuthEvent {
     detail: any;
 }
 
+interface AuditPage {
+    items: AuthEvent[];
+    next_cursor: string | null;
+}
+
+// Rows kept on screen while live; older ones are still reachable via Refresh
+const LIVE_MAX_ROWS = 500;
+
+const EVENT_TYPES = [
+    'provision_init',
+    'provision_complete',
+    'verify_success',
+    'verify_fail',
+    'backup_used',
+    'disabled',
+];
+
 const AdminAudit: React.FC = () => {
     const [events, setEvents] = useState<AuthEvent[]>([]);
     const [userId, setUserId] = useState('');
+    const [eventType, setEventType] = useState('');
+    const [nextCursor, setNextCursor] = useState<string | null>(null);
     const [loading, setLoading] = useState(false);
+    const [live, setLive] = useState(false);
+    const [missed, setMissed] = useState(0);
+    const streamRef = useRef<EventSource | null>(null);
+
+    const filterParams = () => {
+        const params: any = {};
+        if (userId) params.user_id = userId;
+        if (eventType) params.event_type = eventType;
+        return params;
+    };
 
-    const fetchEvents = async () => {
+    // cursor === undefined starts over from the newest event
+    const fetchEvents = async (cursor?: string) => {
         setLoading(true);
         try {
-            const params: any = { limit: 50 };
-            if (userId) params.user_id = userId;
+            const params: any = { ...filterParams(), limit: 50 };
+            if (cursor) params.cursor = cursor;
 
-            const response = await api.get('/admin/audit', { params });
-            setEvents(response.data);
+            const response = await api.get<AuditPage>('/authenticator/admin/audit', { params });
+            setEvents((prev) => (cursor ? [...prev, ...response.data.items] : response.data.items));
+            setNextCursor(response.data.next_cursor);
         } catch (err) {
             console.error('Failed to fetch events', err);
         } finally {
@@ -30,8 +61,36 @@ const AdminAudit: React.FC = () => {
         }
     };
 
+    const exportUrl = (format: 'ndjson' | 'csv') => {
+        const query = new URLSearchParams({ ...filterParams(), format }).toString();
+        return `${api.defaults.baseURL}/authenticator/admin/audit/export?${query}`;
+    };
+
+    const stopLive = () => {
+        streamRef.current?.close();
+        streamRef.current = null;
+        setLive(false);
+    };
+
+    // New events are pushed by the server instead of polling /admin/audit
+    const startLive = () => {
+        const query = new URLSearchParams(filterParams()).toString();
+        const source = new EventSource(`${api.defaults.baseURL}/authenticator/admin/audit/stream?${query}`);
+        source.addEventListener('audit', (message) => {
+            const event: AuthEvent = JSON.parse((message as MessageEvent).data);
+            setEvents((prev) => [event, ...prev].slice(0, LIVE_MAX_ROWS));
+        });
+        source.addEventListener('overflow', (message) => {
+            setMissed((prev) => prev + JSON.parse((message as MessageEvent).data).dropped);
+        });
+        streamRef.current = source;
+        setMissed(0);
+        setLive(true);
+    };
+
     useEffect(() => {
         fetchEvents();
+        return () => streamRef.current?.close();
     }, []);
 
     return (
@@ -46,15 +105,45 @@ const AdminAudit: React.FC = () => {
                         placeholder="Filter by User ID"
                         className="shadow appearance-none border rounded py-2 px-3 text-gray-700 leading-tight focus:outline-none focus:shadow-outline"
                     />
+                    <select
+                        value={eventType}
+                        onChange={(e) => setEventType(e.target.value)}
+                        className="shadow border rounded py-2 px-3 text-gray-700 leading-tight focus:outline-none focus:shadow-outline"
+                    >
+                        <option value="">All events</option>
+                        {EVENT_TYPES.map((type) => (
+                            <option key={type} value={type}>
+                                {type}
+                            </option>
+                        ))}
+                    </select>
                     <button
-                        onClick={fetchEvents}
+                        onClick={() => fetchEvents()}
                         className="bg-gray-500 hover:bg-gray-700 text-white font-bold py-2 px-4 rounded focus:outline-none focus:shadow-outline"
                     >
                         Refresh
                     </button>
+                    <button
+                        onClick={() => (live ? stopLive() : startLive())}
+                        className={`${live ? 'bg-green-600 hover:bg-green-800' : 'bg-gray-500 hover:bg-gray-700'} text-white font-bold py-2 px-4 rounded focus:outline-none focus:shadow-outline`}
+                    >
+                        {live ? 'Live' : 'Go live'}
+                    </button>
+                    <a
+                        href={exportUrl('csv')}
+                        className="bg-white hover:bg-gray-100 text-gray-700 font-bold py-2 px-4 border rounded focus:outline-none focus:shadow-outline"
+                    >
+                        Export CSV
+                    </a>
                 </div>
             </div>
 
+            {missed > 0 && (
+                <div className="mb-4 text-sm text-yellow-800 bg-yellow-100 rounded p-2">
+                    {missed} events were skipped while the view was behind; Refresh to see them.
+                </div>
+            )}
+
             <div className="overflow-x-auto">
                 <table className="min-w-full leading-normal">
                     <thead>
@@ -77,7 +166,7 @@ const AdminAudit: React.FC = () => {
                         </tr>
                     </thead>
                     <tbody>
-                        {loading ? (
+                        {loading && events.length === 0 ? (
                             <tr>
                                 <td colSpan={5} className="px-5 py-5 border-b border-gray-200 bg-white text-sm text-center">
                                     Loading...
@@ -118,6 +207,18 @@ const AdminAudit: React.FC = () => {
                     </tbody>
                 </table>
             </div>
+
+            {nextCursor && (
+                <div className="flex justify-center mt-4">
+                    <button
+                        onClick={() => fetchEvents(nextCursor)}
+                        disabled={loading}
+                        className="bg-gray-500 hover:bg-gray-700 text-white font-bold py-2 px-4 rounded focus:outline-none focus:shadow-outline disabled:opacity-50"
+                    >
+                        {loading ? 'Loading...' : 'Load more'}
+                    </button>
+                </div>
+            )}
         </div>
     );
 };